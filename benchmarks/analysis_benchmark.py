@@ -0,0 +1,274 @@
+"""
+Бенчмарк конвейера анализа на синтетической нагрузке, без Trino и LLM.
+
+Генератор строит реалистичный TaskRequest: хабы и линки Data Vault, широкие таблицы и запросы
+с частыми JOIN, CROSS JOIN, фильтрами в HAVING вместо WHERE и SELECT * по широким таблицам.
+Часть запросов отличается только литералами, как повторяющиеся запуски в реальном журнале.
+Trino заменен заглушкой, которая на любой EXPLAIN возвращает заранее заготовленный JSON-план.
+
+Для каждого размера нагрузки измеряются пропускная способность (запросов в секунду) и пиковая память
+(tracemalloc, отдельным проходом) для perform_global_analysis, каждого детектора (на всех шаблонах
+нагрузки) и сборки промпта _build_pattern_prompt. Кэши разбора SQL сбрасываются перед каждым замером.
+Результат можно сохранить (--save) и сравнить с предыдущим запуском (--compare): падение пропускной
+способности или рост памяти больше --tolerance считается регрессией, и скрипт завершается с кодом 1.
+
+Запуск: python -m benchmarks.analysis_benchmark [--sizes 100,1000,10000,100000] [--seed 42]
+        [--save results.json] [--compare results.json] [--tolerance 0.1] [--explain auto|always]
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from optimizer_service.agent.optimization_agent import OptimizationAgent
+from optimizer_service.core.config import settings
+from optimizer_service.data_analyzer import query_parser
+from optimizer_service.data_analyzer.analysis_module import AnalysisModule
+from optimizer_service.data_analyzer.deduplication import build_query_templates
+from optimizer_service.data_analyzer.query_parser import build_ddl_map
+from optimizer_service.data_analyzer.workload_stats import WorkloadStats
+from optimizer_service.models.schemas import TaskRequest
+from optimizer_service.patterns.dispatcher import pattern_dispatcher
+
+HUBS = ["author", "book", "publisher", "customer", "store", "order", "genre", "country"]
+WIDE_TABLES = 4
+WIDE_COLUMNS = 60
+
+CANNED_EXPLAIN_PLAN = json.dumps({
+    "0": {"id": "6", "name": "Output", "descriptor": {"columnNames": "[name, _col1]"},
+          "estimates": [{"outputRowCount": 1000.0, "outputSizeInBytes": 24000.0, "cpuCost": 2.4e6,
+                         "memoryCost": 0.0, "networkCost": 0.0}],
+          "children": [{"id": "7", "name": "RemoteSource", "children": []}]},
+    "1": {"id": "3", "name": "Aggregate", "descriptor": {"type": "FINAL", "keys": "[name]"},
+          "estimates": [{"outputRowCount": 1000.0, "outputSizeInBytes": 24000.0, "cpuCost": 1.2e7,
+                         "memoryCost": 24000.0, "networkCost": 0.0}],
+          "children": [{"id": "0", "name": "ScanFilterProject",
+                        "descriptor": {"table": "quests:public.h_author$data@1"},
+                        "estimates": [{"outputRowCount": 1.0e6, "outputSizeInBytes": 3.1e7, "cpuCost": 3.1e7,
+                                       "memoryCost": 0.0, "networkCost": 0.0}],
+                        "children": []}]},
+})
+
+
+class CannedTrinoConnector:
+    """Заглушка TrinoConnector: соединения из «пула» отвечают на EXPLAIN заготовленным планом."""
+    target = "benchmark:0/quests/public"
+
+    class _Cursor:
+        def execute(self, sql: str):
+            pass
+
+        def fetchone(self):
+            return (CANNED_EXPLAIN_PLAN,)
+
+    class _Connection:
+        def cursor(self):
+            return CannedTrinoConnector._Cursor()
+
+    @contextmanager
+    def connection(self, **kwargs):
+        yield self._Connection()
+
+
+def generate_ddl() -> List[str]:
+    ddl = []
+    for hub in HUBS:
+        ddl.append(f"CREATE TABLE quests.public.h_{hub} (id int, {hub}_key varchar, name varchar, "
+                   f"load_dt timestamp(3), record_source varchar, dt date)")
+    for left, right in zip(HUBS, HUBS[1:] + HUBS[:1]):
+        ddl.append(f"CREATE TABLE quests.public.l_{left}_{right} ({left}_id int, {right}_id int, "
+                   f"load_dt timestamp(3), record_source varchar)")
+    for i in range(WIDE_TABLES):
+        columns = ", ".join(f"col_{j} {'int' if j % 3 else 'varchar'}" for j in range(WIDE_COLUMNS))
+        ddl.append(f"CREATE TABLE quests.public.wide_{i} (id int, dt date, {columns})")
+    return ddl
+
+
+def _hub_link_join(rnd: random.Random, literal: int) -> str:
+    index = rnd.randrange(len(HUBS))
+    left, right = HUBS[index], HUBS[(index + 1) % len(HUBS)]
+    return (f"SELECT h.name, count(*) AS cnt FROM quests.public.h_{left} h "
+            f"JOIN quests.public.l_{left}_{right} l ON h.id = l.{left}_id "
+            f"JOIN quests.public.h_{right} r ON r.id = l.{right}_id "
+            f"WHERE h.dt > DATE '2024-01-01' AND r.id > {literal} GROUP BY h.name")
+
+
+def _cross_join(rnd: random.Random, literal: int) -> str:
+    left, right = rnd.sample(HUBS, 2)
+    return (f"SELECT a.name, b.name FROM quests.public.h_{left} a CROSS JOIN quests.public.h_{right} b "
+            f"WHERE a.id = {literal}")
+
+
+def _having_misuse(rnd: random.Random, literal: int) -> str:
+    hub = rnd.choice(HUBS)
+    return (f"SELECT name, count(*) FROM quests.public.h_{hub} GROUP BY name "
+            f"HAVING name = 'name_{literal}'")
+
+
+def _wide_select_star(rnd: random.Random, literal: int) -> str:
+    return f"SELECT * FROM quests.public.wide_{rnd.randrange(WIDE_TABLES)} WHERE id = {literal}"
+
+
+def _wide_projection(rnd: random.Random, literal: int) -> str:
+    table = rnd.randrange(WIDE_TABLES)
+    columns = ", ".join(f"col_{j}" for j in sorted(rnd.sample(range(WIDE_COLUMNS), rnd.randint(2, 8))))
+    return f"SELECT {columns} FROM quests.public.wide_{table} WHERE dt = DATE '2024-0{literal % 9 + 1}-01'"
+
+
+QUERY_SHAPES = [(_hub_link_join, 40), (_wide_projection, 25), (_cross_join, 10), (_having_misuse, 15),
+                (_wide_select_star, 10)]
+
+
+def generate_workload(size: int, seed: int = 42) -> TaskRequest:
+    """Синтетическая задача из size запросов; примерно каждый четвертый — повтор шаблона с другим литералом."""
+    rnd = random.Random(seed)
+    shapes, weights = zip(*QUERY_SHAPES)
+    queries = []
+    for i in range(size):
+        shape = rnd.choices(shapes, weights)[0]
+        queries.append({
+            "queryid": f"q{i}",
+            "query": shape(rnd, rnd.randrange(1000)),
+            "runquantity": int(rnd.paretovariate(1.2) * 10),
+            "executiontime": max(1, int(rnd.lognormvariate(2, 1.5))),
+        })
+    return TaskRequest(url="jdbc:trino://benchmark:443", ddl=[{"statement": s} for s in generate_ddl()],
+                       queries=queries)
+
+
+@contextlib.contextmanager
+def _quiet():
+    """
+    Вывод измеряемого кода (print и предупреждения логов без настроенных обработчиков)
+    уходит в /dev/null: он не должен влиять ни на время, ни на память.
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        yield
+
+
+def _reset_caches():
+    for cached in (query_parser.parse_query, query_parser.normalize_sql,
+                   query_parser.query_fingerprint, query_parser.parse_ddl):
+        cached.cache_clear()
+
+
+def measure(fn: Callable[[], object], items: int, memory: bool = True) -> Dict[str, Optional[float]]:
+    """Замер времени и (отдельным проходом) пиковой памяти."""
+    with _quiet():
+        _reset_caches()
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - started
+        peak_mb = None
+        if memory:
+            _reset_caches()
+            gc.collect()
+            tracemalloc.start()
+            try:
+                fn()
+                peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            finally:
+                tracemalloc.stop()
+    return {
+        "seconds": round(seconds, 4),
+        "throughput": round(items / seconds, 1) if seconds else None,
+        "peak_mb": round(peak_mb, 2) if peak_mb is not None else None,
+    }
+
+
+def run_suite(sizes: List[int], seed: int, memory: bool = True) -> Dict[str, Dict[str, dict]]:
+    results: Dict[str, Dict[str, dict]] = {}
+    connector = CannedTrinoConnector()
+    for size in sizes:
+        task = generate_workload(size, seed)
+        analyzer = AnalysisModule(connector=connector)
+        agent = OptimizationAgent(llm_provider=None, analyzer=analyzer)
+        size_results = results.setdefault(str(size), {})
+
+        size_results["perform_global_analysis"] = measure(lambda: analyzer.perform_global_analysis(task), size, memory)
+
+        with _quiet():
+            report = analyzer.perform_global_analysis(task)
+            ddl_map = build_ddl_map(ddl.statement for ddl in task.ddl)
+            templates = build_query_templates(task.queries, deduplicate=settings.QUERY_DEDUPLICATION)
+            profiled = analyzer._profile_queries(templates, ddl_map)
+            stats = WorkloadStats()
+            for template in templates:
+                stats.observe(template.query)
+
+        for detector in analyzer._detectors:
+            name = f"detector:{detector.__class__.__name__}"
+            size_results[name] = measure(lambda: detector.run(profiled, ddl_map, stats), len(profiled), memory)
+
+        detector_name = report.top_detection.detector_name if report.top_detection else "JoinPatternDetector"
+        example = pattern_dispatcher.get_pattern(detector_name)["solution_template"]
+        size_results["_build_pattern_prompt"] = measure(
+            lambda: agent._build_pattern_prompt(report, task, example), 1, memory)
+    return results
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Регрессии: пропускная способность упала или пиковая память выросла больше чем на tolerance."""
+    regressions = []
+    for size, stages in current.items():
+        for stage, result in stages.items():
+            previous = baseline.get(size, {}).get(stage)
+            if not previous:
+                continue
+            if previous.get("throughput") and result["throughput"] is not None \
+                    and result["throughput"] < previous["throughput"] * (1 - tolerance):
+                regressions.append(f"{size} {stage}: пропускная способность {previous['throughput']} -> "
+                                   f"{result['throughput']} запросов/с")
+            if previous.get("peak_mb") and result["peak_mb"] is not None \
+                    and result["peak_mb"] > previous["peak_mb"] * (1 + tolerance):
+                regressions.append(f"{size} {stage}: пиковая память {previous['peak_mb']} -> {result['peak_mb']} МБ")
+    return regressions
+
+
+def print_results(results: dict):
+    print(f"{'size':>8}  {'stage':<48}{'seconds':>10}{'items/s':>12}{'peak_MB':>10}")
+    for size, stages in results.items():
+        for stage, r in stages.items():
+            peak = "-" if r["peak_mb"] is None else r["peak_mb"]
+            print(f"{size:>8}  {stage:<48}{r['seconds']:>10}{r['throughput']:>12}{peak:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000,100000")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--explain", choices=("auto", "always"), default=settings.EXPLAIN_MODE,
+                        help="always — профилировать каждый шаблон через заглушку EXPLAIN")
+    parser.add_argument("--no-memory", action="store_true", help="не делать проход с tracemalloc")
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON предыдущего запуска для поиска регрессий")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    settings.EXPLAIN_MODE = args.explain
+    results = run_suite([int(size) for size in args.sizes.split(",")], args.seed, memory=not args.no_memory)
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"РЕГРЕССИЯ: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("Регрессий не обнаружено.")
+
+
+if __name__ == "__main__":
+    main()
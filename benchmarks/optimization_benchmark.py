@@ -0,0 +1,323 @@
+"""
+Бенчмарк «до/после» для готового результата оптимизации.
+
+Берет исходную задачу (тело запроса /new) и результат (ответ /getresult), многократно выполняет
+исходные и переписанные запросы и сравнивает их по queryid: перцентили задержки, процессорное время
+и объем прочитанных данных. Ускорение считается по медиане задержки.
+
+Движки:
+  trino  — кластер из --url (по умолчанию URL задачи). Статистика берется из статистики запроса Trino.
+           С --apply перед замером применяются ddl и migrations результата; с --sandbox-schema
+           новые таблицы создаются в указанной схеме (catalog.schema), а после замера удаляются.
+  duckdb — локальная замена для офлайн-CI: DDL задачи и все запросы транспилируются sqlglot в диалект
+           DuckDB, исходные таблицы заполняются синтетическими строками (--rows), ddl и migrations
+           результата применяются всегда. Процессорное время — время процесса, объем чтения не измеряется.
+
+Запуск: python -m benchmarks.optimization_benchmark --task task.json --result result.json
+        [--engine trino|duckdb] [--repeat 5] [--warmup 1] [--rows 10000] [--json report.json]
+"""
+import argparse
+import json
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+import sqlglot
+from sqlglot import exp
+
+from optimizer_service.data_analyzer.trino_connector import TrinoConnector
+from optimizer_service.models.schemas import OptimizationResult, TaskRequest
+
+
+@dataclass
+class RunStats:
+    """Показатели одного выполнения запроса; None — движок такой показатель не сообщает."""
+    latency_ms: float
+    cpu_ms: Optional[float] = None
+    bytes_read: Optional[float] = None
+
+
+@dataclass
+class QueryBenchmark:
+    queryid: str
+    baseline: List[RunStats] = field(default_factory=list)
+    optimized: List[RunStats] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Перцентиль методом ближайшего ранга."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(runs: List[RunStats]) -> Dict[str, Optional[float]]:
+    latencies = [run.latency_ms for run in runs]
+    cpu = [run.cpu_ms for run in runs if run.cpu_ms is not None]
+    read = [run.bytes_read for run in runs if run.bytes_read is not None]
+    return {
+        "runs": len(runs),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "cpu_ms": sum(cpu) / len(cpu) if cpu else None,
+        "bytes_read": sum(read) / len(read) if read else None,
+    }
+
+
+def _new_tables(result: OptimizationResult) -> List[exp.Table]:
+    tables = []
+    for item in result.ddl:
+        ast = sqlglot.parse_one(item["statement"], read="trino")
+        if isinstance(ast, exp.Create) and ast.kind == "TABLE":
+            tables.append(ast.this.this if isinstance(ast.this, exp.Schema) else ast.this)
+    return tables
+
+
+class TrinoEngine:
+    """Выполняет запросы в Trino; задержка и ресурсы — из статистики запроса (cursor.stats)."""
+
+    def __init__(self, jdbc_url: str, apply: bool = False, sandbox_schema: Optional[str] = None):
+        self._conn = TrinoConnector(jdbc_url).connect(request_timeout=600)
+        self._apply = apply or sandbox_schema is not None
+        self._sandbox = exp.to_table(f"{sandbox_schema}._", dialect="trino") if sandbox_schema else None
+        self._renames: Dict[str, exp.Table] = {}
+
+    def prepare(self, task: TaskRequest, result: OptimizationResult):
+        if not self._apply:
+            return
+        if self._sandbox is not None:
+            for table in _new_tables(result):
+                self._renames[exp.table_name(table)] = exp.Table(
+                    this=table.this.copy(), db=self._sandbox.args["db"].copy(),
+                    catalog=self._sandbox.args["catalog"].copy())
+        for item in result.ddl + result.migrations:
+            ast = sqlglot.parse_one(item["statement"], read="trino")
+            if self._sandbox is not None and isinstance(ast, exp.Create) and ast.kind == "SCHEMA":
+                continue
+            self.execute(item["statement"])
+
+    def rewrite(self, sql: str) -> str:
+        if not self._renames:
+            return sql
+
+        def replace(node):
+            if isinstance(node, exp.Table) and exp.table_name(node) in self._renames:
+                renamed = self._renames[exp.table_name(node)].copy()
+                renamed.set("alias", node.args.get("alias"))
+                return renamed
+            return node
+
+        return sqlglot.parse_one(sql, read="trino").transform(replace).sql(dialect="trino")
+
+    def execute(self, sql: str):
+        cursor = self._conn.cursor()
+        cursor.execute(self.rewrite(sql).strip().rstrip(";"))
+        cursor.fetchall()
+
+    def run(self, sql: str) -> RunStats:
+        cursor = self._conn.cursor()
+        started = time.perf_counter()
+        cursor.execute(self.rewrite(sql).strip().rstrip(";"))
+        cursor.fetchall()
+        latency_ms = (time.perf_counter() - started) * 1000
+        stats = cursor.stats or {}
+        return RunStats(
+            latency_ms=stats.get("elapsedTimeMillis") or latency_ms,
+            cpu_ms=stats.get("cpuTimeMillis"),
+            bytes_read=stats.get("physicalInputBytes") or stats.get("processedBytes"),
+        )
+
+    def close(self):
+        for table in self._renames.values():
+            try:
+                self._conn.cursor().execute(f"DROP TABLE IF EXISTS {table.sql(dialect='trino')}")
+            except Exception as e:
+                print(f"Не удалось удалить таблицу песочницы {table.sql(dialect='trino')}: {e}")
+        self._conn.close()
+
+
+class DuckDBEngine:
+    """Локальный движок для офлайн-замеров: SQL из диалекта Trino транспилируется в DuckDB."""
+
+    _GENERATORS = {
+        exp.DataType.Type.DATE: "DATE '2024-01-01' + CAST(i % 365 AS INTEGER)",
+        exp.DataType.Type.TIMESTAMP: "TIMESTAMP '2024-01-01 00:00:00' + to_seconds(i % 86400)",
+        exp.DataType.Type.BOOLEAN: "i % 2 = 0",
+    }
+
+    def __init__(self, rows: int = 10000):
+        try:
+            import duckdb
+        except ImportError:
+            raise RuntimeError("Для движка duckdb установите пакет: pip install duckdb")
+        self._conn = duckdb.connect()
+        self._rows = rows
+        self._catalogs = set()
+        self._schemas = set()
+
+    @staticmethod
+    def _transpile(ast: exp.Expression) -> str:
+        return ast.sql(dialect="duckdb")
+
+    def _ensure_namespace(self, table: exp.Table):
+        """Каталоги Trino представляются подключенными in-memory базами DuckDB."""
+        if table.catalog and table.catalog not in self._catalogs:
+            self._conn.execute(f"ATTACH ':memory:' AS {table.catalog}")
+            self._catalogs.add(table.catalog)
+        if table.db and (table.catalog, table.db) not in self._schemas:
+            self._conn.execute(f"CREATE SCHEMA IF NOT EXISTS {'.'.join(p for p in (table.catalog, table.db) if p)}")
+            self._schemas.add((table.catalog, table.db))
+
+    def _create(self, sql: str) -> Optional[exp.Schema]:
+        ast = sqlglot.parse_one(sql, read="trino")
+        if not (isinstance(ast, exp.Create) and ast.kind == "TABLE"):
+            if isinstance(ast, exp.Create) and ast.kind == "SCHEMA":
+                return None
+            self._conn.execute(self._transpile(ast))
+            return None
+        # Свойства хранения Trino (format, partitioning, ...) в DuckDB не имеют смысла
+        ast.set("properties", None)
+        target = ast.this.this if isinstance(ast.this, exp.Schema) else ast.this
+        self._ensure_namespace(target)
+        self._conn.execute(self._transpile(ast))
+        return ast.this if isinstance(ast.this, exp.Schema) else None
+
+    def _fill(self, schema: exp.Schema):
+        values = []
+        for index, col_def in enumerate(e for e in schema.expressions if isinstance(e, exp.ColumnDef)):
+            kind = col_def.kind
+            if kind is None:
+                values.append("NULL")
+            elif kind.is_type(*exp.DataType.NUMERIC_TYPES):
+                values.append(f"CAST((i * {index + 7}) % 1000 AS {kind.sql(dialect='duckdb')})")
+            elif kind.is_type(*exp.DataType.TEXT_TYPES):
+                values.append(f"'v' || CAST((i * {index + 3}) % 100 AS VARCHAR)")
+            elif kind.this in self._GENERATORS:
+                values.append(self._GENERATORS[kind.this])
+            else:
+                values.append(f"CAST(NULL AS {kind.sql(dialect='duckdb')})")
+        table = schema.this.sql(dialect="duckdb")
+        self._conn.execute(f"INSERT INTO {table} SELECT {', '.join(values)} FROM range({self._rows}) AS t(i)")
+
+    def prepare(self, task: TaskRequest, result: OptimizationResult):
+        for ddl in task.ddl:
+            schema = self._create(ddl.statement)
+            if schema is not None:
+                self._fill(schema)
+        for item in result.ddl:
+            self._create(item["statement"])
+        for item in result.migrations:
+            self.execute(item["statement"])
+
+    def execute(self, sql: str):
+        self._conn.execute(self._transpile(sqlglot.parse_one(sql, read="trino")))
+
+    def run(self, sql: str) -> RunStats:
+        statement = self._transpile(sqlglot.parse_one(sql, read="trino"))
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        self._conn.execute(statement).fetchall()
+        return RunStats(
+            latency_ms=(time.perf_counter() - started) * 1000,
+            cpu_ms=(time.process_time() - cpu_started) * 1000,
+        )
+
+    def close(self):
+        self._conn.close()
+
+
+def run_benchmark(engine, task: TaskRequest, result: OptimizationResult,
+                  repeat: int = 5, warmup: int = 1) -> List[QueryBenchmark]:
+    """Выполняет пары (исходный, переписанный) запрос по queryid; прогревочные запуски не учитываются."""
+    originals = {query.queryid: query.query for query in task.queries}
+    engine.prepare(task, result)
+    benchmarks = []
+    for item in result.queries:
+        queryid = item.get("queryid")
+        bench = QueryBenchmark(queryid=queryid)
+        benchmarks.append(bench)
+        if queryid not in originals:
+            bench.error = "нет исходного запроса с таким queryid"
+            continue
+        try:
+            for attempt in range(warmup + repeat):
+                # Чередование исходного и переписанного запроса уравнивает влияние кэшей движка
+                baseline, optimized = engine.run(originals[queryid]), engine.run(item["query"])
+                if attempt >= warmup:
+                    bench.baseline.append(baseline)
+                    bench.optimized.append(optimized)
+        except Exception as e:
+            bench.error = str(e)
+    return benchmarks
+
+
+def build_report(benchmarks: Iterable[QueryBenchmark]) -> List[dict]:
+    report = []
+    for bench in benchmarks:
+        baseline, optimized = summarize(bench.baseline), summarize(bench.optimized)
+        speedup = None
+        if baseline["p50_ms"] and optimized["p50_ms"]:
+            speedup = baseline["p50_ms"] / optimized["p50_ms"]
+        report.append({"queryid": bench.queryid, "baseline": baseline, "optimized": optimized,
+                       "speedup": speedup, "error": bench.error})
+    return report
+
+
+def _fmt(value: Optional[float], digits: int = 1) -> str:
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_report(report: List[dict]):
+    print(f"{'queryid':<24}{'base_p50':>10}{'opt_p50':>10}{'base_p95':>10}{'opt_p95':>10}"
+          f"{'base_cpu':>10}{'opt_cpu':>10}{'base_MB':>9}{'opt_MB':>9}{'speedup':>9}")
+    for row in report:
+        if row["error"]:
+            print(f"{row['queryid']:<24}ошибка: {row['error']}")
+            continue
+        b, o = row["baseline"], row["optimized"]
+        mb = lambda value: None if value is None else value / 1024 ** 2
+        print(f"{row['queryid']:<24}{_fmt(b['p50_ms']):>10}{_fmt(o['p50_ms']):>10}{_fmt(b['p95_ms']):>10}"
+              f"{_fmt(o['p95_ms']):>10}{_fmt(b['cpu_ms']):>10}{_fmt(o['cpu_ms']):>10}"
+              f"{_fmt(mb(b['bytes_read'])):>9}{_fmt(mb(o['bytes_read'])):>9}{_fmt(row['speedup'], 2):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--task", required=True, help="JSON исходной задачи (тело запроса /new)")
+    parser.add_argument("--result", required=True, help="JSON результата (ответ /getresult)")
+    parser.add_argument("--engine", choices=("trino", "duckdb"), default="trino")
+    parser.add_argument("--url", help="JDBC URL Trino; по умолчанию URL из задачи")
+    parser.add_argument("--apply", action="store_true", help="применить ddl и migrations результата в Trino")
+    parser.add_argument("--sandbox-schema", help="catalog.schema для новых таблиц (подразумевает --apply)")
+    parser.add_argument("--rows", type=int, default=10000, help="строк в каждой исходной таблице (duckdb)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--json", help="сохранить отчет в файл")
+    args = parser.parse_args()
+
+    with open(args.task, encoding="utf-8") as f:
+        task = TaskRequest(**json.load(f))
+    with open(args.result, encoding="utf-8") as f:
+        result = OptimizationResult(**json.load(f))
+
+    if args.engine == "duckdb":
+        engine = DuckDBEngine(rows=args.rows)
+    else:
+        engine = TrinoEngine(args.url or task.url, apply=args.apply, sandbox_schema=args.sandbox_schema)
+    try:
+        report = build_report(run_benchmark(engine, task, result, repeat=args.repeat, warmup=args.warmup))
+    finally:
+        engine.close()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
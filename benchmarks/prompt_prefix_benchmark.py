@@ -0,0 +1,143 @@
+"""
+Бенчмарк переиспользования префикса промпта (prefix caching в vLLM / llama.cpp).
+
+Моделирует поток задач с одним и тем же детектором, по одной генерации и две попытки исправления на задачу,
+и считает, сколько токенов каждого промпта сервер модели может взять из KV-кэша (общий префикс
+с уже обработанными промптами), а сколько ему придется считать заново (prefill).
+Сравниваются прежняя раскладка (MEGA_PROMPT_V4 + исправление, встраивающее весь исходный промпт)
+и текущая (неизменяемое системное сообщение + контекст задачи + исправления репликами диалога).
+
+Запуск: python -m benchmarks.prompt_prefix_benchmark [--tasks 20] [--block-tokens 16]
+"""
+import argparse
+import json
+import os
+from typing import List
+
+from optimizer_service.agent.optimization_agent import OptimizationAgent
+from optimizer_service.agent.prompt_builder import PromptBuilder, estimate_tokens
+from optimizer_service.core.config import settings
+from optimizer_service.llm.base_provider import render_prompt
+from optimizer_service.llm.prompts import MEGA_PROMPT_V4_TEMPLATE
+from optimizer_service.models.schemas import GlobalAnalysisReport, ProfiledQuery
+from optimizer_service.patterns.dispatcher import pattern_dispatcher
+
+# Шаблон исправления до перехода на реплики диалога: исходный промпт встраивался после собственного заголовка
+LEGACY_CORRECTION_PROMPT_TEMPLATE = """
+Ты — ведущий дата-архитектор. Твоя предыдущая попытка сгенерировать SQL-код провалила автоматическую валидацию.
+
+# ИСХОДНЫЙ КОНТЕКСТ И ЗАДАЧА
+{original_prompt}
+
+# ОШИБКА ВАЛИДАЦИИ
+Твой сгенерированный SQL-код был проверен, и вот какая ошибка возникла:
+- **Ошибочный SQL:** `{failing_sql}`
+- **Сообщение об ошибке:** `{error_message}`
+
+# НОВАЯ ЗАДАЧА
+Пожалуйста, исправь эту ошибку, сохранив общую логику оптимизации. 
+Перегенерируй ПОЛНЫЙ JSON-ответ в правильном формате.
+
+Твой ответ должен содержать ТОЛЬКО JSON-объект и ничего больше.
+"""
+
+DETECTOR_NAME = "JoinPatternDetector"
+FAILING_SQL = "INSERT INTO quests.optimized.fact SELECT a.id, b.title FROM quests.public.h_author a"
+ERROR_MESSAGE = "line 1:42: Column 'b.title' cannot be resolved"
+
+
+def make_task(i: int):
+    ddl = [
+        f"CREATE TABLE quests.public.author_{i} (id int, name varchar, country varchar, dt date)",
+        f"CREATE TABLE quests.public.book_{i} (id int, author_id int, title varchar, price double)",
+    ]
+    queries = [
+        ProfiledQuery(
+            queryid=f"task{i}-q{j}",
+            sql=f"SELECT a.name, b.title FROM quests.public.author_{i} a "
+                f"JOIN quests.public.book_{i} b ON a.id = b.author_id WHERE b.price > {j * 10}",
+            run_quantity=100 - j, execution_time=10.0, cost=(100 - j) * 10.0,
+        )
+        for j in range(5)
+    ]
+    summary = (f"Detected 5 issues. Most critical: frequent JOIN of quests.public.author_{i} "
+               f"and quests.public.book_{i} across the whole workload.")
+    return GlobalAnalysisReport(top_cost_queries=queries, analysis_summary=summary), ddl
+
+
+def legacy_prompts(report: GlobalAnalysisReport, ddl: List[str], example: dict) -> List[str]:
+    top_queries_context = "\n---\n".join(
+        f"{i + 1}. Query ID: {q.queryid}\n   Cost: {int(q.cost)}\n   SQL: {q.sql}"
+        for i, q in enumerate(report.top_cost_queries)
+    )
+    initial = MEGA_PROMPT_V4_TEMPLATE.format(
+        analysis_summary=report.analysis_summary,
+        example_solution=json.dumps(example, indent=2),
+        top_n=len(report.top_cost_queries),
+        top_queries_context=top_queries_context,
+        ddl_context="\n".join(ddl) + "\n",
+        highest_cost_query_id=report.top_cost_queries[0].queryid,
+    )
+    correction = LEGACY_CORRECTION_PROMPT_TEMPLATE.format(
+        original_prompt=initial, failing_sql=FAILING_SQL, error_message=ERROR_MESSAGE)
+    return [initial, correction, correction]
+
+
+def current_prompts(report: GlobalAnalysisReport, ddl: List[str], example: dict) -> List[str]:
+    builder = PromptBuilder(token_budget=settings.PROMPT_TOKEN_BUDGET, chars_per_token=settings.PROMPT_CHARS_PER_TOKEN)
+    initial, _ = builder.build(report, ddl, example)
+    previous_answer = {"ddl": [], "migrations": [{"statement": FAILING_SQL}], "queries": []}
+    correction = OptimizationAgent._build_correction_prompt(initial, previous_answer, FAILING_SQL, ERROR_MESSAGE)
+    return [render_prompt(initial), render_prompt(correction), render_prompt(correction)]
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    return len(os.path.commonprefix([a, b]))
+
+
+def simulate(prompts: List[str], block_tokens: int) -> dict:
+    """Считает токены, которые можно взять из кэша префиксов (с точностью до блока KV-кэша)."""
+    chars_per_token = settings.PROMPT_CHARS_PER_TOKEN
+    seen: List[str] = []
+    total_tokens = cached_tokens = 0
+    for prompt in prompts:
+        prompt_tokens = estimate_tokens(prompt, chars_per_token)
+        shared_chars = max((common_prefix_length(prompt, previous) for previous in seen), default=0)
+        shared_tokens = int(shared_chars / chars_per_token) // block_tokens * block_tokens
+        total_tokens += prompt_tokens
+        cached_tokens += min(shared_tokens, prompt_tokens)
+        seen.append(prompt)
+    return {
+        "prompts": len(prompts),
+        "prompt_tokens": total_tokens,
+        "cached_tokens": cached_tokens,
+        "prefill_tokens": total_tokens - cached_tokens,
+        "cache_hit_ratio": round(cached_tokens / total_tokens, 3) if total_tokens else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--block-tokens", type=int, default=16, help="размер блока KV-кэша в токенах")
+    args = parser.parse_args()
+
+    example = pattern_dispatcher.get_pattern(DETECTOR_NAME)["solution_template"]
+    tasks = [make_task(i) for i in range(args.tasks)]
+    results = {
+        "legacy": simulate([p for report, ddl in tasks for p in legacy_prompts(report, ddl, example)],
+                           args.block_tokens),
+        "current": simulate([p for report, ddl in tasks for p in current_prompts(report, ddl, example)],
+                            args.block_tokens),
+    }
+
+    print(f"{'layout':<10}{'prompts':>9}{'prompt_tok':>12}{'cached_tok':>12}{'prefill_tok':>13}{'hit_ratio':>11}")
+    for name, r in results.items():
+        print(f"{name:<10}{r['prompts']:>9}{r['prompt_tokens']:>12}{r['cached_tokens']:>12}"
+              f"{r['prefill_tokens']:>13}{r['cache_hit_ratio']:>11}")
+    saved = 1 - results["current"]["prefill_tokens"] / results["legacy"]["prefill_tokens"]
+    print(f"Prefill tokens saved: {saved:.1%}")
+
+
+if __name__ == "__main__":
+    main()
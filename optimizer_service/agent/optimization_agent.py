@@ -1,43 +1,40 @@
+import asyncio
 import json
+import logging
 import time
-import sqlglot
-
-from optimizer_service.llm import BaseLLMProvider
+from contextlib import aclosing
+from typing import List, Optional, Tuple
+
+from optimizer_service.core.config import settings
+from optimizer_service.core.observability import RETRIES, span
+from optimizer_service.agent.prompt_builder import PromptBuilder
+from optimizer_service.llm import BaseLLMProvider, Prompt
+from optimizer_service.llm.base_provider import as_messages
+from optimizer_service.llm.async_runtime import run_sync
+from optimizer_service.llm.streaming_json import IncrementalJSONParser
 from optimizer_service.models.schemas import TaskRequest, GlobalAnalysisReport
-from optimizer_service.llm.prompts import MEGA_PROMPT_V2_TEMPLATE, MEGA_PROMPT_V3_TEMPLATE, MEGA_PROMPT_V4_TEMPLATE
+from optimizer_service.llm.prompts import CORRECTION_FOLLOWUP_TEMPLATE
 from optimizer_service.data_analyzer.analysis_module import AnalysisModule
 from optimizer_service.patterns.dispatcher import pattern_dispatcher
 
-MAX_CORRECTION_ATTEMPTS = 2
-
-CORRECTION_PROMPT_TEMPLATE = """
-Ты — ведущий дата-архитектор. Твоя предыдущая попытка сгенерировать SQL-код провалила автоматическую валидацию.
-
-# ИСХОДНЫЙ КОНТЕКСТ И ЗАДАЧА
-{original_prompt}
-
-# ОШИБКА ВАЛИДАЦИИ
-Твой сгенерированный SQL-код был проверен, и вот какая ошибка возникла:
-- **Ошибочный SQL:** `{failing_sql}`
-- **Сообщение об ошибке:** `{error_message}`
-
-# НОВАЯ ЗАДАЧА
-Пожалуйста, исправь эту ошибку, сохранив общую логику оптимизации. 
-Перегенерируй ПОЛНЫЙ JSON-ответ в правильном формате.
+logger = logging.getLogger(__name__)
 
-Твой ответ должен содержать ТОЛЬКО JSON-объект и ничего больше.
-"""
+MAX_CORRECTION_ATTEMPTS = 2
 
 class OptimizationAgent:
     def __init__(self, llm_provider: BaseLLMProvider, analyzer: AnalysisModule):
         self.llm_provider = llm_provider
         self.analyzer = analyzer
+        self.prompt_builder = PromptBuilder(
+            token_budget=settings.PROMPT_TOKEN_BUDGET,
+            chars_per_token=settings.PROMPT_CHARS_PER_TOKEN,
+        )
 
     def run_global_optimization(self, task_data: TaskRequest) -> dict:
         """
         Запускает полный пайплайн: Глобальный анализ -> Генерация -> Валидация.
         """
-        print("Агент: Начинаю глобальную оптимизацию...")
+        logger.info("Агент: Начинаю глобальную оптимизацию...")
 
         analysis_report = self.analyzer.perform_global_analysis(task_data)
 
@@ -48,92 +45,131 @@ class OptimizationAgent:
         if not pattern:
             raise ValueError(f"Не найден паттерн для детектора {analysis_report.top_detection.detector_name}")
 
-        initial_prompt = self._build_pattern_prompt(analysis_report, task_data, pattern['solution_template'])
+        with span("prompt_build", detector=analysis_report.top_detection.detector_name):
+            initial_prompt = self._build_pattern_prompt(analysis_report, task_data, pattern['solution_template'])
+
+        cached_response = self.llm_provider.get_cached_completion(initial_prompt)
+        if cached_response is not None:
+            logger.info("Агент: найден ранее провалидированный ответ LLM на этот промпт, генерация пропущена.")
+            return cached_response
+
         current_prompt = initial_prompt
+        source_ddl = [ddl.statement for ddl in task_data.ddl]
 
         for attempt in range(MAX_CORRECTION_ATTEMPTS + 1):
-            print(f"--- Попытка генерации #{attempt + 1} ---")
-            print(current_prompt)
+            logger.info("--- Попытка генерации #%d ---", attempt + 1)
+            logger.debug("Промпт:\n%s", as_messages(current_prompt)[-1]["content"])
             if attempt > 0:
+                RETRIES.labels(component="llm_correction").inc()
                 delay = 5 * attempt
-                print(f"Делаю паузу в {delay} сек. перед повторной попыткой...")
+                logger.info("Делаю паузу в %d сек. перед повторной попыткой...", delay)
                 time.sleep(delay)
 
             try:
-                llm_response = self.llm_provider.get_completion(current_prompt)
-                print(f"LLM Response: {llm_response}")
-
-                is_valid, error_msg, failing_sql = self.analyzer.validate_sql_list(
-                    ddl_statements=llm_response.get("ddl", []),
-                    migration_statements=llm_response.get("migrations", []),
-                    query_statements=llm_response.get("queries", [])
-                )
+                # В потоковом и спекулятивном режимах валидация идет по мере генерации и попадает внутрь llm_call
+                if settings.LLM_SPECULATIVE_CANDIDATES > 1:
+                    with span("llm_call", attempt=attempt + 1, mode="speculative"):
+                        llm_response, (is_valid, error_msg, failing_sql) = run_sync(
+                            self._first_valid_candidate(current_prompt, settings.LLM_SPECULATIVE_CANDIDATES,
+                                                        source_ddl)
+                        )
+                elif settings.LLM_STREAMING and self.llm_provider.supports_streaming:
+                    with span("llm_call", attempt=attempt + 1, mode="stream"):
+                        llm_response, (is_valid, error_msg, failing_sql) = run_sync(
+                            self._streamed_candidate(current_prompt, source_ddl)
+                        )
+                else:
+                    with span("llm_call", attempt=attempt + 1, mode="single"):
+                        llm_response = self.llm_provider.get_completion(current_prompt)
+                    logger.debug("LLM Response: %s", llm_response)
+                    is_valid, error_msg, failing_sql = self._validate_response(llm_response, source_ddl)
 
                 if is_valid:
-                    print("Ответ LLM прошел валидацию!")
+                    logger.info("Ответ LLM прошел валидацию!")
+                    self.llm_provider.record_validated_completion(initial_prompt, llm_response)
                     return llm_response
                 else:
-                    print("Ответ LLM не прошел валидацию. Готовлю промпт для исправления.")
-                    current_prompt = CORRECTION_PROMPT_TEMPLATE.format(
-                        original_prompt=initial_prompt,
-                        failing_sql=failing_sql,
-                        error_message=error_msg
-                    )
+                    logger.info("Ответ LLM не прошел валидацию. Готовлю промпт для исправления.")
+                    current_prompt = self._build_correction_prompt(initial_prompt, llm_response, failing_sql, error_msg)
 
             except Exception as e:
-                print(f"Ошибка на попытке #{attempt + 1}: {e}")
+                logger.warning("Ошибка на попытке #%d: %s", attempt + 1, e)
                 if attempt >= MAX_CORRECTION_ATTEMPTS:
                     raise e
 
         raise Exception("Не удалось сгенерировать валидный SQL после нескольких попыток.")
 
-    def _build_pattern_prompt(self, report: GlobalAnalysisReport, task_data: TaskRequest, example: dict) -> str:
-        """Собирает отчет и контекст в финальный "стратегический" промпт."""
-
-        top_queries_context_list = []
-        for i, q in enumerate(report.top_cost_queries):
-            context = (
-                f"{i + 1}. Query ID: {q.queryid}\n"
-                f"   Cost: {int(q.cost)}\n"
-                f"   SQL: {q.sql}"
+    async def _first_valid_candidate(self, prompt: Prompt, n: int,
+                                     source_ddl: List[str]) -> Tuple[Optional[dict], Tuple[bool, str, str]]:
+        """
+        Запрашивает n вариантов ответа одновременно и валидирует их по мере поступления.
+        Возвращает первый прошедший валидацию вариант (остальные запросы отменяются),
+        а если не прошел ни один — последний вариант с его ошибкой валидации.
+        Если модель не вернула ни одного варианта, результат считается невалидным и уходит на исправление.
+        """
+        last_candidate = (None, (False, "LLM не вернула ни одного ответа", ""))
+        async with aclosing(self.llm_provider.aiter_completions(prompt, n)) as candidates:
+            async for candidate in candidates:
+                logger.debug("LLM Response: %s", candidate)
+                validation = await asyncio.to_thread(self._validate_response, candidate, source_ddl)
+                if validation[0]:
+                    return candidate, validation
+                last_candidate = (candidate, validation)
+        return last_candidate
+
+    async def _streamed_candidate(self, prompt: Prompt,
+                                  source_ddl: List[str]) -> Tuple[Optional[dict], Tuple[bool, str, str]]:
+        """
+        Получает ответ потоком и проверяет элементы ddl/migrations/queries по мере их генерации.
+        Если элемент не проходит локальную проверку, генерация прерывается, не дожидаясь конца ответа;
+        заведомо некорректный JSON прерывает ее с MalformedLLMOutput.
+        """
+        parser = IncrementalJSONParser()
+        async with aclosing(self.llm_provider.astream_completion(prompt)) as chunks:
+            async for chunk in chunks:
+                for section, item in parser.feed(chunk):
+                    error_msg = self.analyzer.precheck_statement(section, item)
+                    if error_msg:
+                        logger.info("Элемент '%s' не прошел проверку, прерываю генерацию: %s", section, error_msg)
+                        failing_sql = item.get("query" if section == "queries" else "statement", "") \
+                            if isinstance(item, dict) else str(item)
+                        return None, (False, error_msg, failing_sql)
+                if parser.done:
+                    break
+
+        llm_response = parser.result()
+        logger.debug("LLM Response: %s", llm_response)
+        return llm_response, await asyncio.to_thread(self._validate_response, llm_response, source_ddl)
+
+    def _validate_response(self, llm_response: dict, source_ddl: List[str]) -> Tuple[bool, str, str]:
+        with span("validate") as validate_span:
+            result = self.analyzer.validate_sql_list(
+                ddl_statements=llm_response.get("ddl", []),
+                migration_statements=llm_response.get("migrations", []),
+                query_statements=llm_response.get("queries", []),
+                source_ddl=source_ddl,
             )
-            top_queries_context_list.append(context)
-        top_queries_context = "\n---\n".join(top_queries_context_list)
-
-        relevant_tables = set()
-        for q in report.top_cost_queries:
-            tables_in_query = q.tables
-            print(tables_in_query)
-            for table in tables_in_query:
-                relevant_tables.add(table)
-        print(relevant_tables)
-        ddl_context = ""
-        try:
-            all_ddl_map = {self._extract_table_name_from_ddl(ddl.statement): ddl.statement for ddl in task_data.ddl}
-        except Exception:
-            all_ddl_map = {}
-        print(all_ddl_map)
-        for table_name in relevant_tables:
-            if table_name in all_ddl_map:
-                ddl_context += all_ddl_map[table_name] + "\n"
-
-        highest_cost_query_id = report.top_cost_queries[0].queryid
-
-        example_solution_str = json.dumps(example, indent=2)
-
-        return MEGA_PROMPT_V4_TEMPLATE.format(
-            analysis_summary=report.analysis_summary,
-            example_solution=example_solution_str,
-            top_n=len(report.top_cost_queries),
-            top_queries_context=top_queries_context,
-            ddl_context=ddl_context,
-            highest_cost_query_id=highest_cost_query_id
-        )
-
-    def _extract_table_name_from_ddl(self, ddl: str) -> str:
-        """Надежная функция для извлечения имени таблицы из CREATE TABLE с помощью AST."""
-        try:
-            parsed = sqlglot.parse_one(ddl, read="trino")
-            return parsed.this.this.sql()
-        except Exception:
-            return ""
\ No newline at end of file
+            validate_span.attributes["valid"] = result[0]
+        return result
+
+    def _build_pattern_prompt(self, report: GlobalAnalysisReport, task_data: TaskRequest, example: dict) -> Prompt:
+        """Собирает отчет и контекст в финальный "стратегический" промпт в пределах бюджета токенов."""
+        prompt, sizes = self.prompt_builder.build(report, (ddl.statement for ddl in task_data.ddl), example)
+        logger.info("Размер промпта по секциям (токенов, оценка): %s", sizes)
+        return prompt
+
+    @staticmethod
+    def _build_correction_prompt(initial_prompt: Prompt, llm_response: Optional[dict], failing_sql: str,
+                                 error_message: str) -> Prompt:
+        """
+        Исправление отправляется продолжением диалога: исходные сообщения не меняются,
+        поэтому их префикс берется из кэша сервера модели, а не считается заново.
+        """
+        previous_answer = json.dumps(llm_response, ensure_ascii=False) if llm_response is not None else failing_sql
+        return as_messages(initial_prompt) + [
+            {"role": "assistant", "content": previous_answer},
+            {"role": "user", "content": CORRECTION_FOLLOWUP_TEMPLATE.format(
+                failing_sql=failing_sql,
+                error_message=error_message,
+            )},
+        ]
@@ -0,0 +1,183 @@
+import json
+import logging
+import math
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlglot import exp
+
+from optimizer_service.data_analyzer.query_parser import parse_query, build_ddl_map
+from optimizer_service.data_analyzer.static_validator import _table_key
+from optimizer_service.llm.prompts import PATTERN_SYSTEM_PROMPT_TEMPLATE, PATTERN_CONTEXT_PROMPT_TEMPLATE
+from optimizer_service.models.schemas import GlobalAnalysisReport, ParsedDDL, ParsedQuery, ProfiledQuery
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str, chars_per_token: float) -> int:
+    """Грубая оценка числа токенов без токенизатора модели."""
+    return math.ceil(len(text) / chars_per_token)
+
+
+def minify_sql(sql: str) -> str:
+    """Компактная запись запроса без комментариев и лишних пробелов."""
+    try:
+        return parse_query(sql).ast.sql(dialect="trino", comments=False)
+    except Exception:
+        return re.sub(r"\s+", " ", sql).strip()
+
+
+class PromptBuilder:
+    """
+    Собирает промпт генерации в пределах бюджета токенов.
+    Промпт — диалог из системного сообщения и контекста задачи. Системное сообщение (инструкции и эталонный
+    пример детектора) не зависит от задачи, поэтому сервер модели переиспользует его KV-кэш между задачами.
+    Запросы минифицируются, DDL сокращается до колонок, упомянутых в запросах, пример решения
+    сериализуется компактно. Если промпт все равно не помещается, из контекста убираются наименее
+    дорогие запросы (самый дорогой остается всегда). Размер каждой секции возвращается вместе с промптом.
+    """
+
+    def __init__(self, token_budget: int, chars_per_token: float):
+        self._token_budget = token_budget
+        self._chars_per_token = chars_per_token
+
+    def build(self, report: GlobalAnalysisReport, ddl_statements: Iterable[str],
+              example: dict) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        ddl_map = build_ddl_map(ddl_statements)
+        example_solution = json.dumps(example, separators=(",", ":"), ensure_ascii=False)
+        system_prompt = PATTERN_SYSTEM_PROMPT_TEMPLATE.format(example_solution=example_solution)
+        prefix_tokens = estimate_tokens(system_prompt, self._chars_per_token)
+        queries = report.top_cost_queries
+
+        for top_n in range(len(queries), 0, -1):
+            sections = {
+                "analysis_summary": report.analysis_summary,
+                "top_queries_context": self._queries_context(queries[:top_n]),
+                "ddl_context": self._ddl_context(queries[:top_n], ddl_map),
+            }
+            context_prompt = PATTERN_CONTEXT_PROMPT_TEMPLATE.format(
+                top_n=top_n,
+                highest_cost_query_id=queries[0].queryid,
+                **sections,
+            )
+            total_tokens = prefix_tokens + estimate_tokens(context_prompt, self._chars_per_token)
+            if total_tokens <= self._token_budget:
+                break
+        else:
+            logger.warning("Промпт (%d токенов) не помещается в бюджет %d даже с одним запросом. Отправляю как есть.",
+                           total_tokens, self._token_budget)
+
+        sizes = {name: estimate_tokens(text, self._chars_per_token) for name, text in sections.items()}
+        sizes["template"] = total_tokens - prefix_tokens - sum(sizes.values())
+        sizes["static_prefix"] = prefix_tokens
+        sizes["total"] = total_tokens
+        sizes["top_n"] = top_n
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": context_prompt},
+        ]
+        return messages, sizes
+
+    @staticmethod
+    def _queries_context(queries: List[ProfiledQuery]) -> str:
+        return "\n---\n".join(
+            f"{i + 1}. Query ID: {q.queryid}\n   Cost: {int(q.cost)}\n   SQL: {minify_sql(q.sql)}"
+            for i, q in enumerate(queries)
+        )
+
+    @staticmethod
+    def _ddl_context(queries: List[ProfiledQuery], ddl_map: Dict[str, ParsedDDL]) -> str:
+        ddl_by_key = {
+            _table_key(ddl.ast.this.this if isinstance(ddl.ast.this, exp.Schema) else ddl.ast.this): ddl
+            for ddl in ddl_map.values()
+        }
+        relevant_tables: Dict[str, None] = {}
+        referenced_columns: Dict[str, Set[str]] = defaultdict(set)
+        select_star_tables: Set[str] = set()
+        for q in queries:
+            try:
+                parsed = q.parsed or parse_query(q.sql)
+            except Exception:
+                continue
+            table_keys = [_table_key(table) for table in parsed.ast.find_all(exp.Table)]
+            relevant_tables.update(dict.fromkeys(table_keys))
+            for table_key, columns in PromptBuilder._columns_by_table(parsed).items():
+                referenced_columns[table_key].update(columns)
+            if parsed.has_select_star:
+                select_star_tables.update(table_keys)
+
+        statements = []
+        for table_key in relevant_tables:
+            if table_key not in ddl_by_key:
+                continue
+            keep_all = table_key in select_star_tables
+            statements.append(PromptBuilder._prune_ddl(ddl_by_key[table_key], referenced_columns[table_key], keep_all))
+        return "\n".join(statements)
+
+    @staticmethod
+    def _columns_by_table(parsed: ParsedQuery) -> Dict[str, Set[str]]:
+        """
+        Раскладывает колонки запроса по таблицам (ключ — catalog.schema.table в нижнем регистре) через их
+        квалификаторы: алиас таблицы или ее имя с любым числом частей. Одноименные таблицы из разных схем
+        различаются по алиасам и полным именам; неоднозначный квалификатор засчитывается всем подходящим таблицам.
+        Колонка без квалификатора или с квалификатором подзапроса/CTE может относиться к любой таблице запроса,
+        поэтому засчитывается им всем.
+        """
+        tables = list(parsed.ast.find_all(exp.Table))
+        qualifiers: Dict[str, Set[str]] = defaultdict(set)
+        for table in tables:
+            table_key = _table_key(table)
+            if table.alias:
+                qualifiers[table.alias.lower()].add(table_key)
+                continue
+            parts = table_key.split(".")
+            for start in range(len(parts)):
+                qualifiers[".".join(parts[start:])].add(table_key)
+
+        all_tables = {_table_key(table) for table in tables}
+        columns_by_table: Dict[str, Set[str]] = defaultdict(set)
+        for column in parsed.ast.find_all(exp.Column):
+            if not column.this:
+                continue
+            name = column.name.lower()
+            qualifier = ".".join(part for part in (column.catalog, column.db, column.table) if part).lower()
+            for target in qualifiers.get(qualifier) or all_tables:
+                columns_by_table[target].add(name)
+        return columns_by_table
+
+    @staticmethod
+    def _prune_ddl(ddl: ParsedDDL, referenced_columns: Set[str], keep_all: bool) -> str:
+        """
+        Оставляет в CREATE TABLE только колонки, которые встречаются в запросах. Остальные части схемы
+        (PRIMARY KEY, ограничения) и свойства таблицы сохраняются вместе с колонками, на которые они ссылаются.
+        """
+        schema = ddl.ast.this
+        if keep_all or not isinstance(schema, exp.Schema):
+            return ddl.ast.sql(dialect="trino", comments=False) + ";"
+
+        column_defs = [e for e in schema.expressions if isinstance(e, exp.ColumnDef)]
+        constraint_columns = {
+            identifier.name.lower()
+            for e in schema.expressions if not isinstance(e, exp.ColumnDef)
+            for identifier in e.find_all(exp.Identifier)
+        }
+        # Колонки партиционирования и сортировки задаются строками в WITH (...), например 'day(dt)'
+        properties = ddl.ast.args.get("properties")
+        if properties is not None:
+            constraint_columns.update(
+                word for literal in properties.find_all(exp.Literal) if literal.is_string
+                for word in re.findall(r"\w+", literal.this.lower())
+            )
+        required_columns = referenced_columns | constraint_columns
+        kept = [e for e in column_defs if e.this.name.lower() in required_columns] or column_defs
+        kept_ids = {id(e) for e in kept}
+        pruned = ddl.ast.copy()
+        pruned.this.set("expressions", [
+            e.copy() for e in schema.expressions if not isinstance(e, exp.ColumnDef) or id(e) in kept_ids
+        ])
+        statement = pruned.sql(dialect="trino", comments=False) + ";"
+        omitted = len(column_defs) - len(kept)
+        if omitted:
+            statement += f" -- {omitted} unused columns omitted"
+        return statement
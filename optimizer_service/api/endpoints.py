@@ -1,22 +1,84 @@
+import uuid
+import zlib
 from typing import Union
 
 import redis
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from celery.result import AsyncResult
 
+from optimizer_service.api.ndjson import iter_ndjson
 from optimizer_service.core.config import settings
+from optimizer_service.core.staging import workload_staging
+from optimizer_service.core.task_dedup import task_deduplicator
+from optimizer_service.data_analyzer.deduplication import request_digest
 from optimizer_service.models.schemas import TaskRequest, TaskResponse, TaskStatus, OptimizationResult, ErrorResponse, \
-    TaskLogsResponse
-from optimizer_service.tasks.optimization_task import run_optimization_task
+    WorkloadHeader, QueryStatement
+from optimizer_service.tasks.optimization_task import run_optimization_task, run_staged_optimization_task
 
 router = APIRouter()
 
-@router.post("/new", response_model=TaskResponse, status_code=202)
+@router.post("/new", response_model=TaskResponse, response_model_exclude_none=True, status_code=202)
 def create_task(request: TaskRequest):
     """
     Запускает новую задачу оптимизации.
+    Если идентичная задача уже выполняется, возвращается ее идентификатор,
+    а если недавно завершилась — сразу ее результат.
     """
-    task = run_optimization_task.delay(request.dict())
+    if not settings.TASK_DEDUPLICATION:
+        task = run_optimization_task.delay(request.dict())
+        return TaskResponse(taskid=task.id)
+
+    digest = request_digest(request)
+    finished = task_deduplicator.get_result(digest)
+    if finished is not None:
+        return TaskResponse(taskid=finished["taskid"], result=OptimizationResult(**finished["result"]))
+
+    task_id = str(uuid.uuid4())
+    running_task_id = task_deduplicator.claim(digest, task_id)
+    if running_task_id is not None:
+        return TaskResponse(taskid=running_task_id)
+
+    try:
+        task = run_optimization_task.apply_async(args=[request.dict()], kwargs={"digest": digest}, task_id=task_id)
+    except Exception:
+        # Иначе все идентичные отправки до истечения TTL получали бы идентификатор несуществующей задачи
+        task_deduplicator.release(digest, task_id)
+        raise
+    return TaskResponse(taskid=task.id)
+
+@router.post("/new/stream", response_model=TaskResponse, status_code=202)
+async def create_streamed_task(request: Request):
+    """
+    Запускает задачу оптимизации для большой нагрузки, загружаемой потоком NDJSON.
+    Первая строка — {"url": ..., "ddl": [...]}, каждая следующая — один QueryStatement.
+    Поддерживается сжатие gzip (заголовок Content-Encoding: gzip).
+    Записи валидируются по мере чтения и складываются в Redis, в Celery уходит только ссылка на них.
+    """
+    gzipped = request.headers.get("content-encoding", "").lower() == "gzip"
+    workload_id = None
+    line_no = 0
+    batch = []
+    try:
+        async for line_no, record in iter_ndjson(request.stream(), gzipped=gzipped):
+            if workload_id is None:
+                workload_id = await run_in_threadpool(workload_staging.create, WorkloadHeader(**record))
+                continue
+            batch.append(QueryStatement(**record))
+            if len(batch) >= settings.STAGING_BATCH_SIZE:
+                await run_in_threadpool(workload_staging.append, workload_id, batch)
+                batch = []
+        if workload_id is None:
+            raise ValueError("загрузка не содержит заголовка с url и ddl")
+        await run_in_threadpool(workload_staging.append, workload_id, batch)
+    except (ValueError, zlib.error) as e:
+        # Ошибка разбора строки возникает до того, как итератор вернул ее номер
+        line_no = getattr(e, "line_no", line_no)
+        if workload_id is not None:
+            await run_in_threadpool(workload_staging.delete, workload_id)
+        raise HTTPException(status_code=422, detail=f"Некорректная загрузка (строка {line_no}): {e}")
+
+    task = run_staged_optimization_task.delay(workload_id)
     return TaskResponse(taskid=task.id)
 
 @router.get("/status", response_model=TaskStatus)
@@ -0,0 +1,50 @@
+import json
+import zlib
+from typing import AsyncIterator, Tuple
+
+
+class NDJSONRecordError(ValueError):
+    """Строка потока не разбирается как JSON или не является объектом; line_no — ее номер."""
+
+    def __init__(self, message: str, line_no: int):
+        super().__init__(message)
+        self.line_no = line_no
+
+
+def _decode_record(line: bytes, line_no: int) -> dict:
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise NDJSONRecordError(str(e), line_no)
+    if not isinstance(record, dict):
+        raise NDJSONRecordError(f"ожидался JSON-объект, получено: {type(record).__name__}", line_no)
+    return record
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes], gzipped: bool = False) -> AsyncIterator[Tuple[int, dict]]:
+    """
+    Инкрементально декодирует поток NDJSON (при необходимости сжатый gzip).
+    Возвращает пары (номер строки, объект); пустые строки пропускаются, а строка с JSON другого типа
+    (массив, строка, число) или некорректным JSON вызывает NDJSONRecordError с номером строки.
+    В памяти держится только текущая незавершенная строка.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    buffer = b""
+    line_no = 0
+
+    async for chunk in chunks:
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield line_no, _decode_record(line, line_no)
+
+    if decompressor is not None:
+        buffer += decompressor.flush()
+    for line in buffer.split(b"\n"):
+        line_no += 1
+        if line.strip():
+            yield line_no, _decode_record(line, line_no)
@@ -0,0 +1,101 @@
+import json
+import logging
+import threading
+import time
+from typing import Any, Optional
+
+import redis
+
+from optimizer_service.core.config import settings
+from optimizer_service.core.observability import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class RedisCache:
+    """
+    Персистентный JSON-кэш поверх Redis, общий для всех процессов воркера.
+    Поддерживает TTL, вытеснение по размеру (самые давно использованные ключи удаляются первыми)
+    и счетчики попаданий/промахов. Ошибки Redis не прерывают работу: кэш деградирует до промаха.
+    """
+
+    def __init__(self, namespace: str, ttl_seconds: int, max_entries: int,
+                 redis_url: Optional[str] = None, client: Optional[redis.Redis] = None):
+        self._namespace = namespace
+        self._ttl_seconds = ttl_seconds
+        self._max_entries = max_entries
+        self._redis_url = redis_url or settings.CACHE_REDIS_URL
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    def _redis(self) -> redis.Redis:
+        with self._client_lock:
+            if self._client is None:
+                self._client = redis.Redis.from_url(
+                    self._redis_url,
+                    socket_timeout=settings.CACHE_SOCKET_TIMEOUT_SECONDS,
+                    socket_connect_timeout=settings.CACHE_SOCKET_TIMEOUT_SECONDS,
+                )
+            return self._client
+
+    def _entry_key(self, key: str) -> str:
+        return f"{self._namespace}:entry:{key}"
+
+    @property
+    def _index_key(self) -> str:
+        return f"{self._namespace}:lru"
+
+    @property
+    def _stats_key(self) -> str:
+        return f"{self._namespace}:stats"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Возвращает значение из кэша или None при промахе."""
+        try:
+            client = self._redis()
+            raw = client.get(self._entry_key(key))
+            pipe = client.pipeline()
+            if raw is None:
+                pipe.zrem(self._index_key, key)
+                pipe.hincrby(self._stats_key, "misses", 1)
+            else:
+                pipe.zadd(self._index_key, {key: time.time()})
+                pipe.hincrby(self._stats_key, "hits", 1)
+            pipe.execute()
+        except redis.RedisError as e:
+            CACHE_REQUESTS.labels(cache=self._namespace, result="error").inc()
+            logger.warning("Кэш %s недоступен: %s", self._namespace, e)
+            return None
+        CACHE_REQUESTS.labels(cache=self._namespace, result="miss" if raw is None else "hit").inc()
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any):
+        """Сохраняет значение с TTL и вытесняет самые старые записи сверх max_entries."""
+        now = time.time()
+        try:
+            client = self._redis()
+            pipe = client.pipeline()
+            pipe.set(self._entry_key(key), json.dumps(value), ex=self._ttl_seconds)
+            pipe.zadd(self._index_key, {key: now})
+            pipe.zremrangebyscore(self._index_key, 0, now - self._ttl_seconds)
+            pipe.zcard(self._index_key)
+            size = pipe.execute()[-1]
+
+            overflow = size - self._max_entries
+            if overflow > 0:
+                evicted = client.zrange(self._index_key, 0, overflow - 1)
+                pipe = client.pipeline()
+                pipe.delete(*[self._entry_key(k.decode()) for k in evicted])
+                pipe.zrem(self._index_key, *evicted)
+                pipe.hincrby(self._stats_key, "evictions", len(evicted))
+                pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Не удалось записать в кэш %s: %s", self._namespace, e)
+
+    def stats(self) -> dict:
+        """Возвращает накопленные счетчики hits/misses/evictions."""
+        try:
+            raw = self._redis().hgetall(self._stats_key)
+        except redis.RedisError:
+            return {}
+        return {k.decode(): int(v) for k, v in raw.items()}
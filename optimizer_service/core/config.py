@@ -10,4 +10,48 @@ class Settings(BaseSettings):
     VLLM_PORT: int = int(os.environ.get("VLLM_PORT", "8001"))
     LLAMA_HOST: str = os.environ.get("LLAMA_HOST", "localhost")
     LLAMA_PORT: int = int(os.environ.get("LLAMA_PORT", "8001"))
+    STAGING_TTL_SECONDS: int = int(os.environ.get("STAGING_TTL_SECONDS", str(24 * 3600)))
+    STAGING_BATCH_SIZE: int = int(os.environ.get("STAGING_BATCH_SIZE", "1000"))
+    PARSE_CACHE_SIZE: int = int(os.environ.get("PARSE_CACHE_SIZE", "4096"))
+    PROFILING_CONCURRENCY: int = int(os.environ.get("PROFILING_CONCURRENCY", "8"))
+    TRINO_POOL_SIZE: int = int(os.environ.get("TRINO_POOL_SIZE", "8"))
+    TRINO_POOL_IDLE_TIMEOUT_SECONDS: float = float(os.environ.get("TRINO_POOL_IDLE_TIMEOUT_SECONDS", "300"))
+    TRINO_POOL_HEALTHCHECK_AFTER_SECONDS: float = float(os.environ.get("TRINO_POOL_HEALTHCHECK_AFTER_SECONDS", "60"))
+    QUERY_DEDUPLICATION: bool = os.environ.get("QUERY_DEDUPLICATION", "true").lower() == "true"
+    TEMPLATE_QUERYIDS_LIMIT: int = int(os.environ.get("TEMPLATE_QUERYIDS_LIMIT", "100"))
+    TOP_N_QUERIES: int = int(os.environ.get("TOP_N_QUERIES", "5"))
+    LAZY_PROFILING: bool = os.environ.get("LAZY_PROFILING", "true").lower() == "true"
+    PRIORITIZATION_METRIC: str = os.environ.get("PRIORITIZATION_METRIC", "time")
+    LAZY_PROFILING_MARGIN: int = int(os.environ.get("LAZY_PROFILING_MARGIN", "2"))
+    ENABLED_DETECTORS: str = os.environ.get("ENABLED_DETECTORS", "")
+    DISABLED_DETECTORS: str = os.environ.get("DISABLED_DETECTORS", "")
+    EXPLAIN_MODE: str = os.environ.get("EXPLAIN_MODE", "auto")
+    EXPLAIN_ANALYZE_ENABLED: bool = os.environ.get("EXPLAIN_ANALYZE_ENABLED", "false").lower() == "true"
+    EXPLAIN_ANALYZE_SAMPLE_SIZE: int = int(os.environ.get("EXPLAIN_ANALYZE_SAMPLE_SIZE", "3"))
+    EXPLAIN_ANALYZE_CONCURRENCY: int = int(os.environ.get("EXPLAIN_ANALYZE_CONCURRENCY", "2"))
+    EXPLAIN_ANALYZE_TIMEOUT_SECONDS: int = int(os.environ.get("EXPLAIN_ANALYZE_TIMEOUT_SECONDS", "120"))
+    DETECTOR_CONCURRENCY: int = int(os.environ.get("DETECTOR_CONCURRENCY", "8"))
+    DETECTOR_TIME_BUDGET_SECONDS: float = float(os.environ.get("DETECTOR_TIME_BUDGET_SECONDS", "10"))
+    EXPLAIN_TIMEOUT_SECONDS: float = float(os.environ.get("EXPLAIN_TIMEOUT_SECONDS", "30"))
+    CACHE_REDIS_URL: str = os.environ.get("CACHE_REDIS_URL", os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+    CACHE_SOCKET_TIMEOUT_SECONDS: float = float(os.environ.get("CACHE_SOCKET_TIMEOUT_SECONDS", "2"))
+    EXPLAIN_CACHE_ENABLED: bool = os.environ.get("EXPLAIN_CACHE_ENABLED", "true").lower() == "true"
+    EXPLAIN_CACHE_TTL_SECONDS: int = int(os.environ.get("EXPLAIN_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    EXPLAIN_CACHE_MAX_ENTRIES: int = int(os.environ.get("EXPLAIN_CACHE_MAX_ENTRIES", "50000"))
+    LLM_CACHE_ENABLED: bool = os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true"
+    LLM_CACHE_TTL_SECONDS: int = int(os.environ.get("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    LLM_CACHE_MAX_ENTRIES: int = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "10000"))
+    LLM_HTTP_MAX_CONNECTIONS: int = int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", "32"))
+    LLM_HTTP_KEEPALIVE_SECONDS: float = float(os.environ.get("LLM_HTTP_KEEPALIVE_SECONDS", "60"))
+    LLM_SPECULATIVE_CANDIDATES: int = int(os.environ.get("LLM_SPECULATIVE_CANDIDATES", "1"))
+    LLM_STREAMING: bool = os.environ.get("LLM_STREAMING", "true").lower() == "true"
+    LLM_GUIDED_DECODING: bool = os.environ.get("LLM_GUIDED_DECODING", "true").lower() == "true"
+    PROMPT_TOKEN_BUDGET: int = int(os.environ.get("PROMPT_TOKEN_BUDGET", "6000"))
+    PROMPT_CHARS_PER_TOKEN: float = float(os.environ.get("PROMPT_CHARS_PER_TOKEN", "3.5"))
+    LOCAL_VALIDATION: bool = os.environ.get("LOCAL_VALIDATION", "true").lower() == "true"
+    TASK_DEDUPLICATION: bool = os.environ.get("TASK_DEDUPLICATION", "true").lower() == "true"
+    TASK_RESULT_TTL_SECONDS: int = int(os.environ.get("TASK_RESULT_TTL_SECONDS", "3600"))
+    TASK_INFLIGHT_TTL_SECONDS: int = int(os.environ.get("TASK_INFLIGHT_TTL_SECONDS", str(6 * 3600)))
+    LOG_LEVEL: str = os.environ.get("LOG_LEVEL", "INFO")
+    METRICS_COLLECT_DIRS: str = os.environ.get("METRICS_COLLECT_DIRS", os.environ.get("PROMETHEUS_MULTIPROC_DIR", ""))
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,168 @@
+import glob
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+from optimizer_service.core.config import settings
+
+logger = logging.getLogger("optimizer_service.trace")
+
+# В мультипроцессном режиме значения метрик пишутся в файлы каталога процесса; создаем его заранее
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+STAGE_SECONDS = Histogram(
+    "optimizer_stage_duration_seconds", "Длительность этапов обработки задачи",
+    ["stage", "status"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+EXPLAIN_CALLS = Counter(
+    "optimizer_explain_calls_total", "EXPLAIN-запросы, отправленные в Trino", ["kind", "status"])
+CACHE_REQUESTS = Counter(
+    "optimizer_cache_requests_total", "Обращения к кэшам (hit/miss/error)", ["cache", "result"])
+RETRIES = Counter(
+    "optimizer_retries_total", "Повторные попытки (исправления ответа LLM, повторы HTTP-запросов)", ["component"])
+LLM_TOKENS = Counter(
+    "optimizer_llm_tokens_total", "Токены промпта и ответа по данным сервера модели", ["provider", "kind"])
+LLM_REQUEST_SECONDS = Histogram(
+    "optimizer_llm_request_duration_seconds", "Длительность запросов к LLM",
+    ["provider", "mode", "status"],
+    buckets=(0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+DETECTOR_ORPHANED_THREADS = Counter(
+    "optimizer_detector_orphaned_threads_total",
+    "Потоки детекторов, которые не уложились в бюджет времени и продолжили работу в фоне", ["detector"])
+
+
+@dataclass
+class Span:
+    """Этап обработки в рамках трассы (задачи). Вложенные этапы ссылаются на родителя."""
+    name: str
+    trace_id: str
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: Optional[str] = None
+    attributes: dict = field(default_factory=dict)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def configure_logging():
+    """
+    Уровень логов сервиса задается LOG_LEVEL. Полные промпты и ответы LLM пишутся только на уровне DEBUG.
+    Если обработчики уже настроены (например, Celery), используются они.
+    """
+    logging.getLogger("optimizer_service").setLevel(settings.LOG_LEVEL.upper())
+    if not logging.getLogger().handlers:
+        logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def observe_stage(stage: str, seconds: float, status: str = "ok"):
+    STAGE_SECONDS.labels(stage=stage, status=status).observe(seconds)
+
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, **attributes) -> Iterator[Span]:
+    """
+    Открывает этап трассы: время попадает в гистограмму optimizer_stage_duration_seconds,
+    а завершение этапа с атрибутами — в лог. Трасса наследуется от текущего этапа или начинается заново.
+    """
+    parent = _current_span.get()
+    current = Span(
+        name=name,
+        trace_id=trace_id or (parent.trace_id if parent else uuid.uuid4().hex[:16]),
+        parent_id=parent.span_id if parent else None,
+        attributes=attributes,
+    )
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield current
+    except Exception:
+        status = "error"
+        raise
+    except BaseException:
+        status = "cancelled"
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        _current_span.reset(token)
+        observe_stage(name, seconds, status)
+        details = " ".join(f"{key}={value}" for key, value in current.attributes.items())
+        logger.info("span=%s trace=%s parent=%s status=%s duration_ms=%.1f %s", name, current.trace_id,
+                    current.parent_id or "-", status, seconds * 1000, details)
+
+
+@contextmanager
+def llm_request(provider: str, mode: str) -> Iterator[None]:
+    """
+    Замеряет запрос к LLM (mode: single, batch, stream) в гистограмме optimizer_llm_request_duration_seconds.
+    Прерванная агентом генерация (закрытие потока, отмена лишних вариантов) отмечается статусом cancelled.
+    """
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    except BaseException:
+        status = "cancelled"
+        raise
+    finally:
+        LLM_REQUEST_SECONDS.labels(provider=provider, mode=mode, status=status).observe(time.perf_counter() - started)
+
+
+def record_llm_tokens(provider: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    if prompt_tokens:
+        LLM_TOKENS.labels(provider=provider, kind="prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(provider=provider, kind="completion").inc(completion_tokens)
+
+
+class _SharedDirectoriesCollector:
+    """
+    Сводит метрики процессов из нескольких каталогов мультипроцессного режима в одну выборку.
+    У каждого контейнера (API, воркер) свой каталог на общем томе: PID разных контейнеров совпадают,
+    и общий каталог привел бы к записи двух процессов в один файл.
+    """
+
+    def __init__(self, paths):
+        self._paths = paths
+
+    def collect(self):
+        files = [file for path in self._paths for file in glob.glob(os.path.join(path, "*.db"))]
+        return multiprocess.MultiProcessCollector.merge(files, accumulate=True)
+
+
+def mark_process_dead():
+    """Убирает живые метрики (gauge) завершившегося процесса воркера из общего каталога мультипроцессного режима."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def metrics_payload() -> Tuple[bytes, str]:
+    """
+    Метрики в формате Prometheus. Задачи выполняются в процессах воркера Celery, поэтому при заданном
+    METRICS_COLLECT_DIRS (по умолчанию — PROMETHEUS_MULTIPROC_DIR) метрики всех процессов
+    собираются из перечисленных каталогов.
+    """
+    paths = [path.strip() for path in settings.METRICS_COLLECT_DIRS.split(",") if path.strip()]
+    if paths:
+        registry = CollectorRegistry()
+        registry.register(_SharedDirectoriesCollector(paths))
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,97 @@
+import json
+import threading
+import uuid
+from typing import Iterator, List, Optional
+
+import redis
+
+from optimizer_service.core.config import settings
+from optimizer_service.models.schemas import WorkloadHeader, QueryStatement, DDLStatement
+
+
+class StagedWorkload:
+    """
+    Нагрузка, загруженная потоком и сохраненная в Redis.
+    Повторяет интерфейс TaskRequest (url, ddl, queries), но запросы не материализуются целиком:
+    каждое обращение к queries возвращает новый генератор, читающий записи порциями.
+    """
+
+    def __init__(self, staging: "WorkloadStaging", workload_id: str, header: WorkloadHeader):
+        self._staging = staging
+        self.workload_id = workload_id
+        self.url: str = header.url
+        self.ddl: List[DDLStatement] = header.ddl
+
+    @property
+    def queries(self) -> Iterator[QueryStatement]:
+        return self._staging.iter_queries(self.workload_id)
+
+
+class WorkloadStaging:
+    """
+    Промежуточное хранилище больших нагрузок в Redis.
+    API складывает туда провалидированные записи по мере чтения запроса,
+    а через Celery передается только идентификатор нагрузки.
+    """
+
+    def __init__(self, redis_url: Optional[str] = None, client: Optional[redis.Redis] = None):
+        self._redis_url = redis_url or settings.CACHE_REDIS_URL
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    def _redis(self) -> redis.Redis:
+        with self._client_lock:
+            if self._client is None:
+                self._client = redis.Redis.from_url(self._redis_url)
+            return self._client
+
+    @staticmethod
+    def _header_key(workload_id: str) -> str:
+        return f"workload:{workload_id}:header"
+
+    @staticmethod
+    def _queries_key(workload_id: str) -> str:
+        return f"workload:{workload_id}:queries"
+
+    def create(self, header: WorkloadHeader) -> str:
+        """Создает новую нагрузку и возвращает ее идентификатор."""
+        workload_id = uuid.uuid4().hex
+        self._redis().set(self._header_key(workload_id), header.model_dump_json(),
+                          ex=settings.STAGING_TTL_SECONDS)
+        return workload_id
+
+    def append(self, workload_id: str, queries: List[QueryStatement]):
+        """Дописывает порцию провалидированных запросов в конец нагрузки."""
+        if not queries:
+            return
+        key = self._queries_key(workload_id)
+        pipe = self._redis().pipeline()
+        pipe.rpush(key, *[query.model_dump_json() for query in queries])
+        pipe.expire(key, settings.STAGING_TTL_SECONDS)
+        pipe.execute()
+
+    def load(self, workload_id: str) -> StagedWorkload:
+        """Открывает сохраненную нагрузку для чтения."""
+        raw_header = self._redis().get(self._header_key(workload_id))
+        if raw_header is None:
+            raise ValueError(f"Нагрузка {workload_id} не найдена или устарела.")
+        return StagedWorkload(self, workload_id, WorkloadHeader(**json.loads(raw_header)))
+
+    def iter_queries(self, workload_id: str) -> Iterator[QueryStatement]:
+        """Читает запросы нагрузки порциями по STAGING_BATCH_SIZE записей."""
+        key = self._queries_key(workload_id)
+        batch_size = settings.STAGING_BATCH_SIZE
+        start = 0
+        while True:
+            batch = self._redis().lrange(key, start, start + batch_size - 1)
+            for raw in batch:
+                yield QueryStatement(**json.loads(raw))
+            if len(batch) < batch_size:
+                return
+            start += batch_size
+
+    def delete(self, workload_id: str):
+        self._redis().delete(self._header_key(workload_id), self._queries_key(workload_id))
+
+
+workload_staging = WorkloadStaging()
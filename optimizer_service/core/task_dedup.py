@@ -0,0 +1,103 @@
+import json
+import logging
+import threading
+from typing import Optional
+
+import redis
+
+from optimizer_service.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TaskDeduplicator:
+    """
+    Схлопывание одинаковых задач по каноническому отпечатку запроса.
+    Пока задача выполняется, ее идентификатор хранится под отпечатком, и повторные отправки
+    получают тот же идентификатор вместо новой задачи в Celery. Успешный результат хранится
+    TASK_RESULT_TTL_SECONDS и отдается сразу. Ошибки Redis не мешают постановке задачи.
+    """
+
+    def __init__(self, redis_url: Optional[str] = None, client: Optional[redis.Redis] = None):
+        self._redis_url = redis_url or settings.CACHE_REDIS_URL
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    def _redis(self) -> redis.Redis:
+        with self._client_lock:
+            if self._client is None:
+                self._client = redis.Redis.from_url(
+                    self._redis_url,
+                    socket_timeout=settings.CACHE_SOCKET_TIMEOUT_SECONDS,
+                    socket_connect_timeout=settings.CACHE_SOCKET_TIMEOUT_SECONDS,
+                )
+            return self._client
+
+    @staticmethod
+    def _inflight_key(digest: str) -> str:
+        return f"task-digest:{digest}:inflight"
+
+    @staticmethod
+    def _result_key(digest: str) -> str:
+        return f"task-digest:{digest}:result"
+
+    def get_result(self, digest: str) -> Optional[dict]:
+        """Возвращает {"taskid": ..., "result": ...} недавно решенной задачи или None."""
+        try:
+            raw = self._redis().get(self._result_key(digest))
+        except redis.RedisError as e:
+            logger.warning("Хранилище отпечатков задач недоступно: %s", e)
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    def claim(self, digest: str, task_id: str) -> Optional[str]:
+        """
+        Атомарно закрепляет отпечаток за новой задачей.
+        Возвращает идентификатор уже выполняющейся задачи или None, если task_id стал владельцем.
+        SET NX GET (Redis 7+) проверяет и занимает ключ одной командой: между проверкой и чтением
+        ключ не может истечь, поэтому дубликат не уходит в очередь.
+        """
+        try:
+            existing = self._redis().set(self._inflight_key(digest), task_id, nx=True, get=True,
+                                         ex=settings.TASK_INFLIGHT_TTL_SECONDS)
+        except redis.RedisError as e:
+            logger.warning("Хранилище отпечатков задач недоступно: %s", e)
+            return None
+        return existing.decode() if existing is not None else None
+
+    def release(self, digest: str, task_id: str):
+        """Снимает отметку о выполнении, если задачу так и не удалось поставить в очередь."""
+        self.complete(digest, task_id, None)
+
+    def complete(self, digest: str, task_id: str, result: Optional[dict]):
+        """Сохраняет успешный результат (если он есть) и снимает отметку о выполнении."""
+        try:
+            client = self._redis()
+            if result is not None:
+                client.set(self._result_key(digest), json.dumps({"taskid": task_id, "result": result}),
+                           ex=settings.TASK_RESULT_TTL_SECONDS)
+            self._delete_if_owner(client, self._inflight_key(digest), task_id)
+        except redis.RedisError as e:
+            logger.warning("Не удалось обновить отпечаток задачи %s: %s", task_id, e)
+
+
+    @staticmethod
+    def _delete_if_owner(client: redis.Redis, key: str, task_id: str):
+        """
+        Удаляет отметку, только если она все еще принадлежит task_id. Сравнение и удаление идут под WATCH:
+        если между ними отметка истекла и ее заняла новая задача, MULTI/EXEC отменяется, и отметка
+        нового владельца остается на месте.
+        """
+        with client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != task_id.encode():
+                    return
+                pipe.multi()
+                pipe.delete(key)
+                pipe.execute()
+            except redis.WatchError:
+                logger.debug("Отметка %s сменила владельца во время снятия, оставляю ее.", key)
+
+
+task_deduplicator = TaskDeduplicator()
@@ -1,40 +1,91 @@
 import json
-from typing import List
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Iterable, Iterator
 
 import sqlglot
-from sqlglot import exp
 
+from optimizer_service.core.config import settings
+from optimizer_service.core.observability import EXPLAIN_CALLS, observe_stage, span
+from optimizer_service.data_analyzer.cte_simulation import CTESimulationPlanner, SimulatedStatement, SimulationError
+from optimizer_service.data_analyzer.deduplication import build_query_templates
+from optimizer_service.data_analyzer.detector_runner import DetectorRunner
+from optimizer_service.data_analyzer.explain_cache import ExplainPlanCache
+from optimizer_service.data_analyzer.plan_analysis import PRIORITIZATION_METRICS, analyze_plan, query_cost
+from optimizer_service.data_analyzer.query_parser import parse_query, build_ddl_map
+from optimizer_service.data_analyzer.runtime_profile import parse_explain_analyze, describe_hot_spot
+from optimizer_service.data_analyzer.static_validator import StaticSQLValidator
 from optimizer_service.data_analyzer.trino_connector import TrinoConnector
-from optimizer_service.models.schemas import ProfiledQuery, GlobalAnalysisReport, TaskRequest, DetectionResult
-from .detectors.cross_join_detector import CrossJoinDetector
-from .detectors.inefficient_agg_detector import InefficientAggregationDetector
-from .detectors.join_detector import JoinPatternDetector
-from .detectors.partitioning_detector import PartitioningCandidateDetector
-from .detectors.select_star_detector import SelectStarDetector
+from optimizer_service.data_analyzer.workload_stats import WorkloadStats, TopKQueries
+from optimizer_service.models.schemas import ProfiledQuery, GlobalAnalysisReport, TaskRequest, DetectionResult, \
+    QueryTemplate, ParsedQuery, ParsedDDL, RuntimeProfile
+from .detectors.base_detector import BasePatternDetector, DetectorInput
+from .detectors.registry import create_configured_detectors
+
+logger = logging.getLogger(__name__)
 
 
 class AnalysisModule:
-    def __init__(self, connector: TrinoConnector):
+    def __init__(self, connector: TrinoConnector, explain_cache: Optional[ExplainPlanCache] = None,
+                 detectors: Optional[List[BasePatternDetector]] = None):
         self._connector = connector
-        self._detectors = [
-            JoinPatternDetector(),
-            PartitioningCandidateDetector(),
-            CrossJoinDetector(),
-            InefficientAggregationDetector(),
-            SelectStarDetector(),
-        ]
+        self._explain_cache = explain_cache
+        self._detectors = create_configured_detectors() if detectors is None else detectors
+        self._required_inputs = frozenset().union(*(d.required_inputs for d in self._detectors))
+        if settings.PRIORITIZATION_METRIC not in PRIORITIZATION_METRICS:
+            raise ValueError(f"Неизвестная метрика приоритизации: {settings.PRIORITIZATION_METRIC}. "
+                             f"Допустимые значения: {', '.join(PRIORITIZATION_METRICS)}")
+        self._explain_enabled = (settings.EXPLAIN_MODE == "always"
+                                 or settings.PRIORITIZATION_METRIC != "time"
+                                 or bool({DetectorInput.EXPLAIN_PLAN, DetectorInput.PLAN_COSTS}
+                                         & self._required_inputs))
+        self._detector_runner = DetectorRunner(
+            max_workers=settings.DETECTOR_CONCURRENCY,
+            time_budget_seconds=settings.DETECTOR_TIME_BUDGET_SECONDS,
+        )
 
     def perform_global_analysis(self, task_data: TaskRequest) -> GlobalAnalysisReport:
-        print("Начинаю глобальный анализ с использованием детекторов...")
-
-        profiled_queries = self._profile_all_queries(task_data)
-        top_cost_queries = self._prioritize_queries(profiled_queries)
-
-        ddl_map = {sqlglot.parse_one(ddl.statement).this.this.sql(): ddl.statement for ddl in task_data.ddl}
-
-        all_detections: List[DetectionResult] = []
-        for detector in self._detectors:
-            all_detections.extend(detector.run(top_cost_queries, ddl_map))
+        logger.info("Начинаю глобальный анализ с использованием детекторов...")
+        logger.debug("Детекторы: %s, входные данные: %s, EXPLAIN: %s", [d.__class__.__name__ for d in self._detectors],
+                     sorted(self._required_inputs), self._explain_enabled)
+
+        ddl_map = {}
+        if DetectorInput.DDL in self._required_inputs or self._explain_enabled:
+            ddl_map = build_ddl_map(ddl.statement for ddl in task_data.ddl)
+
+        templates = build_query_templates(task_data.queries, deduplicate=settings.QUERY_DEDUPLICATION)
+        logger.info("Шаблонов запросов: %d из %d запросов.", len(templates), sum(t.query_count for t in templates))
+
+        workload_stats = None
+        if DetectorInput.WORKLOAD_STATS in self._required_inputs:
+            workload_stats = WorkloadStats()
+            for template in templates:
+                workload_stats.observe(template.query)
+
+        top_n = settings.TOP_N_QUERIES
+        with span("profile", templates=len(templates), explain=self._explain_enabled) as profile_span:
+            # Ленивое профилирование ранжирует по времени до EXPLAIN, поэтому с метриками плана профилируем все.
+            if settings.LAZY_PROFILING and settings.PRIORITIZATION_METRIC == "time":
+                top_cost_queries = self._profile_top_queries(templates, ddl_map, top_n)
+            else:
+                top_cost_queries = self._prioritize_queries(self._iter_profiled_queries(templates, ddl_map), top_n)
+            profile_span.attributes["top"] = len(top_cost_queries)
+
+        if self._explain_cache is not None:
+            logger.debug("Статистика кэша EXPLAIN: %s", self._explain_cache.stats())
+
+        if settings.EXPLAIN_ANALYZE_ENABLED:
+            with span("explain_analyze"):
+                self._sample_runtime_profiles(top_cost_queries)
+
+        with span("detect", detectors=len(self._detectors)) as detect_span:
+            all_detections, detector_stats = self._detector_runner.run(
+                self._detectors, top_cost_queries, ddl_map, workload_stats)
+            detect_span.attributes["detections"] = len(all_detections)
+        for run_stats in detector_stats:
+            logger.debug("Детектор %s: %s, %.1f мс, запросов %d, находок %d", run_stats.detector_name,
+                         run_stats.status, run_stats.duration_ms, run_stats.queries_examined, run_stats.result_count)
 
         sorted_detections = sorted(all_detections, key=lambda d: d.priority, reverse=True)
 
@@ -44,7 +95,8 @@ class AnalysisModule:
         return GlobalAnalysisReport(
             top_cost_queries=top_cost_queries,
             analysis_summary=analysis_summary,
-            top_detection=highest_priority_problem
+            top_detection=highest_priority_problem,
+            detector_stats=detector_stats
         )
 
     def _generate_analysis_summary(self, detections: List[DetectionResult], top_queries) -> str:
@@ -52,49 +104,181 @@ class AnalysisModule:
             return "Не удалось проанализировать запросы."
 
         if not detections:
-            return ("Глобальный анализ не выявил очевидных паттернов. "
-                    "Рекомендуется поочередная оптимизация самого дорогого запроса.")
+            summary = ("Глобальный анализ не выявил очевидных паттернов. "
+                       "Рекомендуется поочередная оптимизация самого дорогого запроса.")
+        else:
+            highest_priority_problem = detections[0]
+            summary = highest_priority_problem.message
 
-        highest_priority_problem = detections[0]
-        return highest_priority_problem.message
+        hot_spots = [
+            describe_hot_spot(query.queryid, query.runtime_profile)
+            for query in top_queries if query.runtime_profile is not None
+        ]
+        return " ".join([summary] + [spot for spot in hot_spots if spot])
 
     def _profile_all_queries(self, task_data: TaskRequest) -> List[ProfiledQuery]:
-        """Собирает EXPLAIN и метаданные для каждого запроса."""
-        results = []
-        with self._connector.connect() as conn:
-            cur = conn.cursor()
-            for query in task_data.queries:
-                try:
-                    print(f"Профилирую запрос: {query.queryid}")
-                    explain_plan = self._run_explain_with_cursor(cur, query.query)
-
-                    parsed_sql = sqlglot.parse_one(query.query, read="trino")
-                    tables = []
-                    for table in parsed_sql.find_all(exp.Table):
-                        table.set('alias', None)
-                        tables.append(table.sql())
-                    print(tables)
-                    results.append(
-                        ProfiledQuery(
-                            queryid=query.queryid,
-                            sql=query.query,
-                            run_quantity=query.runquantity,
-                            execution_time=query.executiontime,
-                            explain_plan=explain_plan,
-                            tables=tables
-                        )
-                    )
-                except Exception as e:
-                    print(f"Не удалось спрофилировать запрос {query.queryid}. Ошибка: {e}. Пропускаю.")
-        return results
-
-    def _prioritize_queries(self, queries: List[ProfiledQuery], top_n: int = 5) -> List[ProfiledQuery]:
-        """Вычисляет 'стоимость' и возвращает самые дорогие запросы."""
+        """Собирает EXPLAIN и метаданные для каждого шаблона запросов."""
+        ddl_map = build_ddl_map(ddl.statement for ddl in task_data.ddl)
+        templates = build_query_templates(task_data.queries, deduplicate=settings.QUERY_DEDUPLICATION)
+        return self._profile_queries(templates, ddl_map)
+
+    def _profile_top_queries(self, queries: List[QueryTemplate], ddl_map: Dict[str, ParsedDDL],
+                             top_n: int = 5) -> List[ProfiledQuery]:
+        """
+        Ленивое профилирование: сначала ранжирует запросы по дешевой стоимости (run_quantity * execution_time),
+        затем профилирует только кандидатов, способных попасть в топ-N, плюс запас LAZY_PROFILING_MARGIN
+        на случай упавших EXPLAIN-ов. Если запаса не хватило, профилируется следующая порция.
+        Результат совпадает с полным профилированием и последующей приоритизацией.
+        """
+        ranked = sorted(queries, key=lambda q: q.runquantity * q.executiontime, reverse=True)
+
+        profiled = []
+        position = 0
+        while len(profiled) < top_n and position < len(ranked):
+            batch = ranked[position:position + top_n - len(profiled) + settings.LAZY_PROFILING_MARGIN]
+            position += len(batch)
+            profiled.extend(self._profile_queries(batch, ddl_map))
+
+        logger.info("Ленивое профилирование: выполнено %d EXPLAIN из %d запросов.", position, len(ranked))
+        return self._prioritize_queries(profiled, top_n)
+
+    def _profile_queries(self, queries: List[QueryTemplate], ddl_map: Dict[str, ParsedDDL]) -> List[ProfiledQuery]:
+        """Профилирует переданные запросы и возвращает успешно спрофилированные в исходном порядке."""
+        return list(self._iter_profiled_queries(queries, ddl_map))
+
+    def _iter_profiled_queries(self, queries: Iterable[QueryTemplate],
+                               ddl_map: Dict[str, ParsedDDL]) -> Iterator[ProfiledQuery]:
+        """
+        Потоково профилирует запросы.
+        EXPLAIN-ы выполняются параллельно (не более PROFILING_CONCURRENCY одновременно)
+        на соединениях из пула коннектора. Запросы отправляются окнами, поэтому в памяти
+        одновременно находится ограниченное число планов. Порядок результатов совпадает с порядком запросов.
+        """
+        if not self._explain_enabled:
+            for query in queries:
+                profiled = self._profile_query(query, ddl_map)
+                if profiled is not None:
+                    yield profiled
+            return
+
+        concurrency = max(1, settings.PROFILING_CONCURRENCY)
+        window_size = concurrency * 4
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            window = []
+            for query in queries:
+                window.append(query)
+                if len(window) >= window_size:
+                    yield from self._profile_window(executor, window, ddl_map)
+                    window = []
+            yield from self._profile_window(executor, window, ddl_map)
+
+    def _profile_window(self, executor: ThreadPoolExecutor, queries: List[QueryTemplate],
+                        ddl_map: Dict[str, ParsedDDL]) -> Iterator[ProfiledQuery]:
+        for profiled in executor.map(lambda query: self._profile_query(query, ddl_map), queries):
+            if profiled is not None:
+                yield profiled
+
+    def _profile_query(self, query: QueryTemplate, ddl_map: Dict[str, ParsedDDL]) -> Optional[ProfiledQuery]:
+        """
+        Профилирует представителя шаблона запросов. EXPLAIN выполняется, только если он нужен
+        включенным детекторам (или EXPLAIN_MODE=always).
+        Возвращает None, если запрос не удалось разобрать или выполнить EXPLAIN.
+        """
+        try:
+            logger.debug("Профилирую запрос: %s", query.queryid)
+            parsed = parse_query(query.query)
+            explain_plan = self._explain(parsed, ddl_map) if self._explain_enabled else {}
+
+            return ProfiledQuery(
+                queryid=query.queryid,
+                sql=query.query,
+                run_quantity=query.runquantity,
+                execution_time=query.executiontime,
+                explain_plan=explain_plan,
+                tables=list(parsed.tables),
+                queryids=query.queryids,
+                parsed=parsed,
+                plan_profile=analyze_plan(explain_plan) if explain_plan else None,
+            )
+        except Exception as e:
+            logger.warning("Не удалось спрофилировать запрос %s. Ошибка: %s. Пропускаю.", query.queryid, e)
+            return None
+
+    def _sample_runtime_profiles(self, queries: List[ProfiledQuery]):
+        """
+        Опциональный режим: выполняет EXPLAIN ANALYZE для EXPLAIN_ANALYZE_SAMPLE_SIZE самых дорогих запросов
+        и прикрепляет к ним измеренный профиль операторов. EXPLAIN ANALYZE действительно выполняет запрос,
+        поэтому берутся только SELECT-запросы, одновременно выполняется не более EXPLAIN_ANALYZE_CONCURRENCY,
+        а время выполнения ограничено на стороне Trino свойством сессии query_max_run_time.
+        """
+        sample = [
+            query for query in queries
+            if query.parsed is not None and isinstance(query.parsed.ast, sqlglot.exp.Query)
+        ][:settings.EXPLAIN_ANALYZE_SAMPLE_SIZE]
+        if not sample:
+            return
+
+        logger.info("EXPLAIN ANALYZE для %d запросов...", len(sample))
+        with ThreadPoolExecutor(max_workers=max(1, settings.EXPLAIN_ANALYZE_CONCURRENCY)) as executor:
+            for query, profile in zip(sample, executor.map(self._explain_analyze, sample)):
+                query.runtime_profile = profile
+
+    def _explain_analyze(self, query: ProfiledQuery) -> Optional[RuntimeProfile]:
+        timeout = settings.EXPLAIN_ANALYZE_TIMEOUT_SECONDS
+        sql_query = query.sql.strip().rstrip(";")
+        try:
+            with self._connector.connection(session_properties={"query_max_run_time": f"{timeout}s"},
+                                            request_timeout=timeout + 10) as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"EXPLAIN ANALYZE {sql_query}")
+                rows = cursor.fetchall()
+        except Exception as e:
+            EXPLAIN_CALLS.labels(kind="analyze", status="error").inc()
+            logger.warning("EXPLAIN ANALYZE для запроса %s не выполнен: %s. Пропускаю.", query.queryid, e)
+            return None
+        EXPLAIN_CALLS.labels(kind="analyze", status="ok").inc()
+        return parse_explain_analyze("\n".join(str(row[0]) for row in rows))
+
+    def _prioritize_queries(self, queries: Iterable[ProfiledQuery], top_n: int = 5) -> List[ProfiledQuery]:
+        """
+        Вычисляет 'стоимость' и возвращает самые дорогие запросы.
+        Метрика задается PRIORITIZATION_METRIC: время по данным клиента или оценка из плана
+        (например, scanned_bytes — оценочный объем прочитанных данных).
+        Запросы принимаются потоком: в памяти остаются только top_n кандидатов.
+        Длительность этапа 'prioritize' считается без времени профилирования, которое идет в том же цикле.
+        """
+        top_queries = TopKQueries(top_n)
+        elapsed = 0.0
         for query in queries:
-            query.cost = query.run_quantity * query.execution_time
+            started = time.perf_counter()
+            query.cost = query_cost(query, settings.PRIORITIZATION_METRIC)
+            top_queries.push(query)
+            elapsed += time.perf_counter() - started
+        started = time.perf_counter()
+        result = top_queries.result()
+        observe_stage("prioritize", elapsed + time.perf_counter() - started)
+        return result
+
+    def _explain(self, parsed: ParsedQuery, ddl_map: Dict[str, ParsedDDL]) -> dict:
+        """Возвращает EXPLAIN-план из персистентного кэша, а при промахе выполняет EXPLAIN в Trino."""
+        cache_key = None
+        if self._explain_cache is not None:
+            cache_key = self._explain_cache.make_key(self._connector.target, parsed, ddl_map)
+            cached_plan = self._explain_cache.get(cache_key)
+            if cached_plan is not None:
+                return cached_plan
 
-        sorted_queries = sorted(queries, key=lambda q: q.cost, reverse=True)
-        return sorted_queries[:top_n]
+        try:
+            with self._connector.connection() as conn:
+                explain_plan = self._run_explain_with_cursor(conn.cursor(), parsed.sql)
+        except Exception:
+            EXPLAIN_CALLS.labels(kind="profile", status="error").inc()
+            raise
+        EXPLAIN_CALLS.labels(kind="profile", status="ok").inc()
+
+        if cache_key is not None:
+            self._explain_cache.set(cache_key, explain_plan)
+        return explain_plan
 
     def _run_explain_with_cursor(self, cursor, sql_query: str) -> dict:
         """Выполняет EXPLAIN, используя существующий курсор. Максимально отказоустойчивая версия."""
@@ -116,68 +300,86 @@ class AnalysisModule:
         else:
             raise ValueError(f"EXPLAIN не вернул ожидаемую JSON-строку. Получено (тип: {type(result)}): {result}")
 
-    def validate_sql_list(self, ddl_statements: list, migration_statements: list, query_statements: list) -> (
-    bool, str, str):
+    def precheck_statement(self, section: str, item) -> Optional[str]:
         """
-        Проверяет SQL-запросы с помощью симуляции через CTE. Не требует прав на запись.
+        Быстрая локальная проверка одного элемента ответа LLM (без обращения к Trino).
+        Позволяет отбросить ответ, пока модель еще генерирует остальные секции.
+        Возвращает текст ошибки или None.
         """
-        print("Запускаю CTE-валидацию сгенерированного SQL...")
-
+        field = "query" if section == "queries" else "statement"
+        if not isinstance(item, dict) or not isinstance(item.get(field), str):
+            return f"Элемент секции '{section}' должен быть объектом с полем '{field}'"
+        sql = item[field]
         try:
-            if not ddl_statements or not migration_statements or not query_statements:
-                print("Предупреждение: Недостаточно данных для CTE-валидации. Пропускаю.")
-                return True, "", ""
-
-            create_table_sql = next(
-                (s["statement"] for s in ddl_statements if "CREATE TABLE" in s["statement"].upper()), None)
-            if not create_table_sql:
-                return False, "Не найден CREATE TABLE в DDL ответа LLM", ""
-
-            try:
-                create_table_ast = sqlglot.parse_one(create_table_sql, read="trino")
-                column_defs = create_table_ast.this.expressions
-                column_names = [col_def.this.sql() for col_def in column_defs]
-            except Exception as e:
-                return False, f"AST-парсер не смог извлечь колонки из DDL: {e}", create_table_sql
-
-            new_table_name = sqlglot.parse_one(create_table_sql, read="trino").this.this.sql()
-            if not new_table_name:
-                return False, "Не удалось извлечь имя новой таблицы из DDL", create_table_sql
-
-            migration_sql = migration_statements[0]["statement"]
-            select_part_index = migration_sql.upper().find("SELECT")
-            if select_part_index == -1:
-                return False, "Не найдена SELECT-часть в миграционном скрипте", migration_sql
-            migration_select = migration_sql[select_part_index:]
-
-            if migration_select.strip().endswith(';'):
-                migration_select = migration_select.strip()[:-1]
-
-            final_query_sql = query_statements[0]["query"]
-            final_query_simulated = final_query_sql.replace(new_table_name, "simulated_new_table")
-
-            validation_query = f"""
-            WITH simulated_new_table ({', '.join(column_names)}) AS (
-                {migration_select}
-            )
-            {final_query_simulated}
-            """
+            statement_ast = sqlglot.parse_one(sql, read="trino")
+        except Exception as e:
+            return f"SQL в секции '{section}' не разбирается: {e}"
 
-            if validation_query.strip().endswith(';'):
-                validation_query = validation_query.strip()[:-1]
+        if section == "ddl" and isinstance(statement_ast, sqlglot.exp.Create) and statement_ast.kind == "TABLE":
+            if not isinstance(statement_ast.this, sqlglot.exp.Schema) or not statement_ast.this.expressions:
+                return "Не удалось извлечь колонки из CREATE TABLE"
+        if section == "migrations" and "SELECT" not in sql.upper():
+            return "Не найдена SELECT-часть в миграционном скрипте"
+        return None
 
-            explain_query = f"EXPLAIN {validation_query}"
+    def validate_sql_list(self, ddl_statements: list, migration_statements: list, query_statements: list,
+                          source_ddl: Optional[Iterable[str]] = None) -> (bool, str, str):
+        """
+        Проверяет SQL-запросы с помощью симуляции через CTE. Не требует прав на запись.
+        Каждая миграция и каждый итоговый запрос проверяются своим EXPLAIN-ом; EXPLAIN-ы выполняются
+        параллельно на соединениях из пула, а ошибка возвращается для первого по порядку оператора.
+        Если ответ не создает таблиц, запросы проверяются EXPLAIN-ом напрямую по исходной схеме;
+        ответ без итоговых запросов невалиден.
+        Если передан source_ddl (DDL задачи), сначала выполняется локальная проверка по схеме,
+        и в Trino уходят только ответы, которые ее прошли.
+        """
+        logger.info("Запускаю CTE-валидацию сгенерированного SQL...")
 
-            print(f"Выполняю EXPLAIN для симуляции...")
-            print(f"EXPLAIN: {explain_query}")
-            with self._connector.connect() as conn:
-                cur = conn.cursor()
-                cur.execute(explain_query)
+        try:
+            # Локальная проверка не зависит от состава ответа: ответ только из запросов тоже сверяется со схемой
+            if source_ddl is not None and settings.LOCAL_VALIDATION:
+                is_valid, error_message, failing_sql = StaticSQLValidator(source_ddl).validate(
+                    ddl_statements, migration_statements, query_statements)
+                if not is_valid:
+                    logger.info("Локальная проверка не пройдена, Trino не вызывается: %s", error_message)
+                    return False, error_message, failing_sql
+
+            if not query_statements:
+                error_message = "Ответ LLM не содержит итоговых запросов"
+                logger.info(error_message)
+                return False, error_message, ""
 
-            print("CTE-валидация SQL прошла успешно.")
+            try:
+                statements = CTESimulationPlanner(ddl_statements, migration_statements).plan(query_statements)
+            except SimulationError as e:
+                return False, str(e), e.sql
+
+            logger.debug("Выполняю EXPLAIN для %d операторов симуляции...", len(statements))
+            concurrency = max(1, min(settings.PROFILING_CONCURRENCY, len(statements)))
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                errors = list(executor.map(self._explain_simulation, statements))
+
+            for statement, error in zip(statements, errors):
+                if error is not None:
+                    error_message = f"Симуляция оператора из секции '{statement.section}' не прошла EXPLAIN: {error}"
+                    logger.info(error_message)
+                    return False, error_message, statement.sql
+
+            logger.info("CTE-валидация SQL прошла успешно.")
             return True, "", ""
 
         except Exception as e:
             error_message = f"Критическая ошибка в процессе CTE-валидации: {e}"
-            print(error_message)
-            return False, error_message, validation_query if 'validation_query' in locals() else ""
+            logger.exception(error_message)
+            return False, error_message, ""
+
+    def _explain_simulation(self, statement: SimulatedStatement) -> Optional[str]:
+        """Выполняет EXPLAIN проверочного запроса на соединении из пула; возвращает текст ошибки или None."""
+        try:
+            with self._connector.connection() as conn:
+                conn.cursor().execute(f"EXPLAIN {statement.validation_sql}")
+        except Exception as e:
+            EXPLAIN_CALLS.labels(kind="validation", status="error").inc()
+            return str(e)
+        EXPLAIN_CALLS.labels(kind="validation", status="ok").inc()
+        return None
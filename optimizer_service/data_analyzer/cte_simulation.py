@@ -0,0 +1,248 @@
+from dataclasses import dataclass, field
+from graphlib import CycleError, TopologicalSorter
+from typing import Dict, List, Optional, Set
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+
+
+class SimulationError(ValueError):
+    """Ответ LLM нельзя превратить в симуляцию; sql — оператор, на котором это выяснилось."""
+
+    def __init__(self, message: str, sql: str = ""):
+        super().__init__(message)
+        self.sql = sql
+
+
+@dataclass
+class SimulatedTable:
+    """Новая таблица из ответа LLM, представленная в проверочных запросах как CTE."""
+    name: str
+    cte_name: str
+    columns: List[exp.Identifier]
+    types: Dict[str, exp.DataType]
+    bodies: List[exp.Query] = field(default_factory=list)
+    dependencies: Set[str] = field(default_factory=set)
+    self_referencing: bool = False
+
+
+@dataclass
+class SimulatedStatement:
+    """Оператор ответа LLM и запрос, которым он проверяется через EXPLAIN."""
+    section: str
+    sql: str
+    validation_sql: str
+
+
+def _table_key(table: exp.Table) -> str:
+    return ".".join(part for part in (table.catalog, table.db, table.name) if part).lower()
+
+
+class CTESimulationPlanner:
+    """
+    Строит проверочные запросы для всех операторов ответа LLM без прав на запись.
+    Каждая таблица из CREATE TABLE ответа заменяется CTE: его тело — SELECT-части всех миграций,
+    пишущих в таблицу (UNION ALL), приведенные к колонкам и типам DDL; таблица без миграций
+    представлена пустым типизированным набором строк. Ссылки на новые таблицы подменяются
+    на уровне AST, поэтому миграции с собственными WITH и алиасы таблиц сохраняются.
+    Зависимости между новыми таблицами образуют граф; в проверочный запрос попадают только нужные
+    CTE в топологическом порядке. Проверяется каждая миграция и каждый итоговый запрос.
+    Если ответ не создает таблиц, проверочные запросы совпадают с исходными и проверяются по схеме источника.
+    """
+
+    def __init__(self, ddl_statements: list, migration_statements: list):
+        self._tables: Dict[str, SimulatedTable] = {}
+        self._migrations: List[tuple] = []
+        for item in ddl_statements:
+            self._register_ddl(item["statement"])
+        for item in migration_statements:
+            self._register_migration(item["statement"])
+        self._order = self._topological_order()
+
+    @staticmethod
+    def _parse(sql: str) -> exp.Expression:
+        try:
+            return sqlglot.parse_one(sql, read="trino")
+        except ParseError as e:
+            raise SimulationError(f"SQL не разбирается: {e}", sql)
+
+    def _register_ddl(self, sql: str):
+        ast = self._parse(sql)
+        if not (isinstance(ast, exp.Create) and ast.kind == "TABLE"):
+            return
+        schema = ast.this
+        target = schema.this if isinstance(schema, exp.Schema) else schema
+        key = _table_key(target)
+        if isinstance(schema, exp.Schema):
+            column_defs = [e for e in schema.expressions if isinstance(e, exp.ColumnDef)]
+            if not column_defs:
+                raise SimulationError("AST-парсер не смог извлечь колонки из DDL", sql)
+            columns = [col_def.this.copy() for col_def in column_defs]
+            types = {col_def.this.name.lower(): col_def.kind for col_def in column_defs if col_def.kind}
+            bodies = []
+        elif isinstance(ast.expression, exp.Query):
+            columns = [exp.to_identifier(name) for name in ast.expression.named_selects]
+            types = {}
+            bodies = [ast.expression.copy()]
+        else:
+            raise SimulationError("Не удалось извлечь колонки новой таблицы из DDL", sql)
+        self._tables[key] = SimulatedTable(
+            name=target.sql(dialect="trino"),
+            cte_name=f"simulated_{target.name}_{len(self._tables)}",
+            columns=columns,
+            types=types,
+            bodies=bodies,
+        )
+
+    def _register_migration(self, sql: str):
+        ast = self._parse(sql)
+        if isinstance(ast, exp.Create) and ast.kind == "TABLE" and isinstance(ast.expression, exp.Query):
+            self._register_ddl(sql)
+            key = _table_key(ast.this.this if isinstance(ast.this, exp.Schema) else ast.this)
+            self._migrations.append((sql, key, self._tables[key].bodies[0]))
+            return
+        if not (isinstance(ast, exp.Insert) and isinstance(ast.expression, exp.Query)):
+            raise SimulationError("Не найдена SELECT-часть в миграционном скрипте", sql)
+
+        target = ast.this
+        explicit_columns = [column.name.lower() for column in target.expressions] \
+            if isinstance(target, exp.Schema) else []
+        if isinstance(target, exp.Schema):
+            target = target.this
+        key = _table_key(target)
+        table = self._tables.get(key)
+        if table is None:
+            # Вставка в существующую таблицу: проверяем только SELECT-часть.
+            self._migrations.append((sql, None, ast.expression.copy()))
+            return
+        body = self._align(table, ast.expression.copy(), explicit_columns)
+        table.bodies.append(body)
+        self._migrations.append((sql, key, body))
+
+    @staticmethod
+    def _align(table: SimulatedTable, query: exp.Query, explicit_columns: List[str]) -> exp.Query:
+        """Приводит SELECT миграции к колонкам и типам новой таблицы, как это сделал бы INSERT."""
+        provided = explicit_columns or [column.name.lower() for column in table.columns]
+        projections = []
+        for column in table.columns:
+            name = column.name.lower()
+            value = exp.column(exp.to_identifier(f"c{provided.index(name)}"), table="migration") \
+                if name in provided else exp.null()
+            if name in table.types:
+                value = exp.cast(value, table.types[name].copy())
+            projections.append(exp.alias_(value, column.copy()))
+        source = exp.Subquery(this=query, alias=exp.TableAlias(
+            this=exp.to_identifier("migration"),
+            columns=[exp.to_identifier(f"c{i}") for i in range(len(provided))],
+        ))
+        return exp.select(*projections).from_(source)
+
+    def _referenced_tables(self, query: exp.Expression) -> Set[str]:
+        cte_names = {cte.alias_or_name.lower() for cte in query.find_all(exp.CTE)}
+        return {
+            _table_key(table) for table in query.find_all(exp.Table)
+            if _table_key(table) in self._tables and not (not table.db and table.name.lower() in cte_names)
+        }
+
+    def _topological_order(self) -> List[str]:
+        graph = {}
+        for key, table in self._tables.items():
+            referenced = set().union(*(self._referenced_tables(body) for body in table.bodies))
+            table.self_referencing = key in referenced
+            if table.self_referencing and not table.types:
+                raise SimulationError(f"Таблица {table.name} создается запросом, читающим ее саму")
+            table.dependencies = referenced - {key}
+            graph[key] = table.dependencies
+        try:
+            return list(TopologicalSorter(graph).static_order())
+        except CycleError as e:
+            raise SimulationError(f"Циклическая зависимость между новыми таблицами: {e.args[1]}")
+
+    def _rewrite(self, query: exp.Expression, self_key: Optional[str] = None) -> exp.Expression:
+        """Подменяет ссылки на новые таблицы ссылками на их CTE (ссылка на саму себя — на пустой набор строк)."""
+        cte_names = {cte.alias_or_name.lower() for cte in query.find_all(exp.CTE)}
+
+        def replace(node):
+            if not isinstance(node, exp.Table) or node.name.lower() in cte_names and not node.db:
+                return node
+            key = _table_key(node)
+            if key not in self._tables:
+                return node
+            cte_name = self._tables[key].cte_name if key != self_key else f"{self._tables[key].cte_name}_empty"
+            alias = node.args.get("alias") or exp.TableAlias(this=exp.to_identifier(node.name))
+            return exp.Table(this=exp.to_identifier(cte_name), alias=alias.copy())
+
+        return query.transform(replace)
+
+    def _empty_relation(self, table: SimulatedTable) -> exp.Query:
+        projections = [
+            exp.alias_(exp.cast(exp.null(), table.types[column.name.lower()].copy()), column.copy())
+            for column in table.columns
+        ]
+        return exp.select(*projections).where(exp.false())
+
+    def _cte_body(self, key: str) -> exp.Query:
+        table = self._tables[key]
+        if not table.bodies:
+            return self._empty_relation(table)
+        bodies = [self._rewrite(body.copy(), self_key=key) for body in table.bodies]
+        result = bodies[0]
+        for body in bodies[1:]:
+            result = exp.union(result, body, distinct=False)
+        return result
+
+    def plan(self, query_statements: list) -> List[SimulatedStatement]:
+        """Возвращает проверочные запросы: сначала для миграций, затем для итоговых запросов, в порядке ответа."""
+        statements = []
+        for sql, key, body in self._migrations:
+            if key is None:
+                check = self._with_simulations(body)
+            else:
+                # Миграция проверяется отдельно от соседних: CTE ее таблицы содержит только ее SELECT.
+                table = self._tables[key]
+                check = self._with_simulations(
+                    exp.select("*").from_(exp.to_table(table.cte_name)),
+                    own_table=(key, self._rewrite(body.copy(), self_key=key)),
+                )
+            statements.append(SimulatedStatement("migrations", sql, check.sql(dialect="trino")))
+        for item in query_statements:
+            sql = item["query"]
+            query = self._parse(sql)
+            if not isinstance(query, exp.Query):
+                raise SimulationError("Итоговый запрос должен быть SELECT-запросом", sql)
+            statements.append(SimulatedStatement("queries", sql, self._with_simulations(query).sql(dialect="trino")))
+        return statements
+
+    def _with_simulations(self, query: exp.Query, own_table: Optional[tuple] = None) -> exp.Query:
+        """Добавляет к запросу CTE всех новых таблиц, от которых он зависит (own_table — таблица и ее тело)."""
+        required: Set[str] = set()
+        pending = list(self._referenced_tables(query))
+        if own_table is not None:
+            pending.append(own_table[0])
+        while pending:
+            key = pending.pop()
+            if key not in required:
+                required.add(key)
+                pending.extend(self._tables[key].dependencies)
+
+        ctes = []
+        for key in self._order:
+            if key not in required:
+                continue
+            table = self._tables[key]
+            if table.self_referencing:
+                ctes.append((f"{table.cte_name}_empty", self._empty_relation(table), table.columns))
+            body = own_table[1] if own_table is not None and own_table[0] == key else self._cte_body(key)
+            ctes.append((table.cte_name, body, table.columns))
+
+        rewritten = self._rewrite(query.copy())
+        existing = [(cte.args["alias"], cte.this) for cte in rewritten.ctes]
+        if not ctes:
+            return rewritten
+        for index, (name, body, columns) in enumerate(ctes):
+            alias = exp.TableAlias(this=exp.to_identifier(name), columns=[column.copy() for column in columns])
+            rewritten = rewritten.with_(alias, as_=body, append=index > 0, copy=False)
+        for alias, body in existing:
+            rewritten = rewritten.with_(alias, as_=body, copy=False)
+        return rewritten
@@ -0,0 +1,89 @@
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from optimizer_service.core.config import settings
+from optimizer_service.data_analyzer.query_parser import normalize_sql, query_fingerprint
+from optimizer_service.models.schemas import QueryStatement, QueryTemplate, TaskRequest
+
+
+@dataclass
+class _TemplateTotals:
+    """Накопленные по шаблону значения: от группы хранится только запрос-представитель."""
+    representative: QueryStatement
+    total_runs: int = 0
+    total_time: float = 0.0
+    execution_time_sum: float = 0.0
+    count: int = 0
+    queryids: List[str] = field(default_factory=list)
+
+    def add(self, query: QueryStatement, queryids_limit: int):
+        cost = query.runquantity * query.executiontime
+        if cost > self.representative.runquantity * self.representative.executiontime:
+            self.representative = query
+        self.total_runs += query.runquantity
+        self.total_time += cost
+        self.execution_time_sum += query.executiontime
+        self.count += 1
+        if len(self.queryids) < queryids_limit:
+            self.queryids.append(query.queryid)
+
+
+def build_query_templates(queries: Iterable[QueryStatement], deduplicate: bool = True,
+                          queryids_limit: Optional[int] = None) -> List[QueryTemplate]:
+    """
+    Группирует запросы по отпечатку шаблона.
+    Частота шаблона — сумма runquantity, время — среднее executiontime, взвешенное по частоте,
+    поэтому стоимость шаблона равна суммарной стоимости его запросов.
+    Представителем становится самый дорогой запрос группы (при равенстве — первый). Порядок шаблонов —
+    по первому вхождению. Без дедупликации каждый запрос становится отдельным шаблоном.
+    Запросы агрегируются по мере чтения: память растет с числом шаблонов, а не запросов,
+    а у шаблона сохраняется не больше queryids_limit (по умолчанию TEMPLATE_QUERYIDS_LIMIT) идентификаторов.
+    """
+    limit = settings.TEMPLATE_QUERYIDS_LIMIT if queryids_limit is None else queryids_limit
+    groups: Dict[str, _TemplateTotals] = {}
+    for query in queries:
+        key = query_fingerprint(query.query) if deduplicate else query.queryid
+        totals = groups.get(key)
+        if totals is None:
+            totals = groups[key] = _TemplateTotals(representative=query)
+        totals.add(query, limit)
+
+    templates = []
+    for fingerprint, totals in groups.items():
+        if totals.total_runs:
+            execution_time = totals.total_time / totals.total_runs
+        else:
+            execution_time = totals.execution_time_sum / totals.count
+
+        templates.append(QueryTemplate(
+            fingerprint=fingerprint,
+            queryid=totals.representative.queryid,
+            query=totals.representative.query,
+            runquantity=totals.total_runs,
+            executiontime=execution_time,
+            queryids=totals.queryids,
+            query_count=totals.count,
+        ))
+    return templates
+
+
+def _normalize_or_strip(sql: str) -> str:
+    try:
+        return normalize_sql(sql)
+    except Exception:
+        return sql.strip()
+
+
+def request_digest(request: TaskRequest) -> str:
+    """
+    Канонический отпечаток задачи: URL, отсортированные DDL и нормализованные запросы.
+    Задачи, отличающиеся только порядком или оформлением запросов, получают одинаковый отпечаток.
+    """
+    ddl = sorted(_normalize_or_strip(ddl.statement) for ddl in request.ddl)
+    queries = sorted(
+        (q.queryid, _normalize_or_strip(q.query), q.runquantity, q.executiontime) for q in request.queries
+    )
+    payload = json.dumps({"url": request.url, "ddl": ddl, "queries": queries}, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Optional, Tuple
+
+from optimizer_service.core.observability import DETECTOR_ORPHANED_THREADS
+from optimizer_service.data_analyzer.detectors.base_detector import BasePatternDetector
+from optimizer_service.data_analyzer.workload_stats import WorkloadStats
+from optimizer_service.models.schemas import ProfiledQuery, ParsedDDL, DetectionResult, DetectorRunStats
+
+logger = logging.getLogger(__name__)
+
+
+class DetectorRunner:
+    """
+    Запускает детекторы параллельно в пуле потоков и собирает статистику по каждому из них.
+    Каждому детектору выделяется бюджет времени, который отсчитывается с момента его фактического запуска,
+    а не постановки в очередь: результаты детектора, не уложившегося в бюджет, отбрасываются, и анализ
+    продолжается без него. Ошибки детекторов не скрываются, а попадают в статистику.
+
+    Пул создается на каждый запуск и закрывается с отменой еще не начатых детекторов. Поток Python нельзя
+    прервать принудительно, поэтому детектор, превысивший бюджет, дорабатывает в фоне: такие потоки
+    логируются и считаются в метрике optimizer_detector_orphaned_threads_total, а следующий запуск получает
+    новый пул и не ждет их.
+
+    Используются потоки, а не процессы: Celery prefork-воркеры не могут порождать дочерние процессы,
+    а AST уже разобраны заранее, и их передача в другой процесс стоила бы дороже самого обхода.
+    Из-за GIL потоки дают выигрыш только детекторам, которые ждут ввода-вывода; CPU-bound детекторы
+    (обход AST на чистом Python) выполняются фактически последовательно, а пул лишь изолирует их ошибки
+    и ограничивает время ожидания их результатов.
+    """
+
+    def __init__(self, max_workers: int, time_budget_seconds: float):
+        self._max_workers = max_workers
+        self._time_budget_seconds = time_budget_seconds
+
+    def run(self, detectors: List[BasePatternDetector], queries: List[ProfiledQuery],
+            ddl_map: Dict[str, ParsedDDL],
+            stats: Optional[WorkloadStats] = None) -> Tuple[List[DetectionResult], List[DetectorRunStats]]:
+        """Возвращает найденные проблемы (в порядке детекторов) и статистику запуска каждого детектора."""
+        if not detectors:
+            return [], []
+
+        workers = max(1, min(self._max_workers, len(detectors)))
+        # Если все детекторы израсходуют бюджет полностью, последняя волна закончится к этому сроку.
+        # Детектор, не получивший поток к этому моменту, считается не уложившимся в бюджет.
+        waves = -(-len(detectors) // workers)
+        deadline = time.monotonic() + self._time_budget_seconds * waves
+        start_times: List[Optional[float]] = [None] * len(detectors)
+        started = [threading.Event() for _ in detectors]
+
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="detector")
+        all_detections: List[DetectionResult] = []
+        run_stats: List[DetectorRunStats] = []
+        try:
+            futures = [
+                executor.submit(self._timed_run, detector, queries, ddl_map, stats, start_times, started, index)
+                for index, detector in enumerate(detectors)
+            ]
+            for index, (detector, future) in enumerate(zip(detectors, futures)):
+                detector_name = detector.__class__.__name__
+                try:
+                    if not started[index].wait(timeout=max(0.0, deadline - time.monotonic())):
+                        raise TimeoutError()
+                    remaining = max(0.0, start_times[index] + self._time_budget_seconds - time.monotonic())
+                    detections, duration_ms = future.result(timeout=remaining)
+                except TimeoutError:
+                    if not future.cancel() and not future.done():
+                        DETECTOR_ORPHANED_THREADS.labels(detector=detector_name).inc()
+                        logger.warning("Детектор %s не уложился в %s сек. и продолжает работу в фоне. Пропускаю.",
+                                       detector_name, self._time_budget_seconds)
+                    else:
+                        logger.warning("Детектор %s не уложился в %s сек. Пропускаю.",
+                                       detector_name, self._time_budget_seconds)
+                    run_started_at = start_times[index]
+                    run_stats.append(DetectorRunStats(
+                        detector_name=detector_name,
+                        duration_ms=(time.monotonic() - run_started_at) * 1000 if run_started_at else 0.0,
+                        queries_examined=len(queries),
+                        status="timeout",
+                    ))
+                    continue
+                except Exception as e:
+                    logger.error("Детектор %s завершился с ошибкой: %s", detector_name, e)
+                    run_stats.append(DetectorRunStats(
+                        detector_name=detector_name,
+                        duration_ms=(time.monotonic() - start_times[index]) * 1000,
+                        queries_examined=len(queries),
+                        status="error",
+                        error=str(e),
+                    ))
+                    continue
+
+                all_detections.extend(detections)
+                run_stats.append(DetectorRunStats(
+                    detector_name=detector_name,
+                    duration_ms=duration_ms,
+                    queries_examined=len(queries),
+                    result_count=len(detections),
+                ))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return all_detections, run_stats
+
+    @staticmethod
+    def _timed_run(detector: BasePatternDetector, queries: List[ProfiledQuery], ddl_map: Dict[str, ParsedDDL],
+                   stats: Optional[WorkloadStats], start_times: List[Optional[float]],
+                   started: List[threading.Event], index: int) -> Tuple[List[DetectionResult], float]:
+        start_times[index] = time.monotonic()
+        started[index].set()
+        started_at = time.perf_counter()
+        detections = detector.run(queries, ddl_map, stats)
+        return detections, (time.perf_counter() - started_at) * 1000
@@ -1,10 +1,31 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict
-from optimizer_service.models.schemas import ProfiledQuery, DetectionResult
+from typing import List, Dict, Optional, FrozenSet
+from optimizer_service.data_analyzer.workload_stats import WorkloadStats
+from optimizer_service.models.schemas import ProfiledQuery, DetectionResult, ParsedDDL
+
+class DetectorInput:
+    """Входные данные, которые может запросить детектор. Движок вычисляет только запрошенные."""
+    AST = "ast"
+    EXPLAIN_PLAN = "explain_plan"
+    # ProfiledQuery.plan_profile: плоские узлы плана и векторы оценочной стоимости (см. plan_analysis)
+    PLAN_COSTS = "plan_costs"
+    # ProfiledQuery.runtime_profile: измеренные показатели операторов по EXPLAIN ANALYZE.
+    # Заполняется только при EXPLAIN_ANALYZE_ENABLED и только для выборки самых дорогих запросов.
+    RUNTIME_PROFILE = "runtime_profile"
+    DDL = "ddl"
+    WORKLOAD_STATS = "workload_stats"
+
 
 class BasePatternDetector(ABC):
     """Абстрактный базовый класс для всех детекторов."""
+    required_inputs: FrozenSet[str] = frozenset({DetectorInput.AST})
+
     @abstractmethod
-    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, str]) -> List[DetectionResult]:
-        """Запускает анализ и возвращает список найденных проблем."""
+    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, ParsedDDL],
+            stats: Optional[WorkloadStats] = None) -> List[DetectionResult]:
+        """
+        Запускает анализ и возвращает список найденных проблем.
+        Запросы приходят уже разобранными (ProfiledQuery.parsed), повторно парсить SQL не нужно.
+        stats — счетчики по всей нагрузке для детекторов, которым мало самых дорогих запросов.
+        """
         pass
\ No newline at end of file
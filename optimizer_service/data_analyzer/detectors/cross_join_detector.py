@@ -1,18 +1,18 @@
-from typing import List, Dict
-import sqlglot
-from sqlglot import exp
-from .base_detector import BasePatternDetector
-from optimizer_service.models.schemas import ProfiledQuery, DetectionResult
+from typing import List, Dict, Optional
+from .base_detector import BasePatternDetector, DetectorInput
+from optimizer_service.data_analyzer.workload_stats import WorkloadStats
+from optimizer_service.models.schemas import ProfiledQuery, DetectionResult, ParsedDDL
 
 
 class CrossJoinDetector(BasePatternDetector):
-    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, str]) -> List[DetectionResult]:
+    required_inputs = frozenset({DetectorInput.AST})
+
+    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, ParsedDDL],
+            stats: Optional[WorkloadStats] = None) -> List[DetectionResult]:
         detections = []
         for query in queries:
             try:
-                parsed = sqlglot.parse_one(query.sql, read="trino")
-
-                for join_node in parsed.find_all(exp.Join):
+                for join_node in query.parsed.joins:
                     if join_node.kind and "CROSS" in join_node.kind.upper():
                         message = (
                             f"A CROSS JOIN was detected in query (ID: {query.queryid}). "
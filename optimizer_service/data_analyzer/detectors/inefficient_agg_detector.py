@@ -1,17 +1,19 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 import sqlglot.expressions as exp
-import sqlglot
-from .base_detector import BasePatternDetector
-from optimizer_service.models.schemas import ProfiledQuery, DetectionResult
+from .base_detector import BasePatternDetector, DetectorInput
+from optimizer_service.data_analyzer.workload_stats import WorkloadStats
+from optimizer_service.models.schemas import ProfiledQuery, DetectionResult, ParsedDDL
 
 
 class InefficientAggregationDetector(BasePatternDetector):
-    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, str]) -> List[DetectionResult]:
+    required_inputs = frozenset({DetectorInput.AST})
+
+    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, ParsedDDL],
+            stats: Optional[WorkloadStats] = None) -> List[DetectionResult]:
         detections = []
         for query in queries:
             try:
-                parsed = sqlglot.parse_one(query.sql, read="trino")
-                having_clause = parsed.find(exp.Having)
+                having_clause = query.parsed.having
 
                 if not having_clause:
                     continue
@@ -1,16 +1,28 @@
 from collections import Counter
 from itertools import combinations
-from typing import List, Dict
-from .base_detector import BasePatternDetector
-from optimizer_service.models.schemas import ProfiledQuery, DetectionResult
+from typing import List, Dict, Optional
+from .base_detector import BasePatternDetector, DetectorInput
+from optimizer_service.data_analyzer.workload_stats import WorkloadStats
+from optimizer_service.models.schemas import ProfiledQuery, DetectionResult, ParsedDDL
 
 
 class JoinPatternDetector(BasePatternDetector):
-    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, str]) -> List[DetectionResult]:
-        join_pairs = Counter()
-        for query in queries:
-            pairs = combinations(sorted(query.tables), 2)
-            join_pairs.update(pairs)
+    required_inputs = frozenset({DetectorInput.AST, DetectorInput.WORKLOAD_STATS})
+
+    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, ParsedDDL],
+            stats: Optional[WorkloadStats] = None) -> List[DetectionResult]:
+        if not queries:
+            return []
+
+        if stats is not None:
+            join_pairs = stats.join_pairs
+            scope = "across the whole workload"
+        else:
+            join_pairs = Counter()
+            for query in queries:
+                pairs = combinations(sorted(query.tables), 2)
+                join_pairs.update(pairs)
+            scope = "in the most expensive queries"
 
         top_joins = join_pairs.most_common(3)
 
@@ -20,7 +32,7 @@ class JoinPatternDetector(BasePatternDetector):
         join_str = ", ".join([f"'{t[0][0]}' и '{t[0][1]}'" for t in top_joins])
         message = (
             f"Detected 'Frequent Joins' pattern. "
-            f"Tables {join_str} are constantly joined together in the most expensive queries. "
+            f"Tables {join_str} are constantly joined together {scope}. "
             f"Strategic recommendation: Denormalize these frequently joined tables into a single, wide 'fact table'."
         )
 
@@ -1,18 +1,26 @@
 from collections import Counter
-from typing import List, Dict
-import sqlglot
-from .base_detector import BasePatternDetector
-from optimizer_service.models.schemas import ProfiledQuery, DetectionResult
+from typing import List, Dict, Optional
+from .base_detector import BasePatternDetector, DetectorInput
+from optimizer_service.data_analyzer.workload_stats import WorkloadStats
+from optimizer_service.models.schemas import ProfiledQuery, DetectionResult, ParsedDDL
 
 
 class PartitioningCandidateDetector(BasePatternDetector):
-    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, str]) -> List[DetectionResult]:
+    required_inputs = frozenset({DetectorInput.AST, DetectorInput.DDL, DetectorInput.WORKLOAD_STATS})
+
+    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, ParsedDDL],
+            stats: Optional[WorkloadStats] = None) -> List[DetectionResult]:
         if not queries:
             return []
 
-        table_counter = Counter()
-        for query in queries:
-            table_counter.update(query.tables)
+        if stats is not None:
+            table_counter = stats.table_usage
+            scope = "across the whole workload"
+        else:
+            table_counter = Counter()
+            for query in queries:
+                table_counter.update(query.tables)
+            scope = "in the most expensive queries"
 
         if not table_counter:
             return []
@@ -24,20 +32,16 @@ class PartitioningCandidateDetector(BasePatternDetector):
 
         candidate_ddl = ddl_map[candidate_table]
 
-        if "partitioning" in candidate_ddl.lower():
+        if "partitioning" in candidate_ddl.statement.lower():
             return []
 
-        filter_columns = Counter()
-        for query in queries:
-            if candidate_table in query.tables:
-                try:
-                    parsed = sqlglot.parse_one(query.sql, read="trino")
-                    if parsed.find(sqlglot.exp.Where):
-                        for column in parsed.find(sqlglot.exp.Where).find_all(sqlglot.exp.Column):
-                            if column.this:
-                                filter_columns.update([column.this.sql()])
-                except Exception:
-                    continue
+        if stats is not None:
+            filter_columns = stats.filter_columns.get(candidate_table, Counter())
+        else:
+            filter_columns = Counter()
+            for query in queries:
+                if candidate_table in query.tables:
+                    filter_columns.update(query.parsed.where_columns)
 
         if not filter_columns:
             return []
@@ -47,7 +51,7 @@ class PartitioningCandidateDetector(BasePatternDetector):
 
         message = (
             f"Detected 'Unpartitioned Wide Table' pattern. "
-            f"The table '{candidate_table}' is frequently used in the most expensive queries but is not partitioned. "
+            f"The table '{candidate_table}' is frequently used {scope} but is not partitioned. "
             f"Query analysis shows that data is often filtered by the columns {keys_str}. "
             f"Strategic recommendation: Create a partitioned copy of the table '{candidate_table}', "
             f"using these columns as partitioning keys (e.g., WITH (partitioning = ARRAY[{', '.join(top_keys)}]))."
@@ -0,0 +1,83 @@
+import importlib
+import threading
+from importlib.metadata import entry_points
+from typing import Dict, List, Optional
+
+from optimizer_service.core.config import settings
+from .base_detector import BasePatternDetector
+
+ENTRY_POINT_GROUP = "optimizer_service.detectors"
+
+BUILTIN_DETECTORS: Dict[str, str] = {
+    "JoinPatternDetector": "optimizer_service.data_analyzer.detectors.join_detector:JoinPatternDetector",
+    "PartitioningCandidateDetector":
+        "optimizer_service.data_analyzer.detectors.partitioning_detector:PartitioningCandidateDetector",
+    "CrossJoinDetector": "optimizer_service.data_analyzer.detectors.cross_join_detector:CrossJoinDetector",
+    "InefficientAggregationDetector":
+        "optimizer_service.data_analyzer.detectors.inefficient_agg_detector:InefficientAggregationDetector",
+    "SelectStarDetector": "optimizer_service.data_analyzer.detectors.select_star_detector:SelectStarDetector",
+    "TableScanCostDetector": "optimizer_service.data_analyzer.detectors.scan_cost_detector:TableScanCostDetector",
+}
+
+
+class DetectorRegistry:
+    """
+    Реестр детекторов. Хранит только пути импорта вида 'module:Class',
+    модуль детектора импортируется при первом обращении к нему.
+    Помимо встроенных детекторов, подхватывает сторонние через entry points группы ENTRY_POINT_GROUP.
+    """
+
+    def __init__(self, specs: Optional[Dict[str, str]] = None):
+        self._specs = dict(BUILTIN_DETECTORS if specs is None else specs)
+        self._classes: Dict[str, type] = {}
+        self._lock = threading.Lock()
+        if specs is None:
+            for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+                self._specs.setdefault(entry_point.name, entry_point.value)
+
+    def register(self, name: str, spec: str):
+        """Регистрирует детектор по пути импорта 'module:Class'."""
+        self._specs[name] = spec
+
+    def available(self) -> List[str]:
+        return list(self._specs)
+
+    def load(self, name: str) -> type:
+        """Импортирует и возвращает класс детектора."""
+        with self._lock:
+            if name not in self._classes:
+                spec = self._specs.get(name, name)
+                if ":" not in spec:
+                    raise ValueError(f"Неизвестный детектор: {name}")
+                module_name, class_name = spec.split(":", 1)
+                detector_class = getattr(importlib.import_module(module_name), class_name)
+                if not issubclass(detector_class, BasePatternDetector):
+                    raise TypeError(f"{spec} не является наследником BasePatternDetector")
+                self._classes[name] = detector_class
+            return self._classes[name]
+
+    def create_enabled(self, enabled: Optional[List[str]] = None,
+                       disabled: Optional[List[str]] = None) -> List[BasePatternDetector]:
+        """
+        Создает экземпляры включенных детекторов в порядке конфигурации.
+        Пустой список enabled означает 'все зарегистрированные'. Элементом enabled может быть
+        и путь импорта 'module:Class' для детектора, не зарегистрированного заранее.
+        """
+        names = enabled or self.available()
+        disabled = set(disabled or [])
+        return [self.load(name)() for name in names if name not in disabled]
+
+
+def _parse_names(value: str) -> List[str]:
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+detector_registry = DetectorRegistry()
+
+
+def create_configured_detectors() -> List[BasePatternDetector]:
+    """Создает детекторы согласно настройкам ENABLED_DETECTORS / DISABLED_DETECTORS."""
+    return detector_registry.create_enabled(
+        enabled=_parse_names(settings.ENABLED_DETECTORS),
+        disabled=_parse_names(settings.DISABLED_DETECTORS),
+    )
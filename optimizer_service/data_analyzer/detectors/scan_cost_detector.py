@@ -0,0 +1,85 @@
+from collections import Counter
+from typing import List, Dict, Optional
+from .base_detector import BasePatternDetector, DetectorInput
+from optimizer_service.data_analyzer.plan_analysis import aggregate_table_costs
+from optimizer_service.data_analyzer.workload_stats import WorkloadStats
+from optimizer_service.models.schemas import ProfiledQuery, DetectionResult, ParsedDDL
+
+# Таблица считается доминирующей, если на нее приходится не меньше этой доли оценочного объема чтения
+SCAN_SHARE_THRESHOLD = 0.5
+# Меньшие объемы (с учетом числа запусков) не стоят перестройки таблицы
+MIN_SCANNED_BYTES = 1024 ** 3
+
+
+class TableScanCostDetector(BasePatternDetector):
+    """
+    Ищет таблицу, на чтение которой приходится большая часть оценочного объема данных (scanned_bytes)
+    самых дорогих запросов с учетом числа запусков. Оценки берутся из векторов стоимости плана.
+    Если для запросов есть профиль EXPLAIN ANALYZE, находка подкрепляется измеренными операторами чтения
+    этой таблицы: их долей CPU и долей строк, прошедших фильтр.
+    """
+    required_inputs = frozenset({DetectorInput.AST, DetectorInput.PLAN_COSTS, DetectorInput.RUNTIME_PROFILE})
+
+    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, ParsedDDL],
+            stats: Optional[WorkloadStats] = None) -> List[DetectionResult]:
+        table_costs = aggregate_table_costs(queries)
+        total_scanned = sum(vector.scanned_bytes for vector in table_costs.values())
+        if not table_costs or total_scanned <= 0:
+            return []
+
+        table, vector = max(table_costs.items(), key=lambda item: item[1].scanned_bytes)
+        share = vector.scanned_bytes / total_scanned
+        if share < SCAN_SHARE_THRESHOLD or vector.scanned_bytes < MIN_SCANNED_BYTES:
+            return []
+
+        scanning_queries = [
+            query for query in queries
+            if query.plan_profile is not None and table in query.plan_profile.tables
+        ]
+        filter_columns = Counter()
+        for query in scanning_queries:
+            if query.parsed is not None:
+                filter_columns.update(query.parsed.where_columns)
+
+        if filter_columns:
+            keys_str = ", ".join(f"'{column}'" for column, _ in filter_columns.most_common(2))
+            recommendation = (f"Create a copy of '{table}' partitioned by the filter columns {keys_str} "
+                              f"so that these queries read only the partitions they need.")
+        else:
+            recommendation = (f"The queries read '{table}' without filters: pre-aggregate or narrow it into "
+                              f"a smaller table that contains only the columns and rows these queries use.")
+
+        message = (
+            f"Detected 'Dominant Table Scan' pattern. "
+            f"Table '{table}' accounts for {share:.0%} of the estimated bytes scanned by the most expensive queries "
+            f"({vector.scanned_bytes / 1024 ** 3:.1f} GB weighted by run count, "
+            f"queries: {', '.join(query.queryid for query in scanning_queries)}). "
+            f"{self._describe_measured_scans(table, scanning_queries)}"
+            f"Strategic recommendation: {recommendation}"
+        )
+
+        return [DetectionResult(
+            pattern_name="Dominant Table Scan",
+            message=message,
+            priority=6,
+            queries=scanning_queries,
+            detector_name=self.__class__.__name__,
+        )]
+
+    @staticmethod
+    def _describe_measured_scans(table: str, queries: List[ProfiledQuery]) -> str:
+        """Сводка по измеренным операторам чтения таблицы (пустая строка, если профилей EXPLAIN ANALYZE нет)."""
+        profiled = [query.runtime_profile for query in queries if query.runtime_profile is not None]
+        total_cpu_ms = sum(profile.total_cpu_ms for profile in profiled)
+        scans = [operator for profile in profiled for operator in profile.operators if operator.table == table]
+        if not scans or total_cpu_ms <= 0:
+            return ""
+
+        scan_cpu_ms = sum(operator.cpu_ms for operator in scans)
+        input_rows = sum(operator.input_rows for operator in scans)
+        output_rows = sum(operator.output_rows for operator in scans)
+        description = (f"Measured by EXPLAIN ANALYZE: reading '{table}' takes {scan_cpu_ms / total_cpu_ms:.0%} "
+                       f"of CPU time of the profiled queries")
+        if input_rows > 0:
+            description += f" and keeps {output_rows / input_rows:.2%} of {input_rows} input rows after filtering"
+        return description + ". "
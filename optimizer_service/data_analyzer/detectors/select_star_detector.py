@@ -1,22 +1,21 @@
-from typing import List, Dict
-import sqlglot
-from .base_detector import BasePatternDetector
-from optimizer_service.models.schemas import ProfiledQuery, DetectionResult
+from typing import List, Dict, Optional
+from .base_detector import BasePatternDetector, DetectorInput
+from optimizer_service.data_analyzer.workload_stats import WorkloadStats
+from optimizer_service.models.schemas import ProfiledQuery, DetectionResult, ParsedDDL
 
 
 class SelectStarDetector(BasePatternDetector):
-    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, str]) -> List[DetectionResult]:
+    required_inputs = frozenset({DetectorInput.AST, DetectorInput.DDL})
+
+    def run(self, queries: List[ProfiledQuery], ddl_map: Dict[str, ParsedDDL],
+            stats: Optional[WorkloadStats] = None) -> List[DetectionResult]:
         detections = []
         for query in queries:
             try:
-                parsed = sqlglot.parse_one(query.sql, read="trino")
-                if any(isinstance(sel, sqlglot.exp.Star) for sel in parsed.find(sqlglot.exp.Select).expressions):
-                    tables_in_query = [t.sql() for t in parsed.find_all(sqlglot.exp.Table)]
-                    for table_name in tables_in_query:
+                if query.parsed.has_select_star:
+                    for table_name in query.parsed.tables:
                         if table_name in ddl_map:
-                            ddl = ddl_map[table_name]
-                            ddl_ast = sqlglot.parse_one(ddl, read="trino")
-                            num_columns = len(ddl_ast.this.expressions)
+                            num_columns = len(ddl_map[table_name].column_names)
                             if num_columns > 20:
                                 message = (
                                     f"The query (ID: {query.queryid}) uses `SELECT *` to read from the wide "
@@ -0,0 +1,41 @@
+import hashlib
+from typing import Dict, Optional
+
+from optimizer_service.core.cache import RedisCache
+from optimizer_service.core.config import settings
+from optimizer_service.data_analyzer.query_parser import normalize_sql
+from optimizer_service.models.schemas import ParsedQuery, ParsedDDL
+
+
+class ExplainPlanCache:
+    """
+    Персистентный кэш EXPLAIN-планов.
+    Ключ — нормализованный текст запроса, кластер Trino и отпечаток DDL задействованных таблиц,
+    поэтому изменение схемы любой из таблиц запроса инвалидирует закэшированный план.
+    """
+
+    def __init__(self, cache: Optional[RedisCache] = None):
+        self._cache = cache or RedisCache(
+            namespace="explain-plan",
+            ttl_seconds=settings.EXPLAIN_CACHE_TTL_SECONDS,
+            max_entries=settings.EXPLAIN_CACHE_MAX_ENTRIES,
+        )
+
+    def make_key(self, target: str, parsed: ParsedQuery, ddl_map: Dict[str, ParsedDDL]) -> str:
+        relevant_ddl = sorted(ddl_map[table].statement for table in set(parsed.tables) if table in ddl_map)
+        ddl_fingerprint = hashlib.sha256("\n".join(relevant_ddl).encode("utf-8")).hexdigest()
+
+        digest = hashlib.sha256()
+        for part in (target, normalize_sql(parsed.sql), ddl_fingerprint):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._cache.get(key)
+
+    def set(self, key: str, explain_plan: dict):
+        self._cache.set(key, explain_plan)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
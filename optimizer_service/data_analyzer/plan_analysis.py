@@ -0,0 +1,117 @@
+import math
+import re
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from optimizer_service.models.schemas import PlanCostVector, PlanNode, PlanProfile, ProfiledQuery
+
+SCAN_NODE_PREFIX = "Scan"
+TABLE_SCAN_NODES = ("TableScan",)
+PRIORITIZATION_METRICS = ("time", "rows", "cpu", "memory", "network", "output_bytes", "scanned_bytes")
+
+_ESTIMATE_FIELDS = {
+    "rows": "outputRowCount",
+    "output_bytes": "outputSizeInBytes",
+    "cpu": "cpuCost",
+    "memory": "memoryCost",
+    "network": "networkCost",
+}
+
+
+def _number(value: Any) -> float:
+    """Оценки Trino бывают NaN/Infinity (в том числе строками) — такие считаем неизвестными."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return number if math.isfinite(number) else 0.0
+
+
+def _add(target: PlanCostVector, other: PlanCostVector, weight: float = 1.0):
+    for field in PlanCostVector.model_fields:
+        setattr(target, field, getattr(target, field) + getattr(other, field) * weight)
+
+
+def _is_scan(name: str) -> bool:
+    return name.startswith(SCAN_NODE_PREFIX) or name in TABLE_SCAN_NODES
+
+
+def normalize_table_name(descriptor_table: str) -> Optional[str]:
+    """
+    Приводит описание таблицы из EXPLAIN ('catalog:' + описание таблицы коннектора, например
+    'quests:public.orders$data@42' или 'hive:tpch:orders') к виду catalog.schema.table, как в ProfiledQuery.tables.
+    """
+    if not descriptor_table:
+        return None
+    handle = re.split(r"[\s$@\[{(]", descriptor_table.strip(), maxsplit=1)[0]
+    parts = [part for part in re.split(r"[:.]", handle) if part]
+    return ".".join(parts).lower() if parts else None
+
+
+def _root_nodes(plan: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Логический план — одно дерево, распределенный — словарь фрагментов с деревьями."""
+    if "name" in plan or "children" in plan:
+        yield "", plan
+        return
+    for fragment_id, fragment in plan.items():
+        if isinstance(fragment, dict):
+            yield f"{fragment_id}.", fragment
+
+
+def flatten_plan(plan: Dict[str, Any]) -> List[PlanNode]:
+    """Обходит дерево EXPLAIN (FORMAT JSON) без рекурсии и возвращает узлы в порядке обхода."""
+    nodes = []
+    for prefix, root in _root_nodes(plan or {}):
+        stack = [(root, 0)]
+        while stack:
+            raw, depth = stack.pop()
+            name = str(raw.get("name", ""))
+            estimates = [e for e in raw.get("estimates") or [] if isinstance(e, dict)]
+            vector = PlanCostVector()
+            if estimates:
+                for field, key in _ESTIMATE_FIELDS.items():
+                    setattr(vector, field, _number(estimates[-1].get(key)))
+            table = None
+            if _is_scan(name):
+                descriptor = raw.get("descriptor") or {}
+                table = normalize_table_name(str(descriptor.get("table", "")))
+                # У составных узлов (ScanFilterProject) первая оценка относится к самому чтению таблицы.
+                vector.scanned_bytes = _number(estimates[0].get("outputSizeInBytes")) if estimates else 0.0
+            nodes.append(PlanNode(id=f"{prefix}{raw.get('id', '')}", name=name, depth=depth,
+                                  table=table, estimates=vector))
+            stack.extend((child, depth + 1) for child in reversed(raw.get("children") or []))
+    return nodes
+
+
+def analyze_plan(plan: Dict[str, Any]) -> PlanProfile:
+    """Строит профиль плана: суммарный вектор стоимости и векторы стоимости чтения каждой таблицы."""
+    nodes = flatten_plan(plan)
+    total = PlanCostVector()
+    tables: Dict[str, PlanCostVector] = defaultdict(PlanCostVector)
+    for node in nodes:
+        _add(total, node.estimates)
+        if node.table:
+            _add(tables[node.table], node.estimates)
+    return PlanProfile(nodes=nodes, total=total, tables=dict(tables))
+
+
+def query_cost(query: ProfiledQuery, metric: str = "time") -> float:
+    """
+    Стоимость запроса для приоритизации с учетом числа запусков.
+    'time' — время, сообщенное клиентом (run_quantity * execution_time); остальные метрики берутся
+    из оценок плана. Если плана нет, используется время.
+    """
+    if metric == "time" or query.plan_profile is None:
+        return query.run_quantity * query.execution_time
+    return query.run_quantity * getattr(query.plan_profile.total, metric)
+
+
+def aggregate_table_costs(queries: Iterable[ProfiledQuery]) -> Dict[str, PlanCostVector]:
+    """Суммарная оценочная стоимость чтения каждой таблицы по запросам, взвешенная числом запусков."""
+    tables: Dict[str, PlanCostVector] = defaultdict(PlanCostVector)
+    for query in queries:
+        if query.plan_profile is None:
+            continue
+        for table, vector in query.plan_profile.tables.items():
+            _add(tables[table], vector, weight=query.run_quantity)
+    return dict(tables)
@@ -0,0 +1,120 @@
+import hashlib
+import logging
+from functools import lru_cache
+from typing import Dict, Iterable
+
+import sqlglot
+from sqlglot import exp
+
+from optimizer_service.core.config import settings
+from optimizer_service.models.schemas import ParsedQuery, ParsedDDL
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=settings.PARSE_CACHE_SIZE)
+def parse_query(sql: str) -> ParsedQuery:
+    """
+    Разбирает SQL-запрос один раз и заранее вычисляет всё, что нужно детекторам.
+    Результат кэшируется по тексту запроса, повторные вызовы не запускают парсер.
+    """
+    ast = sqlglot.parse_one(sql, read="trino")
+
+    tables = []
+    for table in ast.find_all(exp.Table):
+        table = table.copy()
+        table.set('alias', None)
+        tables.append(table.sql())
+
+    columns = [column.this.sql() for column in ast.find_all(exp.Column) if column.this]
+
+    where = ast.find(exp.Where)
+    where_columns = []
+    if where:
+        where_columns = [column.this.sql() for column in where.find_all(exp.Column) if column.this]
+
+    select = ast.find(exp.Select)
+    has_select_star = bool(select) and any(isinstance(sel, exp.Star) for sel in select.expressions)
+
+    return ParsedQuery(
+        sql=sql,
+        ast=ast,
+        tables=tuple(tables),
+        columns=tuple(columns),
+        where_columns=tuple(where_columns),
+        joins=tuple(ast.find_all(exp.Join)),
+        where=where,
+        having=ast.find(exp.Having),
+        has_select_star=has_select_star,
+    )
+
+
+@lru_cache(maxsize=settings.PARSE_CACHE_SIZE)
+def normalize_sql(sql: str) -> str:
+    """
+    Приводит запрос к каноническому виду: единое форматирование, без комментариев,
+    идентификаторы в нижнем регистре. Запросы, отличающиеся только оформлением, совпадают.
+    """
+    return parse_query(sql).ast.sql(dialect="trino", normalize=True, comments=False)
+
+
+# Литералы в этих позициях меняют структуру результата (номера колонок GROUP BY/ORDER BY, размер выборки),
+# а не значения фильтров, поэтому остаются в отпечатке как есть
+_STRUCTURAL_LITERAL_PARENTS = (exp.Group, exp.Ordered, exp.Limit, exp.Offset, exp.Fetch)
+
+
+def _replace_literal(node: exp.Expression) -> exp.Expression:
+    if isinstance(node, exp.In) and node.expressions:
+        node.set("expressions", [exp.Placeholder()])
+        return node
+    if isinstance(node, exp.Literal) and not isinstance(node.parent, _STRUCTURAL_LITERAL_PARENTS):
+        return exp.Placeholder()
+    return node
+
+
+@lru_cache(maxsize=settings.PARSE_CACHE_SIZE)
+def query_fingerprint(sql: str) -> str:
+    """
+    Отпечаток шаблона запроса: литералы (даты, ID, строки) заменяются плейсхолдерами,
+    а списки IN сворачиваются в один элемент. Номера колонок в GROUP BY/ORDER BY и значения LIMIT/OFFSET/FETCH
+    сохраняются. Запросы, отличающиеся только литералами, получают один отпечаток.
+    """
+    try:
+        template = parse_query(sql).ast.transform(_replace_literal)
+        text = template.sql(dialect="trino", normalize=True, comments=False)
+    except Exception:
+        text = sql
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=settings.PARSE_CACHE_SIZE)
+def parse_ddl(statement: str) -> ParsedDDL:
+    """Разбирает CREATE TABLE и извлекает имя таблицы и список колонок."""
+    ast = sqlglot.parse_one(statement, read="trino")
+
+    target = ast.this
+    column_defs = []
+    if isinstance(target, exp.Schema):
+        column_defs = [col_def for col_def in target.expressions if isinstance(col_def, exp.ColumnDef)]
+        target = target.this
+
+    return ParsedDDL(
+        statement=statement,
+        ast=ast,
+        table_name=target.sql() if isinstance(target, exp.Table) else "",
+        column_names=tuple(col_def.this.sql() for col_def in column_defs),
+    )
+
+
+def build_ddl_map(statements: Iterable[str]) -> Dict[str, ParsedDDL]:
+    """Строит карту 'имя таблицы -> разобранный DDL'. Неразбираемые выражения пропускаются."""
+    ddl_map = {}
+    for statement in statements:
+        try:
+            parsed = parse_ddl(statement)
+        except Exception as e:
+            logger.warning("Не удалось разобрать DDL: %s. Пропускаю.", e)
+            continue
+        if parsed.table_name:
+            ddl_map[parsed.table_name] = parsed
+    return ddl_map
@@ -0,0 +1,84 @@
+import re
+from typing import List, Optional
+
+from optimizer_service.data_analyzer.plan_analysis import normalize_table_name
+from optimizer_service.models.schemas import OperatorProfile, RuntimeProfile
+
+_DURATION_UNITS_MS = {"ns": 1e-6, "us": 1e-3, "ms": 1.0, "s": 1e3, "m": 60e3, "h": 3600e3, "d": 86400e3}
+_SIZE_UNITS = {"B": 1, "kB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4, "PB": 1024 ** 5}
+
+_FRAGMENT_RE = re.compile(r"^Fragment (\d+)")
+_TREE_PREFIX_RE = re.compile(r"^[\s│├└─]*")
+_OPERATOR_RE = re.compile(r"^([A-Z][A-Za-z]*)(?:\[(.*)\])?$")
+_TABLE_RE = re.compile(r"\btable = ([^,\]\s]+)")
+_CPU_RE = re.compile(r"\bCPU: ([\d.]+)([a-z]+)")
+_WALL_RE = re.compile(r"\b(?:Scheduled|Wall): ([\d.]+)([a-z]+)")
+_ROWS_RE = re.compile(r"\b(Input|Output): (\d+) rows? \(([\d.]+)([kMGTP]?B)\)")
+
+
+def parse_duration_ms(value: str, unit: str) -> float:
+    return float(value) * _DURATION_UNITS_MS.get(unit, 0.0)
+
+
+def parse_data_size(value: str, unit: str) -> float:
+    return float(value) * _SIZE_UNITS.get(unit, 0)
+
+
+def parse_explain_analyze(text: str) -> RuntimeProfile:
+    """
+    Разбирает текстовый вывод EXPLAIN ANALYZE Trino в профиль по операторам.
+    Строки статистики фрагмента (до первого оператора) не учитываются, чтобы не считать время дважды.
+    """
+    operators: List[OperatorProfile] = []
+    fragment: Optional[str] = None
+    current: Optional[OperatorProfile] = None
+    for raw_line in text.splitlines():
+        line = _TREE_PREFIX_RE.sub("", raw_line).strip()
+        if not line:
+            continue
+        fragment_match = _FRAGMENT_RE.match(line)
+        if fragment_match:
+            fragment, current = fragment_match.group(1), None
+            continue
+        operator_match = _OPERATOR_RE.match(line)
+        if operator_match:
+            details = operator_match.group(2) or ""
+            table_match = _TABLE_RE.search(details)
+            current = OperatorProfile(
+                fragment=fragment,
+                name=operator_match.group(1),
+                table=normalize_table_name(table_match.group(1)) if table_match else None,
+            )
+            operators.append(current)
+            continue
+        if current is None:
+            continue
+        cpu_match = _CPU_RE.search(line)
+        if cpu_match:
+            current.cpu_ms = parse_duration_ms(*cpu_match.groups())
+        wall_match = _WALL_RE.search(line)
+        if wall_match:
+            current.wall_ms = parse_duration_ms(*wall_match.groups())
+        for direction, rows, size, unit in _ROWS_RE.findall(line):
+            if direction == "Input":
+                current.input_rows, current.input_bytes = int(rows), parse_data_size(size, unit)
+            else:
+                current.output_rows, current.output_bytes = int(rows), parse_data_size(size, unit)
+
+    operators.sort(key=lambda op: op.cpu_ms, reverse=True)
+    return RuntimeProfile(
+        operators=operators,
+        total_cpu_ms=sum(op.cpu_ms for op in operators),
+        total_wall_ms=sum(op.wall_ms for op in operators),
+    )
+
+
+def describe_hot_spot(queryid: str, profile: RuntimeProfile) -> Optional[str]:
+    """Описание самого дорогого по CPU оператора для сводки анализа (на английском, как сообщения детекторов)."""
+    if not profile.operators or profile.total_cpu_ms <= 0:
+        return None
+    hot = profile.operators[0]
+    target = f" on '{hot.table}'" if hot.table else ""
+    return (f"Measured hot spot in query {queryid}: {hot.name}{target} takes "
+            f"{hot.cpu_ms / profile.total_cpu_ms:.0%} of CPU time ({hot.cpu_ms:.0f} ms), "
+            f"input {hot.input_rows} rows ({hot.input_bytes / 1024 ** 2:.1f} MB).")
@@ -0,0 +1,117 @@
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import OptimizeError, ParseError
+from sqlglot.optimizer.qualify import qualify
+from sqlglot.schema import MappingSchema
+
+from optimizer_service.data_analyzer.query_parser import build_ddl_map
+
+
+def _table_key(table: exp.Table) -> str:
+    """Trino не различает регистр идентификаторов, поэтому таблицы сравниваются без кавычек в нижнем регистре."""
+    return ".".join(part for part in (table.catalog, table.db, table.name) if part).lower()
+
+
+class StaticSQLValidator:
+    """
+    Локальная проверка ответа LLM без обращения к Trino.
+    Схема строится из DDL задачи и дополняется таблицами, которые создает сам ответ. Каждая миграция
+    и каждый запрос разрешаются квалификатором sqlglot по этой схеме: неизвестные таблицы и колонки,
+    а также несовпадение числа колонок в INSERT ... SELECT отсекаются за микросекунды.
+    Таблицы из каталогов и схем, о которых в DDL ничего нет, не проверяются — их оставляем Trino.
+    """
+
+    def __init__(self, source_ddl: Iterable[str]):
+        self._source_tables: Dict[str, Dict[str, str]] = {
+            _table_key(self._create_target(ddl.ast)): self._column_types(ddl.ast)
+            for ddl in build_ddl_map(source_ddl).values()
+        }
+
+    @staticmethod
+    def _create_target(create_ast: exp.Expression) -> exp.Table:
+        return create_ast.this.this if isinstance(create_ast.this, exp.Schema) else create_ast.this
+
+    @staticmethod
+    def _column_types(create_ast: exp.Expression) -> Dict[str, str]:
+        schema = create_ast.this
+        if isinstance(schema, exp.Schema):
+            return {
+                col_def.this.name.lower(): col_def.kind.sql(dialect="trino") if col_def.kind else "UNKNOWN"
+                for col_def in schema.expressions if isinstance(col_def, exp.ColumnDef)
+            }
+        query = create_ast.expression
+        if isinstance(query, exp.Query):
+            return {name.lower(): "UNKNOWN" for name in query.named_selects}
+        return {}
+
+    def validate(self, ddl_statements: list, migration_statements: list,
+                 query_statements: list) -> Tuple[bool, str, str]:
+        """Возвращает (валидно ли, сообщение об ошибке, ошибочный SQL) — в формате validate_sql_list."""
+        tables = dict(self._source_tables)
+        for item in ddl_statements:
+            sql = item["statement"]
+            try:
+                ast = sqlglot.parse_one(sql, read="trino")
+            except ParseError as e:
+                return False, f"DDL не разбирается: {e}", sql
+            if isinstance(ast, exp.Create) and ast.kind == "TABLE":
+                tables[_table_key(self._create_target(ast))] = self._column_types(ast)
+
+        schema, namespaces = self._build_schema(tables)
+        statements = [item["statement"] for item in migration_statements] + \
+                     [item["query"] for item in query_statements]
+        for sql in statements:
+            try:
+                ast = sqlglot.parse_one(sql, read="trino")
+            except ParseError as e:
+                return False, f"SQL не разбирается: {e}", sql
+            error = self._check_statement(ast, tables, schema, namespaces)
+            if error:
+                return False, error, sql
+        return True, "", ""
+
+    @staticmethod
+    def _build_schema(tables: Dict[str, Dict[str, str]]) -> Tuple[MappingSchema, Set[Tuple[str, str]]]:
+        nested: Dict[str, Dict[str, Dict[str, Dict[str, str]]]] = {}
+        for name, columns in tables.items():
+            table = exp.to_table(name, dialect="trino")
+            if table.catalog and table.db and columns:
+                nested.setdefault(table.catalog, {}).setdefault(table.db, {})[table.name] = columns
+        namespaces = {(catalog, db) for catalog, dbs in nested.items() for db in dbs}
+        return MappingSchema(nested, dialect="trino"), namespaces
+
+    @staticmethod
+    def _check_statement(ast: exp.Expression, tables: Dict[str, Dict[str, str]], schema: MappingSchema,
+                         namespaces: Set[Tuple[str, str]]) -> Optional[str]:
+        cte_names = {cte.alias_or_name for cte in ast.find_all(exp.CTE)}
+        for table in ast.find_all(exp.Table):
+            if not table.db and table.name in cte_names:
+                continue
+            if not (table.catalog and table.db):
+                return None
+            name = _table_key(table)
+            if name in tables and tables[name]:
+                continue
+            if (table.catalog.lower(), table.db.lower()) in namespaces and name not in tables:
+                return f"Таблица {name} не найдена ни в исходном DDL, ни в DDL ответа"
+            return None
+
+        try:
+            qualified = qualify(ast.copy(), schema=schema, dialect="trino", validate_qualify_columns=True)
+        except OptimizeError as e:
+            return f"Ошибка разрешения колонок: {e}"
+
+        if isinstance(qualified, exp.Insert) and isinstance(qualified.expression, exp.Query):
+            target = qualified.this
+            explicit_columns = target.expressions if isinstance(target, exp.Schema) else []
+            if isinstance(target, exp.Schema):
+                target = target.this
+            target_name = _table_key(target)
+            expected = len(explicit_columns) or len(tables.get(target_name, {}))
+            actual = len(qualified.expression.selects)
+            if expected and actual != expected:
+                return (f"Число колонок в SELECT миграции ({actual}) не совпадает "
+                        f"с числом колонок таблицы {target_name} ({expected})")
+        return None
@@ -1,6 +1,140 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import requests
 import trino
 from urllib.parse import urlparse, parse_qs
 
+from optimizer_service.core.config import settings
+logger = logging.getLogger(__name__)
+
+BROKEN_CONNECTION_ERRORS = (requests.exceptions.ConnectionError, trino.exceptions.TrinoConnectionError)
+
+
+class TrinoConnectionPool:
+    """
+    Ограниченный пул соединений с Trino.
+    Соединения создаются лениво и возвращаются в пул после использования,
+    одновременно выдается не более max_size соединений. Каждое соединение держит собственную
+    keep-alive HTTP-сессию, поэтому TLS и аутентификация не повторяются при переиспользовании.
+    Соединения, простаивающие дольше idle_timeout_seconds, закрываются; перед выдачей соединения,
+    простоявшего дольше healthcheck_after_seconds, выполняется проверка SELECT 1.
+    """
+
+    def __init__(self, factory: Callable[[], trino.dbapi.Connection], max_size: int,
+                 idle_timeout_seconds: float = 300.0, healthcheck_after_seconds: float = 60.0):
+        self._factory = factory
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle_timeout_seconds = idle_timeout_seconds
+        self._healthcheck_after_seconds = healthcheck_after_seconds
+
+    @contextmanager
+    def connection(self) -> Iterator[trino.dbapi.Connection]:
+        """Выдает соединение из пула, при необходимости ожидая освобождения слота."""
+        self._slots.acquire()
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        try:
+            yield conn
+        except BROKEN_CONNECTION_ERRORS:
+            self._close_connection(conn)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            self._slots.release()
+
+    def _checkout(self) -> trino.dbapi.Connection:
+        self.evict_idle()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self._healthcheck_after_seconds or self._is_healthy(conn):
+                return conn
+            self._close_connection(conn)
+        return self._factory()
+
+    @staticmethod
+    def _is_healthy(conn: trino.dbapi.Connection) -> bool:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return True
+        except Exception as e:
+            logger.warning("Соединение с Trino не прошло проверку: %s. Переподключаюсь.", e)
+            return False
+
+    @staticmethod
+    def _close_connection(conn: trino.dbapi.Connection):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def evict_idle(self):
+        """Закрывает соединения, простаивающие дольше idle_timeout_seconds."""
+        deadline = time.monotonic() - self._idle_timeout_seconds
+        expired = []
+        with self._lock:
+            while self._idle and self._idle[0][1] < deadline:
+                expired.append(self._idle.popleft()[0])
+        for conn in expired:
+            self._close_connection(conn)
+
+    def close(self):
+        """Закрывает все простаивающие соединения."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._close_connection(conn)
+
+
+_shared_pools: Dict[Tuple, TrinoConnectionPool] = {}
+_shared_pools_lock = threading.Lock()
+
+
+def get_shared_pool(key: Tuple, factory: Callable[[], trino.dbapi.Connection]) -> TrinoConnectionPool:
+    """
+    Возвращает пул, общий для всех коннекторов процесса с одинаковыми параметрами подключения.
+    Благодаря этому задачи Celery в одном воркере переиспользуют уже установленные соединения.
+    """
+    with _shared_pools_lock:
+        pool = _shared_pools.get(key)
+        if pool is None:
+            pool = TrinoConnectionPool(
+                factory=factory,
+                max_size=settings.TRINO_POOL_SIZE,
+                idle_timeout_seconds=settings.TRINO_POOL_IDLE_TIMEOUT_SECONDS,
+                healthcheck_after_seconds=settings.TRINO_POOL_HEALTHCHECK_AFTER_SECONDS,
+            )
+            _shared_pools[key] = pool
+        return pool
+
+
+def close_shared_pools():
+    """Закрывает все общие пулы процесса (вызывается при остановке воркера)."""
+    with _shared_pools_lock:
+        pools = list(_shared_pools.values())
+        _shared_pools.clear()
+    for pool in pools:
+        pool.close()
+
 
 class TrinoConnector:
     """
@@ -39,9 +173,17 @@ class TrinoConnector:
             "schema": schema,
         }
 
-    def connect(self) -> trino.dbapi.Connection:
+    @property
+    def target(self) -> str:
+        """Идентификатор кластера и каталога без учетных данных, используется в ключах кэшей."""
+        params = self._parsed_params
+        return f"{params['host']}:{params['port']}/{params['catalog']}/{params['schema']}"
+
+    def connect(self, request_timeout: float = 30.0,
+                session_properties: Optional[Dict[str, str]] = None) -> trino.dbapi.Connection:
         """
         Создает и возвращает объект соединения с Trino.
+        session_properties задают свойства сессии Trino (например, лимит времени выполнения запроса).
         """
         try:
             conn = trino.dbapi.connect(
@@ -52,9 +194,34 @@ class TrinoConnector:
                 auth=trino.auth.BasicAuthentication(self._parsed_params["user"], self._parsed_params["password"]),
                 catalog=self._parsed_params["catalog"],
                 schema=self._parsed_params["schema"],
+                request_timeout=request_timeout,
+                session_properties=session_properties,
             )
-            print(f"Успешное подключение к Trino хосту: {self._parsed_params['host']}")
+            logger.debug("Успешное подключение к Trino хосту: %s", self._parsed_params['host'])
             return conn
         except Exception as e:
-            print(f"Ошибка подключения к Trino: {e}")
-            raise
\ No newline at end of file
+            logger.error("Ошибка подключения к Trino: %s", e)
+            raise
+
+    @contextmanager
+    def connection(self, session_properties: Optional[Dict[str, str]] = None,
+                   request_timeout: Optional[float] = None) -> Iterator[trino.dbapi.Connection]:
+        """
+        Выдает соединение из общего пула процесса для этих параметров подключения.
+        В отличие от connect(), соединение не закрывается после использования,
+        а переиспользуется следующими вызовами, в том числе из других задач.
+        Лимит времени соблюдается и на стороне Trino: свойство сессии query_max_run_time по умолчанию
+        равно EXPLAIN_TIMEOUT_SECONDS, иначе запрос продолжил бы выполняться после таймаута клиента.
+        Соединения с особыми свойствами сессии или таймаутом живут в отдельном пуле.
+        """
+        params = self._parsed_params
+        timeout = request_timeout or settings.EXPLAIN_TIMEOUT_SECONDS
+        properties = {"query_max_run_time": f"{settings.EXPLAIN_TIMEOUT_SECONDS:g}s", **(session_properties or {})}
+        # Пароль не хранится в ключе пула открытым текстом, но смена пароля все равно дает новый пул
+        password_digest = hashlib.sha256((params["password"] or "").encode()).hexdigest()
+        pool_key = (params["host"], params["port"], params["user"], password_digest,
+                    params["catalog"], params["schema"], tuple(sorted(properties.items())), timeout)
+        pool = get_shared_pool(pool_key, lambda: self.connect(request_timeout=timeout,
+                                                              session_properties=properties))
+        with pool.connection() as conn:
+            yield conn
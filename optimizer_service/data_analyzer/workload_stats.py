@@ -0,0 +1,60 @@
+import heapq
+from collections import Counter, defaultdict
+from itertools import combinations
+from typing import Dict, List
+
+from optimizer_service.data_analyzer.query_parser import parse_query
+from optimizer_service.models.schemas import ProfiledQuery
+
+
+class WorkloadStats:
+    """
+    Агрегированные счетчики по всей нагрузке, накапливаемые инкрементально.
+    Память зависит только от числа различных таблиц и колонок, а не от числа запросов.
+    """
+
+    def __init__(self):
+        self.query_count = 0
+        self.table_usage: Counter = Counter()
+        self.join_pairs: Counter = Counter()
+        self.filter_columns: Dict[str, Counter] = defaultdict(Counter)
+
+    def observe(self, sql: str):
+        """Учитывает один запрос (шаблон). Неразбираемые запросы пропускаются."""
+        try:
+            parsed = parse_query(sql)
+        except Exception:
+            return
+
+        self.query_count += 1
+        self.table_usage.update(parsed.tables)
+        self.join_pairs.update(combinations(sorted(parsed.tables), 2))
+        for table in set(parsed.tables):
+            self.filter_columns[table].update(parsed.where_columns)
+
+
+class TopKQueries:
+    """
+    Потоковый отбор K самых дорогих запросов на куче.
+    Запросы, не попадающие в топ, отбрасываются сразу вместе со своими EXPLAIN-планами.
+    При равной стоимости предпочтение отдается запросу, пришедшему раньше.
+    """
+
+    def __init__(self, k: int):
+        self._k = k
+        self._heap = []
+        self._seen = 0
+
+    def push(self, query: ProfiledQuery):
+        entry = (query.cost, -self._seen, query)
+        self._seen += 1
+        if self._k <= 0:
+            return
+        if len(self._heap) < self._k:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+
+    def result(self) -> List[ProfiledQuery]:
+        """Возвращает отобранные запросы по убыванию стоимости."""
+        return [entry[2] for entry in sorted(self._heap, key=lambda e: e[:2], reverse=True)]
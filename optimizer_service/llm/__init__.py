@@ -1,11 +1,12 @@
 from optimizer_service.core.config import settings
-from .base_provider import BaseLLMProvider
+from .base_provider import BaseLLMProvider, AsyncLLMProvider, Prompt
+from .cached_provider import CachingLLMProvider
 from .gemma_provider import GemmaAPIProvider
 from .llama_cpp_provider import LlamaCppProvider
 from .vllm_provider import VLLMProvider
 
 
-def get_llm_provider() -> BaseLLMProvider:
+def _create_provider() -> BaseLLMProvider:
     """
     Фабричная функция, которая создает и возвращает нужный экземпляр LLM-провайдера
     в зависимости от настроек.
@@ -14,12 +15,14 @@ def get_llm_provider() -> BaseLLMProvider:
     if provider_type == "llama_cpp":
         return LlamaCppProvider(
             host=settings.LLAMA_HOST,
-            port=settings.LLAMA_PORT
+            port=settings.LLAMA_PORT,
+            guided_decoding=settings.LLM_GUIDED_DECODING,
         )
     elif provider_type == "vllm":
         return VLLMProvider(
             host=settings.VLLM_HOST,
             port=settings.VLLM_PORT,
+            guided_decoding=settings.LLM_GUIDED_DECODING,
         )
     elif provider_type == "gemma":
         return GemmaAPIProvider(
@@ -29,4 +32,11 @@ def get_llm_provider() -> BaseLLMProvider:
     else:
         raise ValueError(f"Неизвестный LLM_PROVIDER: {settings.LLM_PROVIDER}")
 
+def get_llm_provider() -> BaseLLMProvider:
+    """Создает провайдер из настроек и при включенном LLM_CACHE_ENABLED оборачивает его кэшем ответов."""
+    provider = _create_provider()
+    if settings.LLM_CACHE_ENABLED:
+        return CachingLLMProvider(provider)
+    return provider
+
 llm_provider = get_llm_provider()
\ No newline at end of file
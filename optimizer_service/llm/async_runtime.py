@@ -0,0 +1,57 @@
+import asyncio
+import contextvars
+import threading
+import weakref
+from typing import Any, Coroutine, Optional
+
+import httpx
+
+from optimizer_service.core.config import settings
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Фоновый цикл событий процесса, в котором выполняются асинхронные вызовы синхронных потребителей."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+        return _loop
+
+
+def run_sync(coro: Coroutine[Any, Any, Any]) -> Any:
+    """
+    Синхронный адаптер: выполняет корутину в общем фоновом цикле и ждет результата.
+    Все генерации процесса мультиплексируются в одном цикле поверх общего пула соединений,
+    поэтому ожидающий поток не держит собственное соединение.
+    Переменные контекста вызывающего потока (например, текущий этап трассы) переносятся в корутину.
+    """
+    return asyncio.run_coroutine_threadsafe(_in_context(coro, contextvars.copy_context()), _background_loop()).result()
+
+
+async def _in_context(coro: Coroutine[Any, Any, Any], context: contextvars.Context) -> Any:
+    # Задача цикла получает копию контекста фонового потока, поэтому значения вызывающего потока выставляются в ней
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Возвращает пул HTTP-соединений с keep-alive для текущего цикла событий.
+    Клиент httpx привязан к циклу, в котором открыты его соединения, поэтому пул заводится на каждый цикл.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_SECONDS,
+        ))
+        _clients[loop] = client
+    return client
@@ -1,4 +1,37 @@
+import asyncio
+import json
+import logging
 from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, Optional, Union
+
+from .async_runtime import run_sync
+
+logger = logging.getLogger(__name__)
+
+# Промпт — либо одна строка, либо диалог из сообщений {"role": "system"|"user"|"assistant", "content": ...}
+Prompt = Union[str, List[Dict[str, str]]]
+
+
+def as_messages(prompt: Prompt) -> List[Dict[str, str]]:
+    """Приводит промпт к списку сообщений чата."""
+    if isinstance(prompt, str):
+        return [{"role": "user", "content": prompt}]
+    return prompt
+
+
+def render_prompt(prompt: Prompt) -> str:
+    """
+    Разворачивает диалог в один текст для эндпоинтов без чат-шаблона.
+    Сообщения идут в исходном порядке, поэтому общий префикс диалогов остается общим префиксом текста.
+    """
+    if isinstance(prompt, str):
+        return prompt
+    parts = [
+        message["content"] if message["role"] == "system" else f"### {message['role'].capitalize()}:\n{message['content']}"
+        for message in prompt
+    ]
+    return "\n\n".join(parts) + "\n\n### Assistant:\n"
+
 
 class BaseLLMProvider(ABC):
     """
@@ -6,8 +39,80 @@ class BaseLLMProvider(ABC):
     Определяет единый интерфейс для взаимодействия с языковыми моделями.
     """
     @abstractmethod
-    def get_completion(self, prompt: str) -> dict:
+    def get_completion(self, prompt: Prompt) -> dict:
         """
         Отправляет промпт в API и возвращает ответ в виде словаря.
         """
-        pass
\ No newline at end of file
+        pass
+
+    async def aget_completion(self, prompt: Prompt) -> dict:
+        """
+        Асинхронный вариант get_completion. По умолчанию выполняет синхронный вызов в отдельном потоке;
+        провайдеры с неблокирующим HTTP-клиентом переопределяют его (см. AsyncLLMProvider).
+        """
+        return await asyncio.to_thread(self.get_completion, prompt)
+
+    async def aiter_completions(self, prompt: Prompt, n: int) -> AsyncIterator[dict]:
+        """
+        Запрашивает n вариантов ответа одновременно и отдает их по мере готовности.
+        Неудачные варианты пропускаются; если неудачны все, пробрасывается последняя ошибка.
+        При закрытии генератора (например, после первого подходящего варианта) оставшиеся запросы отменяются.
+        """
+        tasks = [asyncio.ensure_future(self.aget_completion(prompt)) for _ in range(n)]
+        last_error = None
+        yielded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    response = await next_done
+                except Exception as e:
+                    logger.warning("Вариант ответа LLM завершился с ошибкой: %s", e)
+                    last_error = e
+                    continue
+                yielded += 1
+                yield response
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if not yielded and last_error is not None:
+            raise last_error
+
+    # Провайдеры, умеющие отдавать ответ по мере генерации, выставляют True и переопределяют astream_completion
+    supports_streaming = False
+
+    async def astream_completion(self, prompt: Prompt) -> AsyncIterator[str]:
+        """
+        Отдает текст ответа фрагментами по мере генерации.
+        По умолчанию дожидается полного ответа aget_completion и отдает его одним фрагментом в виде JSON,
+        поэтому потоковый путь работает с любым провайдером, но без раннего прерывания генерации.
+        """
+        yield json.dumps(await self.aget_completion(prompt), ensure_ascii=False)
+
+    def cache_identity(self) -> dict:
+        """
+        Описание провайдера, модели и параметров генерации, от которых зависит ответ.
+        Используется как часть ключа кэша ответов.
+        """
+        return {"provider": self.__class__.__name__}
+
+    def get_cached_completion(self, prompt: Prompt) -> Optional[dict]:
+        """Возвращает ранее провалидированный ответ на этот промпт, если провайдер его кэширует."""
+        return None
+
+    def record_validated_completion(self, prompt: Prompt, response: dict):
+        """Сообщает провайдеру, что ответ на промпт прошел валидацию SQL."""
+        pass
+
+
+class AsyncLLMProvider(BaseLLMProvider):
+    """
+    Базовый класс для провайдеров с нативной асинхронной реализацией.
+    Синхронный get_completion выполняет aget_completion в общем фоновом цикле событий.
+    """
+    @abstractmethod
+    async def aget_completion(self, prompt: Prompt) -> dict:
+        pass
+
+    def get_completion(self, prompt: Prompt) -> dict:
+        return run_sync(self.aget_completion(prompt))
@@ -0,0 +1,66 @@
+import hashlib
+import json
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
+
+from optimizer_service.core.cache import RedisCache
+from optimizer_service.core.config import settings
+from .base_provider import BaseLLMProvider, Prompt
+
+
+class CachingLLMProvider(BaseLLMProvider):
+    """
+    Декоратор над LLM-провайдером, кэширующий ответы в Redis.
+    Ключ — провайдер, модель, параметры генерации и хэш промпта.
+    Сохраняются только ответы, прошедшие validate_sql_list (агент сообщает о них
+    через record_validated_completion), поэтому невалидный ответ никогда не будет переиспользован.
+    """
+
+    def __init__(self, provider: BaseLLMProvider, cache: Optional[RedisCache] = None):
+        self._provider = provider
+        self._cache = cache or RedisCache(
+            namespace="llm-response",
+            ttl_seconds=settings.LLM_CACHE_TTL_SECONDS,
+            max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+        )
+
+    def make_key(self, prompt: Prompt) -> str:
+        identity = json.dumps(self._provider.cache_identity(), sort_keys=True)
+        prompt_text = prompt if isinstance(prompt, str) else json.dumps(prompt, ensure_ascii=False, sort_keys=True)
+        digest = hashlib.sha256()
+        for part in (identity, prompt_text):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get_completion(self, prompt: Prompt) -> dict:
+        return self._provider.get_completion(prompt)
+
+    async def aget_completion(self, prompt: Prompt) -> dict:
+        return await self._provider.aget_completion(prompt)
+
+    async def aiter_completions(self, prompt: Prompt, n: int) -> AsyncIterator[dict]:
+        async with aclosing(self._provider.aiter_completions(prompt, n)) as candidates:
+            async for candidate in candidates:
+                yield candidate
+
+    @property
+    def supports_streaming(self) -> bool:
+        return self._provider.supports_streaming
+
+    async def astream_completion(self, prompt: Prompt) -> AsyncIterator[str]:
+        async with aclosing(self._provider.astream_completion(prompt)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    def cache_identity(self) -> dict:
+        return self._provider.cache_identity()
+
+    def get_cached_completion(self, prompt: Prompt) -> Optional[dict]:
+        return self._cache.get(self.make_key(prompt))
+
+    def record_validated_completion(self, prompt: Prompt, response: dict):
+        self._cache.set(self.make_key(prompt), response)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
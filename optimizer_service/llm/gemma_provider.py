@@ -1,10 +1,15 @@
-import time
-import requests
+import asyncio
+import httpx
 import json
-from .base_provider import BaseLLMProvider
+import logging
+from .async_runtime import get_http_client
+from .base_provider import AsyncLLMProvider, Prompt, as_messages
 from optimizer_service.core.config import settings
+from optimizer_service.core.observability import RETRIES, llm_request, record_llm_tokens
 
-class GemmaAPIProvider(BaseLLMProvider):
+logger = logging.getLogger(__name__)
+
+class GemmaAPIProvider(AsyncLLMProvider):
     """
     Реализация провайдера для облачного API Google Gemma.
     """
@@ -13,45 +18,73 @@ class GemmaAPIProvider(BaseLLMProvider):
         self.model_name = "gemma-3-27b-it"
         self.api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.model_name}:generateContent"
 
-    def get_completion(self, prompt: str) -> dict:
+    def cache_identity(self) -> dict:
+        return {"provider": self.__class__.__name__, "model": self.model_name}
+
+    @staticmethod
+    def _build_contents(prompt: Prompt) -> list:
+        """
+        Переводит диалог в формат contents. Gemma не поддерживает системные инструкции,
+        поэтому системное сообщение присоединяется к первой реплике пользователя.
+        """
+        contents = []
+        system_text = ""
+        for message in as_messages(prompt):
+            if message["role"] == "system":
+                system_text += message["content"] + "\n\n"
+                continue
+            text = message["content"]
+            if system_text and message["role"] == "user":
+                text, system_text = system_text + text, ""
+            role = "model" if message["role"] == "assistant" else "user"
+            contents.append({"role": role, "parts": [{"text": text}]})
+        return contents
+
+    async def aget_completion(self, prompt: Prompt) -> dict:
         """
         Отправляет промпт в API и возвращает ответ в виде словаря.
         Реализует логику повторных попыток с экспоненциальной выдержкой.
+        Соединение берется из общего пула с keep-alive, ожидание ответа не занимает поток.
         """
         headers = {"Content-Type": "application/json"}
-        payload = {"contents": [{"parts": [{"text": prompt}]}]}
+        payload = {"contents": self._build_contents(prompt)}
 
         max_retries = 3
         base_delay = 5
 
         for attempt in range(max_retries):
             try:
-                response = requests.post(
-                    self.api_url,
-                    params={"key": self.api_key},
-                    headers=headers,
-                    json=payload,
-                    timeout=180
-                )
-                response.raise_for_status()
-
-                raw_text = response.json()['candidates'][0]['content']['parts'][0]['text']
+                with llm_request("gemma", "single"):
+                    response = await get_http_client().post(
+                        self.api_url,
+                        params={"key": self.api_key},
+                        headers=headers,
+                        json=payload,
+                        timeout=180
+                    )
+                    response.raise_for_status()
+
+                response_json = response.json()
+                usage = response_json.get('usageMetadata') or {}
+                record_llm_tokens("gemma", usage.get('promptTokenCount'), usage.get('candidatesTokenCount'))
+                raw_text = response_json['candidates'][0]['content']['parts'][0]['text']
                 if raw_text.strip().startswith("```json"):
                     raw_text = raw_text.strip()[7:-3]
 
                 return json.loads(raw_text)
 
-            except requests.exceptions.HTTPError as e:
+            except httpx.HTTPStatusError as e:
                 if e.response.status_code == 429:
                     delay = base_delay * (2 ** attempt)
-                    print(f"Получен статус 429 (Too Many Requests). Повторная попытка через {delay} сек...")
-                    time.sleep(delay)
+                    logger.warning("Получен статус 429 (Too Many Requests). Повторная попытка через %s сек...", delay)
+                    RETRIES.labels(component="llm_http").inc()
+                    await asyncio.sleep(delay)
                     continue
                 else:
-                    print(f"HTTP ошибка при вызове LLM API: {e}")
+                    logger.error("HTTP ошибка при вызове LLM API: %s", e)
                     raise
-            except (requests.exceptions.RequestException, json.JSONDecodeError, KeyError, IndexError) as e:
-                print(f"Ошибка при вызове или парсинге ответа LLM: {e}")
+            except (httpx.HTTPError, json.JSONDecodeError, KeyError, IndexError) as e:
+                logger.error("Ошибка при вызове или парсинге ответа LLM: %s", e)
                 raise
 
         raise Exception("Не удалось получить ответ от LLM API после нескольких попыток.")
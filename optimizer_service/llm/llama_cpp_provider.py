@@ -1,33 +1,53 @@
-import requests
 import json
-from .base_provider import BaseLLMProvider
+import logging
+from typing import AsyncIterator
+from optimizer_service.core.observability import llm_request, record_llm_tokens
+from .async_runtime import get_http_client
+from .base_provider import AsyncLLMProvider, Prompt, render_prompt
+from .output_schema import optimization_json_schema
 
+logger = logging.getLogger(__name__)
 
-class LlamaCppProvider(BaseLLMProvider):
+
+class LlamaCppProvider(AsyncLLMProvider):
     """
     Реализация провайдера для локального сервера llama-cpp-python.
     """
 
-    def __init__(self, host: str = "llama-cpp", port: int = 8000):
+    supports_streaming = True
+
+    def __init__(self, host: str = "llama-cpp", port: int = 8000, guided_decoding: bool = True):
         self.api_url = f"http://{host}:{port}/completion"
-        print(f"Инициализирован LlamaCppProvider на {self.api_url}")
+        self.generation_params = {"n_predict": 2048, "temperature": 0.1}
+        self.guided_decoding = guided_decoding
+        logger.info("Инициализирован LlamaCppProvider на %s", self.api_url)
+
+    def cache_identity(self) -> dict:
+        # llama-cpp обслуживает одну модель на сервер, поэтому модель определяется адресом сервера
+        return {"provider": self.__class__.__name__, "endpoint": self.api_url, **self.generation_params,
+                "guided_decoding": self.guided_decoding}
 
-    def get_completion(self, prompt: str) -> dict:
+    def _build_payload(self, prompt: Prompt, stream: bool) -> dict:
+        # cache_prompt: сервер переиспользует KV-кэш общего префикса с предыдущим запросом
+        payload = {"prompt": render_prompt(prompt), **self.generation_params, "stream": stream, "cache_prompt": True}
+        if self.guided_decoding:
+            # llama.cpp компилирует схему в GBNF-грамматику и ограничивает выборку токенов
+            payload["json_schema"] = optimization_json_schema()
+        else:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+
+    async def aget_completion(self, prompt: Prompt) -> dict:
         headers = {"Content-Type": "application/json"}
-        payload = {
-            "prompt": prompt,
-            "n_predict": 2048,
-            "temperature": 0.1,
-            "response_format": {
-                "type": "json_object"
-            }
-        }
+        payload = self._build_payload(prompt, stream=False)
 
         try:
-            response = requests.post(self.api_url, headers=headers, json=payload, timeout=300)
-            response.raise_for_status()
+            with llm_request("llama_cpp", "single"):
+                response = await get_http_client().post(self.api_url, headers=headers, json=payload, timeout=300)
+                response.raise_for_status()
 
             response_json = response.json()
+            self._record_usage(response_json)
             raw_text = response_json.get('content', '')
 
             if raw_text.strip().startswith("```json"):
@@ -39,5 +59,29 @@ class LlamaCppProvider(BaseLLMProvider):
 
             return json.loads(json_part)
         except Exception as e:
-            print(f"Ошибка при вызове локального llama-cpp API: {e}")
-            raise
\ No newline at end of file
+            logger.error("Ошибка при вызове локального llama-cpp API: %s", e)
+            raise
+
+    async def astream_completion(self, prompt: Prompt) -> AsyncIterator[str]:
+        """
+        Отдает текст ответа по мере генерации (режим stream у /completion, формат SSE).
+        Закрытие генератора разрывает HTTP-соединение, и сервер прекращает генерацию.
+        """
+        payload = self._build_payload(prompt, stream=True)
+        with llm_request("llama_cpp", "stream"):
+            async with get_http_client().stream("POST", self.api_url, json=payload, timeout=300) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[len("data: "):])
+                    if event.get("content"):
+                        yield event["content"]
+                    if event.get("stop"):
+                        self._record_usage(event)
+                        break
+
+    @staticmethod
+    def _record_usage(response_json: dict):
+        # Итоговый ответ /completion содержит число обработанных токенов промпта и сгенерированных токенов
+        record_llm_tokens("llama_cpp", response_json.get("tokens_evaluated"), response_json.get("tokens_predicted"))
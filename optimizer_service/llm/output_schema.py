@@ -0,0 +1,12 @@
+from functools import lru_cache
+
+from optimizer_service.models.schemas import GeneratedOptimization
+
+
+@lru_cache(maxsize=1)
+def optimization_json_schema() -> dict:
+    """
+    JSON Schema ответа LLM для ограниченного (guided) декодирования.
+    Сервер модели строит по ней грамматику, и сгенерированный текст всегда является корректным JSON нужной формы.
+    """
+    return GeneratedOptimization.model_json_schema()
@@ -169,4 +169,50 @@ Adapt the "GOLDEN EXAMPLE SOLUTION" to the "CURRENT CONTEXT".
 - Preserve all Trino/Iceberg specifics from the example (`WITH (partitioning = ...)`).
 
 Return ONLY the final JSON object without any explanations or markdown formatting.
-"""
\ No newline at end of file
+"""
+
+# Промпт V5 разделен на неизменяемый префикс и контекст задачи.
+# Префикс (инструкции и эталонный пример детектора) одинаков для всех задач с тем же детектором
+# и идет первым сообщением, поэтому vLLM/llama.cpp переиспользуют его KV-кэш (prefix caching).
+# Все, что меняется от задачи к задаче, вынесено в конец, а исправления отправляются следующими репликами диалога.
+PATTERN_SYSTEM_PROMPT_TEMPLATE = """You are a world-class Trino data architect. An automated performance analysis has been performed,
+and your task is to generate a solution based on its findings.
+
+# GOLDEN EXAMPLE SOLUTION FROM KNOWLEDGE BASE
+Here is an ideal solution example for this type of problem. Use it as the primary template for the response structure and format:
+```json
+{example_solution}
+```
+
+# YOUR TASK
+Adapt the "GOLDEN EXAMPLE SOLUTION" to the context given in the next message.
+- Replace placeholders like `table1`, `col_a` with actual table and column names from the problematic queries.
+- Ensure the `queryid` in your response matches the ID of the most expensive query named in the context.
+- Preserve all Trino/Iceberg specifics from the example (`WITH (partitioning = ...)`).
+
+Return ONLY the final JSON object without any explanations or markdown formatting.
+"""
+
+PATTERN_CONTEXT_PROMPT_TEMPLATE = """# AUTOMATED ANALYSIS RESULTS & STRATEGY
+{analysis_summary}
+
+# CURRENT CONTEXT
+Here are the top-{top_n} most "expensive" queries that caused this problem, sorted by importance:
+---
+{top_queries_context}
+---
+Here are the DDLs for the tables involved in these queries:
+```sql
+{ddl_context}
+```
+
+The most expensive query ID: `{highest_cost_query_id}`.
+"""
+
+CORRECTION_FOLLOWUP_TEMPLATE = """Your previous answer failed automatic validation.
+- Failing SQL: `{failing_sql}`
+- Error message: `{error_message}`
+
+Fix this error while keeping the overall optimization logic.
+Regenerate the FULL JSON response in the same format. Return ONLY the JSON object.
+"""
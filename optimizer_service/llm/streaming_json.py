@@ -0,0 +1,108 @@
+import json
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+class MalformedLLMOutput(ValueError):
+    """Ответ LLM заведомо не является ожидаемым JSON-объектом; генерацию имеет смысл прервать."""
+
+
+class IncrementalJSONParser:
+    """
+    Потоковый разбор JSON-ответа LLM по мере генерации.
+    Текст до первой '{' (например, ограждение ```json) пропускается, текст после закрытия объекта игнорируется.
+    Элементы массивов верхнего уровня из sections отдаются сразу, как только элемент сгенерирован целиком,
+    поэтому их можно проверять, пока модель пишет остальную часть ответа.
+    Несогласованные скобки, невалидный элемент или слишком длинная преамбула приводят к MalformedLLMOutput.
+    """
+
+    def __init__(self, sections: Iterable[str] = ("ddl", "migrations", "queries"), max_preamble_chars: int = 2000):
+        self._sections = frozenset(sections)
+        self._max_preamble_chars = max_preamble_chars
+        self._preamble_chars = 0
+        self._text: List[str] = []
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_key: Optional[str] = None
+        self._current_key: Optional[str] = None
+        self._element_start: Optional[int] = None
+        self.done = False
+
+    def _at_section_level(self) -> bool:
+        return len(self._stack) == 2 and self._stack[1] == "[" and self._current_key in self._sections
+
+    def _emit(self, end: int) -> Tuple[str, Any]:
+        raw = "".join(self._text[self._element_start:end]).strip()
+        self._element_start = None
+        try:
+            return self._current_key, json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise MalformedLLMOutput(f"Невалидный элемент '{self._current_key}': {e}")
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Принимает очередной фрагмент текста и возвращает завершенные в нем элементы (секция, значение)."""
+        events = []
+        for char in chunk:
+            if self.done:
+                break
+            if not self._stack:
+                if char == "{":
+                    self._text.append(char)
+                    self._stack.append(char)
+                    continue
+                self._preamble_chars += 1
+                if self._preamble_chars > self._max_preamble_chars:
+                    raise MalformedLLMOutput("В ответе LLM не найдено начало JSON-объекта.")
+                continue
+
+            index = len(self._text)
+            self._text.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        self._last_key = json.loads("".join(self._text[self._string_start:index + 1]))
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = index
+                if self._at_section_level() and self._element_start is None:
+                    self._element_start = index
+            elif char in "{[":
+                if self._at_section_level() and self._element_start is None:
+                    self._element_start = index
+                self._stack.append(char)
+            elif char in "}]":
+                expected = "{" if char == "}" else "["
+                if self._stack[-1] != expected:
+                    raise MalformedLLMOutput(f"Несогласованная скобка '{char}' в ответе LLM.")
+                if char == "]" and self._at_section_level() and self._element_start is not None:
+                    events.append(self._emit(index))
+                self._stack.pop()
+                if self._at_section_level() and self._element_start is not None:
+                    events.append(self._emit(index + 1))
+                if not self._stack:
+                    self.done = True
+            elif char == ":" and len(self._stack) == 1:
+                self._current_key = self._last_key
+            elif char == ",":
+                if self._at_section_level() and self._element_start is not None:
+                    events.append(self._emit(index))
+                elif len(self._stack) == 1:
+                    self._current_key = None
+            elif not char.isspace() and self._at_section_level() and self._element_start is None:
+                self._element_start = index
+        return events
+
+    def result(self) -> dict:
+        """Возвращает весь разобранный объект; ответ должен быть завершен."""
+        if not self.done:
+            raise MalformedLLMOutput("Ответ LLM оборвался до закрытия JSON-объекта.")
+        return json.loads("".join(self._text))
@@ -1,42 +1,117 @@
 import json
-from openai import OpenAI
-from .base_provider import BaseLLMProvider
+import logging
+from typing import AsyncIterator
+from openai import AsyncOpenAI
+from optimizer_service.core.observability import llm_request, record_llm_tokens
+from .async_runtime import get_http_client
+from .base_provider import AsyncLLMProvider, Prompt, as_messages
+from .output_schema import optimization_json_schema
 
+logger = logging.getLogger(__name__)
 
-class VLLMProvider(BaseLLMProvider):
+
+class VLLMProvider(AsyncLLMProvider):
     """
     Реализация провайдера для локального сервера vLLM.
     Использует OpenAI-совместимый API.
     """
 
-    def __init__(self, host: str = "vllm", port: int = 8000, model_name: str = "defog/sqlcoder-7b-2"):
-        self.client = OpenAI(
-            base_url=f"http://{host}:{port}/v1",
-            api_key="dummy-key"
-        )
+    supports_streaming = True
+
+    def __init__(self, host: str = "vllm", port: int = 8000, model_name: str = "defog/sqlcoder-7b-2",
+                 guided_decoding: bool = True):
+        self.base_url = f"http://{host}:{port}/v1"
         self.model_name = model_name
-        print(f"Инициализирован VLLMProvider для модели: {self.model_name} на http://{host}:{port}")
+        self.temperature = 0.1
+        self.guided_decoding = guided_decoding
+        logger.info("Инициализирован VLLMProvider для модели: %s на http://%s:%s", self.model_name, host, port)
 
-    def get_completion(self, prompt: str) -> dict:
+    def cache_identity(self) -> dict:
+        return {"provider": self.__class__.__name__, "model": self.model_name, "temperature": self.temperature,
+                "guided_decoding": self.guided_decoding}
+
+    async def aget_completion(self, prompt: Prompt) -> dict:
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-            )
-
-            raw_text = response.choices[0].message.content
-
-            if raw_text.strip().startswith("```json"):
-                json_part = raw_text[raw_text.find("```json") + 7: raw_text.rfind("```")]
-            elif "{" in raw_text and "}" in raw_text:
-                json_part = raw_text[raw_text.find("{"): raw_text.rfind("}") + 1]
-            else:
-                raise ValueError("В ответе vLLM не найден JSON-объект.")
-
-            return json.loads(json_part)
+            with llm_request("vllm", "single"):
+                response = await self._create_chat_completion(prompt, n=1)
+            self._record_usage(response.usage)
+            return self._parse_response(response.choices[0].message.content)
         except Exception as e:
-            print(f"Ошибка при вызове локального vLLM API: {e}")
-            raise
\ No newline at end of file
+            logger.error("Ошибка при вызове локального vLLM API: %s", e)
+            raise
+
+    async def aiter_completions(self, prompt: Prompt, n: int) -> AsyncIterator[dict]:
+        """
+        Запрашивает n вариантов одним вызовом с параметром n: vLLM генерирует их одним батчем,
+        разделяя префилл промпта. Варианты, из которых не удалось извлечь JSON, пропускаются.
+        """
+        with llm_request("vllm", "batch"):
+            response = await self._create_chat_completion(prompt, n=n)
+        self._record_usage(response.usage)
+        last_error = None
+        yielded = 0
+        for choice in response.choices:
+            try:
+                parsed = self._parse_response(choice.message.content)
+            except ValueError as e:
+                logger.warning("Вариант ответа vLLM не разобран: %s", e)
+                last_error = e
+                continue
+            yielded += 1
+            yield parsed
+        if not yielded and last_error is not None:
+            raise last_error
+
+    async def astream_completion(self, prompt: Prompt) -> AsyncIterator[str]:
+        """
+        Отдает текст ответа по мере генерации (stream=True в OpenAI-совместимом API).
+        Закрытие генератора закрывает поток, и vLLM прерывает генерацию для отключившегося клиента.
+        Число токенов приходит в последнем фрагменте потока (stream_options.include_usage).
+        """
+        with llm_request("vllm", "stream"):
+            stream = await self._create_chat_completion(prompt, n=1, stream=True)
+            try:
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        self._record_usage(chunk.usage)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+
+    async def _create_chat_completion(self, prompt: Prompt, n: int, stream: bool = False):
+        # Клиент легковесный, а соединения берутся из общего пула текущего цикла событий
+        client = AsyncOpenAI(base_url=self.base_url, api_key="dummy-key", http_client=get_http_client())
+        extra_params = {}
+        if stream:
+            extra_params["stream_options"] = {"include_usage": True}
+        if self.guided_decoding:
+            # vLLM ограничивает декодирование JSON-схемой (guided decoding через response_format)
+            extra_params["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "optimization_result", "schema": optimization_json_schema()},
+            }
+        return await client.chat.completions.create(
+            model=self.model_name,
+            messages=as_messages(prompt),
+            temperature=self.temperature,
+            n=n,
+            stream=stream,
+            **extra_params,
+        )
+
+    @staticmethod
+    def _record_usage(usage):
+        if usage is not None:
+            record_llm_tokens("vllm", usage.prompt_tokens, usage.completion_tokens)
+
+    @staticmethod
+    def _parse_response(raw_text: str) -> dict:
+        if raw_text.strip().startswith("```json"):
+            json_part = raw_text[raw_text.find("```json") + 7: raw_text.rfind("```")]
+        elif "{" in raw_text and "}" in raw_text:
+            json_part = raw_text[raw_text.find("{"): raw_text.rfind("}") + 1]
+        else:
+            raise ValueError("В ответе vLLM не найден JSON-объект.")
+
+        return json.loads(json_part)
@@ -1,5 +1,8 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from optimizer_service.api.endpoints import router as api_router
+from optimizer_service.core.observability import configure_logging, metrics_payload
+
+configure_logging()
 
 app = FastAPI(
     title="Data Lakehouse Optimization Service",
@@ -11,4 +14,9 @@ app.include_router(api_router, prefix="/api", tags=["Optimization"])
 
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to the Optimization Service API!"}
\ No newline at end of file
+    return {"message": "Welcome to the Optimization Service API!"}
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
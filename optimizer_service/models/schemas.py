@@ -1,6 +1,7 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+from sqlglot import exp
 
 
 class DDLStatement(BaseModel):
@@ -12,6 +13,25 @@ class QueryStatement(BaseModel):
     runquantity: int
     executiontime: int = 1
 
+class WorkloadHeader(BaseModel):
+    """Первая строка потоковой NDJSON-загрузки: все поля TaskRequest, кроме запросов."""
+    url: str
+    ddl: List[DDLStatement] = Field(default_factory=list)
+
+class QueryTemplate(BaseModel):
+    """
+    Группа запросов, отличающихся только литералами.
+    Представлена одним запросом-представителем, частоты суммируются, время взвешивается по частоте.
+    queryids хранит не больше TEMPLATE_QUERYIDS_LIMIT идентификаторов, полный размер группы — query_count.
+    """
+    fingerprint: str
+    queryid: str
+    query: str
+    runquantity: int
+    executiontime: float
+    queryids: List[str] = Field(default_factory=list)
+    query_count: int = 0
+
 class TaskRequest(BaseModel):
     url: str
     ddl: List[DDLStatement]
@@ -19,9 +39,6 @@ class TaskRequest(BaseModel):
 
 
 
-class TaskResponse(BaseModel):
-    taskid: str
-
 class TaskStatus(BaseModel):
     status: str
     
@@ -31,15 +48,111 @@ class OptimizationResult(BaseModel):
     migrations: List[Dict[str, Any]]
     queries: List[Dict[str, Any]]
 
+class GeneratedStatement(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    statement: str
+
+class GeneratedQuery(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    queryid: str
+    query: str
+
+class GeneratedOptimization(BaseModel):
+    """
+    Строгая схема ответа LLM, совместимая с OptimizationResult.
+    Из нее строится JSON Schema для ограниченного декодирования в локальных провайдерах.
+    ddl и migrations могут быть пустыми: решения вроде переписывания запроса не создают новых таблиц.
+    """
+    model_config = ConfigDict(extra="forbid")
+    ddl: List[GeneratedStatement]
+    migrations: List[GeneratedStatement]
+    queries: List[GeneratedQuery] = Field(min_length=1)
+
+class TaskResponse(BaseModel):
+    taskid: str
+    # Заполняется, если идентичная задача уже была недавно решена и результат взят из кэша
+    result: Optional[OptimizationResult] = None
+
+class ParsedQuery(BaseModel):
+    """
+    Результат однократного разбора SQL-запроса.
+    AST разделяется между всеми потребителями через кэш, поэтому его нельзя модифицировать.
+    """
+    model_config = ConfigDict(frozen=True, arbitrary_types_allowed=True)
+
+    sql: str
+    ast: exp.Expression = Field(exclude=True)
+    tables: Tuple[str, ...] = ()
+    columns: Tuple[str, ...] = ()
+    where_columns: Tuple[str, ...] = ()
+    joins: Tuple[exp.Join, ...] = Field(default=(), exclude=True)
+    where: Optional[exp.Where] = Field(default=None, exclude=True)
+    having: Optional[exp.Having] = Field(default=None, exclude=True)
+    has_select_star: bool = False
+
+class ParsedDDL(BaseModel):
+    """Результат однократного разбора DDL-выражения CREATE TABLE."""
+    model_config = ConfigDict(frozen=True, arbitrary_types_allowed=True)
+
+    statement: str
+    ast: exp.Expression = Field(exclude=True)
+    table_name: str
+    column_names: Tuple[str, ...] = ()
+
+class PlanCostVector(BaseModel):
+    """Оценки оптимизатора Trino; неизвестные оценки (NaN в EXPLAIN) считаются нулем."""
+    rows: float = 0.0
+    cpu: float = 0.0
+    memory: float = 0.0
+    network: float = 0.0
+    output_bytes: float = 0.0
+    scanned_bytes: float = 0.0
+
+class PlanNode(BaseModel):
+    """Узел EXPLAIN-плана в плоском виде."""
+    id: str
+    name: str
+    depth: int
+    table: Optional[str] = None
+    estimates: PlanCostVector = Field(default_factory=PlanCostVector)
+
+class PlanProfile(BaseModel):
+    """Сводка EXPLAIN-плана одного запроса: узлы, суммарная стоимость и стоимость по таблицам."""
+    nodes: List[PlanNode] = Field(default_factory=list)
+    total: PlanCostVector = Field(default_factory=PlanCostVector)
+    tables: Dict[str, PlanCostVector] = Field(default_factory=dict)
+
+class OperatorProfile(BaseModel):
+    """Измеренные показатели одного оператора из EXPLAIN ANALYZE."""
+    fragment: Optional[str] = None
+    name: str
+    table: Optional[str] = None
+    cpu_ms: float = 0.0
+    wall_ms: float = 0.0
+    input_rows: int = 0
+    input_bytes: float = 0.0
+    output_rows: int = 0
+    output_bytes: float = 0.0
+
+class RuntimeProfile(BaseModel):
+    """Профиль выполнения запроса по EXPLAIN ANALYZE; операторы упорядочены по убыванию CPU."""
+    operators: List[OperatorProfile] = Field(default_factory=list)
+    total_cpu_ms: float = 0.0
+    total_wall_ms: float = 0.0
+
 class ProfiledQuery(BaseModel):
     """Хранит всю собранную информацию об одном запросе."""
     queryid: str
     sql: str
     run_quantity: int
-    execution_time: int
+    execution_time: float
     cost: float = 0.0
-    explain_plan: Dict[str, Any]
+    explain_plan: Dict[str, Any] = Field(default_factory=dict)
     tables: List[str] = Field(default_factory=list)
+    queryids: List[str] = Field(default_factory=list)
+    parsed: Optional[ParsedQuery] = Field(default=None, exclude=True)
+    plan_profile: Optional[PlanProfile] = Field(default=None, exclude=True)
+    runtime_profile: Optional[RuntimeProfile] = Field(default=None, exclude=True)
 
 class DetectionResult(BaseModel):
     """
@@ -51,11 +164,21 @@ class DetectionResult(BaseModel):
     queries: List[ProfiledQuery]
     detector_name: str
 
+class DetectorRunStats(BaseModel):
+    """Статистика одного запуска детектора."""
+    detector_name: str
+    duration_ms: float
+    queries_examined: int
+    result_count: int = 0
+    status: str = "ok"
+    error: Optional[str] = None
+
 class GlobalAnalysisReport(BaseModel):
     """Хранит финальный отчет глобального анализа."""
     top_cost_queries: List[ProfiledQuery]
     analysis_summary: str
     top_detection: Optional[DetectionResult] = None
+    detector_stats: List[DetectorRunStats] = Field(default_factory=list)
 
 class ErrorResponse(BaseModel):
     error: str
\ No newline at end of file
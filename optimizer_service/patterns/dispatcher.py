@@ -1,14 +1,18 @@
 import json
+import logging
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+
 class PatternDispatcher:
     def __init__(self, library_path: Path):
         try:
             with open(library_path, 'r', encoding='utf-8') as f:
                 self._library = json.load(f)
-            print(f"Библиотека паттернов успешно загружена из {library_path}")
+            logger.info("Библиотека паттернов успешно загружена из %s", library_path)
         except Exception as e:
-            print(f"КРИТИЧЕСКАЯ ОШИБКА: Не удалось загрузить библиотеку паттернов: {e}")
+            logger.critical("Не удалось загрузить библиотеку паттернов: %s", e)
             self._library = {}
 
     def get_pattern(self, detector_name: str) -> dict:
@@ -1,29 +1,64 @@
+import logging
+from typing import Optional
+
+from optimizer_service.core.config import settings
+from optimizer_service.core.observability import span
+from optimizer_service.core.staging import workload_staging
+from optimizer_service.core.task_dedup import task_deduplicator
 from optimizer_service.llm import llm_provider
 from optimizer_service.worker import celery_app
 from optimizer_service.models.schemas import TaskRequest
 from optimizer_service.data_analyzer.trino_connector import TrinoConnector
 from optimizer_service.data_analyzer.analysis_module import AnalysisModule
+from optimizer_service.data_analyzer.explain_cache import ExplainPlanCache
 from optimizer_service.agent.optimization_agent import OptimizationAgent
 
+logger = logging.getLogger(__name__)
 
-analyzer_instance = AnalysisModule(connector=None)
+explain_cache = ExplainPlanCache() if settings.EXPLAIN_CACHE_ENABLED else None
+analyzer_instance = AnalysisModule(connector=None, explain_cache=explain_cache)
 agent_instance = OptimizationAgent(llm_provider=llm_provider, analyzer=analyzer_instance)
 
-@celery_app.task(bind=True)
-def run_optimization_task(self, task_data: dict):
-    print(f"Получена задача {self.request.id}. Полный глобальный цикл.")
-    task_request_model = TaskRequest(**task_data)
-
+def _run_global_cycle(task, task_request):
     try:
-        connector = TrinoConnector(jdbc_url=task_request_model.url)
-        agent_instance.analyzer._connector = connector
+        agent_instance.analyzer._connector = TrinoConnector(jdbc_url=task_request.url)
 
-        final_result = agent_instance.run_global_optimization(task_data=task_request_model)
+        # Идентификатор задачи служит идентификатором трассы: по нему связываются все этапы в логах
+        with span("task", trace_id=task.request.id):
+            final_result = agent_instance.run_global_optimization(task_data=task_request)
 
-        print(f"Задача {self.request.id} полностью и успешно обработана.")
+        logger.info("Задача %s полностью и успешно обработана.", task.request.id)
         return final_result
 
     except Exception as e:
-        print(f"!!! КРИТИЧЕСКАЯ ОШИБКА в задаче {self.request.id}: {e}")
-        self.update_state(state='FAILURE', meta={'exc': str(e)})
-        raise
\ No newline at end of file
+        logger.exception("КРИТИЧЕСКАЯ ОШИБКА в задаче %s: %s", task.request.id, e)
+        task.update_state(state='FAILURE', meta={'exc': str(e)})
+        raise
+
+
+@celery_app.task(bind=True)
+def run_optimization_task(self, task_data: dict, digest: Optional[str] = None):
+    logger.info("Получена задача %s. Полный глобальный цикл.", self.request.id)
+    task_request_model = TaskRequest(**task_data)
+    if digest is None:
+        return _run_global_cycle(self, task_request_model)
+
+    result = None
+    try:
+        result = _run_global_cycle(self, task_request_model)
+        return result
+    finally:
+        # Сохраняется только полноценный результат: ответы с ошибкой не должны переиспользоваться
+        is_success = isinstance(result, dict) and "error" not in result
+        task_deduplicator.complete(digest, self.request.id, result if is_success else None)
+
+
+@celery_app.task(bind=True)
+def run_staged_optimization_task(self, workload_id: str):
+    """Та же задача, но запросы читаются потоком из промежуточного хранилища, а не из тела сообщения."""
+    logger.info("Получена задача %s для загруженной нагрузки %s.", self.request.id, workload_id)
+    try:
+        staged_workload = workload_staging.load(workload_id)
+        return _run_global_cycle(self, staged_workload)
+    finally:
+        workload_staging.delete(workload_id)
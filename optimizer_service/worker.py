@@ -1,5 +1,9 @@
 from celery import Celery
+from celery.signals import after_setup_logger, worker_process_shutdown
+
 from optimizer_service.core.config import settings
+from optimizer_service.core.observability import configure_logging, mark_process_dead
+from optimizer_service.data_analyzer.trino_connector import close_shared_pools
 
 celery_app = Celery(
     "tasks",
@@ -10,4 +14,15 @@ celery_app = Celery(
 
 celery_app.conf.update(
     task_track_started=True,
-)
\ No newline at end of file
+)
+
+
+@after_setup_logger.connect
+def _configure_logging(**kwargs):
+    configure_logging()
+
+
+@worker_process_shutdown.connect
+def _close_trino_pools(**kwargs):
+    close_shared_pools()
+    mark_process_dead()
@@ -0,0 +1,27 @@
+import json
+from contextlib import contextmanager
+from unittest.mock import MagicMock
+
+import pytest
+
+FAKE_EXPLAIN_PLAN = {"id": "0", "name": "Output", "children": []}
+
+
+@pytest.fixture
+def fake_connector():
+    """
+    Фикстура подменяет подключение к Trino: каждый EXPLAIN возвращает один и тот же JSON-план.
+    """
+    cursor = MagicMock()
+    cursor.fetchone.return_value = (json.dumps(FAKE_EXPLAIN_PLAN),)
+    connection = MagicMock()
+    connection.cursor.return_value = cursor
+
+    @contextmanager
+    def pooled_connection(**kwargs):
+        yield connection
+
+    connector = MagicMock()
+    connector.connection.side_effect = pooled_connection
+    connector.cursor = cursor
+    return connector
@@ -0,0 +1,680 @@
+import re
+import time
+import tracemalloc
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from prometheus_client import REGISTRY
+
+from optimizer_service.core.config import settings
+from optimizer_service.data_analyzer.analysis_module import AnalysisModule
+from optimizer_service.data_analyzer.deduplication import build_query_templates
+from optimizer_service.data_analyzer.detector_runner import DetectorRunner
+from optimizer_service.data_analyzer.detectors.base_detector import BasePatternDetector, DetectorInput
+from optimizer_service.data_analyzer.detectors.registry import DetectorRegistry
+from optimizer_service.data_analyzer.detectors.scan_cost_detector import TableScanCostDetector
+from optimizer_service.data_analyzer.plan_analysis import analyze_plan, aggregate_table_costs
+from optimizer_service.data_analyzer.query_parser import parse_query, query_fingerprint
+from optimizer_service.data_analyzer.runtime_profile import parse_explain_analyze
+from optimizer_service.data_analyzer.static_validator import StaticSQLValidator
+from optimizer_service.data_analyzer import trino_connector
+from optimizer_service.data_analyzer.trino_connector import TrinoConnectionPool, TrinoConnector, close_shared_pools
+from optimizer_service.models.schemas import TaskRequest, QueryStatement, ProfiledQuery, DetectionResult
+
+WIDE_TABLE_DDL = "CREATE TABLE quests.public.wide ({})".format(
+    ", ".join(f"col_{i} int" for i in range(25))
+)
+
+TASK_REQUEST = {
+    "url": "jdbc:trino://fake-host:443",
+    "ddl": [
+        {"statement": "CREATE TABLE quests.public.h_author (id int, name varchar, dt date)"},
+        {"statement": "CREATE TABLE quests.public.l_book_author (book_id int, author_id int)"},
+        {"statement": WIDE_TABLE_DDL},
+    ],
+    "queries": [
+        {"queryid": "q1", "runquantity": 100, "executiontime": 10,
+         "query": "SELECT a.name FROM quests.public.h_author a CROSS JOIN quests.public.l_book_author l"},
+        {"queryid": "q2", "runquantity": 50, "executiontime": 10,
+         "query": "SELECT a.name, count(*) FROM quests.public.h_author a "
+                  "JOIN quests.public.l_book_author l ON a.id = l.author_id "
+                  "WHERE a.dt > DATE '2024-01-01' GROUP BY a.name HAVING a.name = 'x'"},
+        {"queryid": "q3", "runquantity": 10, "executiontime": 1,
+         "query": "SELECT * FROM quests.public.wide"},
+        {"queryid": "broken", "runquantity": 1000, "executiontime": 1000,
+         "query": "SELEC FROM"},
+    ]
+}
+
+
+def test_parse_query_is_cached():
+    """
+    Тест 1: Один и тот же SQL разбирается один раз, а таблицы извлекаются без алиасов.
+    """
+    sql = "SELECT a.id FROM quests.public.h_author AS a WHERE a.dt > DATE '2024-01-01'"
+    first = parse_query(sql)
+    second = parse_query(sql)
+
+    assert first is second
+    assert first.tables == ("quests.public.h_author",)
+    assert first.where_columns == ("dt",)
+
+
+def test_global_analysis_detects_patterns(fake_connector):
+    """
+    Тест 2: Детекторы работают на заранее разобранных запросах и находят ожидаемые паттерны.
+    """
+    analyzer = AnalysisModule(connector=fake_connector)
+    report = analyzer.perform_global_analysis(TaskRequest(**TASK_REQUEST))
+
+    assert [q.queryid for q in report.top_cost_queries] == ["q1", "q2", "q3"]
+    assert all(q.parsed is not None for q in report.top_cost_queries)
+    assert report.top_detection.detector_name == "JoinPatternDetector"
+
+
+def test_concurrent_profiling_keeps_order(fake_connector, monkeypatch):
+    """
+    Тест 3: Параллельное профилирование сохраняет порядок запросов и пропускает упавшие EXPLAIN-ы.
+    """
+    monkeypatch.setattr(settings, "EXPLAIN_MODE", "always")
+    def explain(sql):
+        if "wide" in sql:
+            raise RuntimeError("Trino is unavailable")
+
+    fake_connector.cursor.execute.side_effect = explain
+    analyzer = AnalysisModule(connector=fake_connector)
+    profiled = analyzer._profile_all_queries(TaskRequest(**TASK_REQUEST))
+
+    assert [q.queryid for q in profiled] == ["q1", "q2"]
+
+
+def test_connection_pool_reuses_connections():
+    """
+    Тест 4: Пул переиспользует соединения вместо создания нового на каждый запрос.
+    """
+    factory = MagicMock(side_effect=lambda: MagicMock())
+    pool = TrinoConnectionPool(factory=factory, max_size=2)
+
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    assert first is second
+    assert factory.call_count == 1
+
+
+def test_lazy_profiling_matches_full_profiling(fake_connector, monkeypatch):
+    """
+    Тест 5: Ленивый режим профилирует только кандидатов в топ-N, но возвращает тот же топ.
+    """
+    queries = [
+        {"queryid": f"q{i}", "runquantity": i, "executiontime": 1,
+         "query": f"SELECT id FROM quests.public.h_author WHERE id = {i}"}
+        for i in range(50)
+    ]
+    task = TaskRequest(url="jdbc:trino://fake-host:443", ddl=[], queries=queries)
+    monkeypatch.setattr(settings, "EXPLAIN_MODE", "always")
+    analyzer = AnalysisModule(connector=fake_connector)
+
+    monkeypatch.setattr(settings, "LAZY_PROFILING_MARGIN", 2)
+    monkeypatch.setattr(settings, "QUERY_DEDUPLICATION", False)
+    templates = build_query_templates(task.queries, deduplicate=False)
+    lazy_top = analyzer._profile_top_queries(templates, {}, top_n=5)
+    assert fake_connector.cursor.execute.call_count == 7
+
+    full_top = analyzer._prioritize_queries(analyzer._profile_all_queries(task), top_n=5)
+    assert [q.queryid for q in lazy_top] == [q.queryid for q in full_top]
+
+
+def test_templates_merge_queries_differing_in_literals():
+    """
+    Тест 6: Запросы, отличающиеся только литералами, сливаются в один шаблон с суммарной стоимостью.
+    """
+    queries = [
+        QueryStatement(queryid="a", runquantity=10, executiontime=2,
+                       query="SELECT name FROM quests.public.h_author WHERE id IN (1, 2, 3)"),
+        QueryStatement(queryid="b", runquantity=30, executiontime=4,
+                       query="select name from quests.public.h_author where id in (7)"),
+        QueryStatement(queryid="c", runquantity=5, executiontime=1,
+                       query="SELECT dt FROM quests.public.h_author WHERE id = 1"),
+    ]
+    templates = build_query_templates(queries)
+
+    assert len(templates) == 2
+    merged = templates[0]
+    assert merged.queryid == "b"
+    assert merged.queryids == ["a", "b"]
+    assert merged.runquantity == 40
+    assert merged.runquantity * merged.executiontime == 10 * 2 + 30 * 4
+
+
+def test_top_k_keeps_most_expensive_in_stable_order():
+    """
+    Тест 7: Потоковый отбор на куче дает тот же результат, что и полная сортировка.
+    """
+    costs = [5, 1, 9, 5, 7, 9, 0, 3]
+    queries = [
+        ProfiledQuery(queryid=f"q{i}", sql="SELECT 1", run_quantity=cost, execution_time=1, explain_plan={})
+        for i, cost in enumerate(costs)
+    ]
+    analyzer = AnalysisModule(connector=None)
+
+    top = analyzer._prioritize_queries(iter(queries), top_n=4)
+
+    expected = sorted(queries, key=lambda q: q.cost, reverse=True)[:4]
+    assert [q.queryid for q in top] == [q.queryid for q in expected] == ["q2", "q5", "q4", "q0"]
+
+
+def test_workload_stats_cover_queries_outside_top_n(fake_connector, monkeypatch):
+    """
+    Тест 8: Агрегирующие детекторы считают статистику по всей нагрузке, а не только по топ-N.
+    """
+    monkeypatch.setattr(settings, "TOP_N_QUERIES", 1)
+    analyzer = AnalysisModule(connector=fake_connector)
+    report = analyzer.perform_global_analysis(TaskRequest(**TASK_REQUEST))
+
+    assert [q.queryid for q in report.top_cost_queries] == ["q1"]
+    assert report.top_detection.detector_name == "JoinPatternDetector"
+    assert "across the whole workload" in report.top_detection.message
+
+
+def test_detector_runner_isolates_slow_and_failing_detectors():
+    """
+    Тест 9: Медленный детектор отбрасывается по бюджету времени, упавший попадает в статистику,
+    а результаты остальных детекторов сохраняются.
+    """
+    class SlowDetector(BasePatternDetector):
+        def run(self, queries, ddl_map, stats=None):
+            time.sleep(1)
+            return []
+
+    class FailingDetector(BasePatternDetector):
+        def run(self, queries, ddl_map, stats=None):
+            raise RuntimeError("boom")
+
+    class FastDetector(BasePatternDetector):
+        def run(self, queries, ddl_map, stats=None):
+            return [DetectionResult(pattern_name="Fast", message="found", priority=1,
+                                    queries=[], detector_name="FastDetector")]
+
+    runner = DetectorRunner(max_workers=3, time_budget_seconds=0.2)
+    detections, run_stats = runner.run([SlowDetector(), FailingDetector(), FastDetector()], [], {})
+
+    assert [d.pattern_name for d in detections] == ["Fast"]
+    assert [(s.detector_name, s.status) for s in run_stats] == [
+        ("SlowDetector", "timeout"), ("FailingDetector", "error"), ("FastDetector", "ok")
+    ]
+    assert run_stats[2].result_count == 1
+
+
+def test_ast_only_detectors_skip_explain(fake_connector, monkeypatch):
+    """
+    Тест 10: Если включены только AST-детекторы, EXPLAIN не выполняется вовсе.
+    """
+    monkeypatch.setattr(settings, "ENABLED_DETECTORS", "CrossJoinDetector,InefficientAggregationDetector")
+    analyzer = AnalysisModule(connector=fake_connector)
+    report = analyzer.perform_global_analysis(TaskRequest(**TASK_REQUEST))
+
+    assert fake_connector.cursor.execute.call_count == 0
+    assert [s.detector_name for s in report.detector_stats] == ["CrossJoinDetector", "InefficientAggregationDetector"]
+    assert report.top_detection.detector_name == "CrossJoinDetector"
+
+
+def test_registry_loads_detector_by_import_path():
+    """
+    Тест 11: Детектор можно подключить по пути импорта и отключить по имени.
+    """
+    registry = DetectorRegistry(specs={})
+    registry.register("Cross", "optimizer_service.data_analyzer.detectors.cross_join_detector:CrossJoinDetector")
+
+    detectors = registry.create_enabled(
+        enabled=["Cross", "optimizer_service.data_analyzer.detectors.select_star_detector:SelectStarDetector"],
+        disabled=["Cross"],
+    )
+
+    assert [d.__class__.__name__ for d in detectors] == ["SelectStarDetector"]
+
+
+def test_connection_pool_drops_stale_and_broken_connections():
+    """
+    Тест 12: Пул проверяет давно простаивающие соединения и не возвращает оборванные,
+    коннекторы с одинаковым URL делят общий пул процесса, лимит времени передается в Trino
+    свойством сессии, а пароль не попадает в ключ пула.
+    """
+    stale = MagicMock()
+    stale.cursor.return_value.execute.side_effect = requests.exceptions.ConnectionError("reset")
+    fresh = MagicMock()
+    factory = MagicMock(side_effect=[stale, fresh, MagicMock()])
+    pool = TrinoConnectionPool(factory=factory, max_size=1, healthcheck_after_seconds=0)
+
+    with pool.connection():
+        pass
+    with pool.connection() as conn:
+        assert conn is fresh
+    stale.close.assert_called_once()
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        with pool.connection():
+            raise requests.exceptions.ConnectionError("broken pipe")
+    fresh.close.assert_called_once()
+
+    url = "jdbc:trino://trino.local:443/hive/default?user=u&password=p"
+    with patch("optimizer_service.data_analyzer.trino_connector.trino.dbapi.connect") as connect:
+        with TrinoConnector(url).connection() as first:
+            pass
+        with TrinoConnector(url).connection() as second:
+            pass
+        pool_keys = list(trino_connector._shared_pools)
+    close_shared_pools()
+
+    assert first is second
+    assert connect.call_count == 1
+    assert connect.call_args.kwargs["session_properties"] == {
+        "query_max_run_time": f"{settings.EXPLAIN_TIMEOUT_SECONDS:g}s"}
+    assert "http_session" not in connect.call_args.kwargs
+    assert len(pool_keys) == 1 and "p" not in pool_keys[0]
+
+
+def test_local_validation_rejects_broken_sql_without_trino(fake_connector):
+    """
+    Тест 13: Неизвестные колонки, таблицы и несовпадение числа колонок отсекаются до обращения к Trino.
+    """
+    analyzer = AnalysisModule(connector=fake_connector)
+    source_ddl = [ddl["statement"] for ddl in TASK_REQUEST["ddl"]]
+    ddl = [{"statement": "CREATE TABLE quests.optimized.author_books (name varchar, book_id int)"}]
+    query = [{"queryid": "q1", "query": "SELECT name FROM quests.optimized.author_books"}]
+
+    cases = {
+        "INSERT INTO quests.optimized.author_books SELECT a.nme, l.book_id "
+        "FROM quests.public.h_author a JOIN quests.public.l_book_author l ON a.id = l.author_id": "nme",
+        "INSERT INTO quests.optimized.author_books SELECT a.name FROM quests.public.h_author a": "(1)",
+        "INSERT INTO quests.optimized.author_books SELECT name, id FROM quests.public.authors": "authors",
+    }
+    for migration, expected_error in cases.items():
+        is_valid, error_msg, failing_sql = analyzer.validate_sql_list(
+            ddl, [{"statement": migration}], query, source_ddl=source_ddl)
+        assert not is_valid
+        assert expected_error in error_msg
+        assert failing_sql == migration
+    fake_connector.cursor.execute.assert_not_called()
+
+    valid_migration = ("INSERT INTO quests.optimized.author_books SELECT a.name, l.book_id "
+                       "FROM quests.public.h_author a JOIN quests.public.l_book_author l ON a.id = l.author_id")
+    is_valid, _, _ = analyzer.validate_sql_list(ddl, [{"statement": valid_migration}], query, source_ddl=source_ddl)
+
+    assert is_valid
+    # Один EXPLAIN на миграцию и один на итоговый запрос.
+    assert fake_connector.cursor.execute.call_count == 2
+
+
+def test_cte_validation_covers_every_statement(fake_connector):
+    """
+    Тест 14: Симулируются все таблицы, миграции (в том числе с WITH) и запросы, а не только первые;
+    ссылки на новые таблицы подменяются через AST, ошибка возвращается для первого упавшего оператора.
+    """
+    analyzer = AnalysisModule(connector=fake_connector)
+    ddl = [
+        {"statement": "CREATE TABLE quests.optimized.author_books (name varchar, book_id int)"},
+        {"statement": "CREATE TABLE quests.optimized.author_stats (name varchar, books bigint)"},
+    ]
+    migrations = [
+        {"statement": "INSERT INTO quests.optimized.author_books "
+                      "WITH a AS (SELECT id, name FROM quests.public.h_author) "
+                      "SELECT a.name, l.book_id FROM a JOIN quests.public.l_book_author l ON a.id = l.author_id"},
+        {"statement": "INSERT INTO quests.optimized.author_stats "
+                      "SELECT name, count(*) FROM quests.optimized.author_books GROUP BY name"},
+    ]
+    queries = [
+        {"queryid": "q1", "query": "SELECT name FROM quests.optimized.author_books WHERE book_id = 1"},
+        {"queryid": "q2", "query": "SELECT s.books FROM quests.optimized.author_stats s WHERE s.name = 'x'"},
+    ]
+
+    is_valid, _, _ = analyzer.validate_sql_list(ddl, migrations, queries)
+
+    assert is_valid
+    explained = [call.args[0] for call in fake_connector.cursor.execute.call_args_list]
+    assert len(explained) == 4
+    assert all(sql.startswith("EXPLAIN WITH simulated_author_books_0(name, book_id) AS (") for sql in explained)
+    assert all("quests.optimized" not in sql for sql in explained)
+    assert all("WITH a AS (SELECT id, name FROM quests.public.h_author)" in sql for sql in explained)
+    assert any("FROM simulated_author_stats_1 AS s WHERE s.name = 'x'" in sql for sql in explained)
+
+    def fail_on_stats(sql):
+        if "author_stats_1 AS s" in sql:
+            raise ValueError("Column 'books' cannot be resolved")
+
+    fake_connector.cursor.execute.side_effect = fail_on_stats
+    is_valid, error_msg, failing_sql = analyzer.validate_sql_list(ddl, migrations, queries)
+
+    assert not is_valid
+    assert "books" in error_msg
+    assert failing_sql == queries[1]["query"]
+
+
+def _scan_plan(table: str, scanned_bytes: float) -> dict:
+    """Распределенный EXPLAIN-план из двух фрагментов: выдача результата и чтение таблицы."""
+    return {
+        "0": {"id": "9", "name": "Output", "estimates": [{"outputRowCount": "NaN", "outputSizeInBytes": "NaN",
+                                                           "cpuCost": 0, "memoryCost": 0, "networkCost": 0}],
+              "children": [{"id": "10", "name": "RemoteSource", "children": []}]},
+        "1": {"id": "0", "name": "ScanFilterProject", "descriptor": {"table": "{}:{}.{}$data@1".format(*table.split("."))},
+              "estimates": [
+                  {"outputRowCount": 1000, "outputSizeInBytes": scanned_bytes, "cpuCost": scanned_bytes,
+                   "memoryCost": 0, "networkCost": 0},
+                  {"outputRowCount": 10, "outputSizeInBytes": 100, "cpuCost": scanned_bytes * 2,
+                   "memoryCost": 0, "networkCost": 0},
+              ],
+              "children": []},
+    }
+
+
+def test_plan_costs_drive_prioritization(fake_connector, monkeypatch):
+    """
+    Тест 15: План разворачивается в плоские узлы с оценками (NaN считается нулем), стоимость чтения
+    привязывается к таблице, а при PRIORITIZATION_METRIC=scanned_bytes ранжирование идет по плану.
+    """
+    profile = analyze_plan(_scan_plan("quests.public.wide", 5e9))
+
+    assert [(node.id, node.name, node.depth) for node in profile.nodes] == [
+        ("0.9", "Output", 0), ("0.10", "RemoteSource", 1), ("1.0", "ScanFilterProject", 0)]
+    assert profile.total.rows == 10
+    assert profile.tables["quests.public.wide"].scanned_bytes == 5e9
+    assert profile.tables["quests.public.wide"].cpu == 1e10
+
+    small_sql, wide_sql = "SELECT id FROM quests.public.small", "SELECT col_1 FROM quests.public.wide"
+    plans = {small_sql: _scan_plan("quests.public.small", 1e3), wide_sql: _scan_plan("quests.public.wide", 5e9)}
+    monkeypatch.setattr(settings, "PRIORITIZATION_METRIC", "scanned_bytes")
+    analyzer = AnalysisModule(connector=fake_connector, detectors=[])
+    monkeypatch.setattr(analyzer, "_explain", lambda parsed, ddl_map: plans[parsed.sql])
+    queries = [
+        QueryStatement(queryid="slow_small", query=small_sql, runquantity=100, executiontime=100),
+        QueryStatement(queryid="fast_wide", query=wide_sql, runquantity=10, executiontime=1),
+    ]
+    profiled = analyzer._profile_queries(build_query_templates(queries), {})
+
+    top = analyzer._prioritize_queries(profiled, top_n=2)
+
+    assert [q.queryid for q in top] == ["fast_wide", "slow_small"]
+    assert top[0].cost == 10 * 5e9
+    table_costs = aggregate_table_costs(top)
+    assert table_costs["quests.public.wide"].scanned_bytes == 10 * 5e9
+    assert table_costs["quests.public.small"].scanned_bytes == 100 * 1e3
+
+
+EXPLAIN_ANALYZE_OUTPUT = """Fragment 1 [HASH]
+    CPU: 2.10s, Scheduled: 3.00s, Blocked 0.00ns (Input: 0.00ns, Output: 0.00ns), Input: 1000 rows (8.00kB)
+    Aggregate[type = FINAL, keys = [name]]
+    │   Layout: [name:varchar, count:bigint]
+    │   CPU: 100.00ms (4.76%), Scheduled: 150.00ms (5.00%), Blocked: 0.00ns (?%), Output: 10 rows (200B)
+    │   Input avg.: 1000.00 rows, Input std.dev.: 0.00%
+    └─ ScanFilterProject[table = quests:public.h_author$data@1, filterPredicate = (dt > DATE '2024-01-01')]
+           Layout: [name:varchar]
+           CPU: 2.00s (95.24%), Scheduled: 2.85s (95.00%), Blocked: 0.00ns (?%), Output: 1000 rows (8.00kB)
+           Input: 1500000 rows (40.00MB), Filtered: 99.93%, Physical input: 12.30MB
+"""
+
+
+def test_explain_analyze_sampling_attaches_runtime_profiles(fake_connector, monkeypatch):
+    """
+    Тест 16: Вывод EXPLAIN ANALYZE разбирается по операторам; опциональный режим выполняет его только
+    для выборки самых дорогих SELECT-запросов с лимитом времени в свойствах сессии и попадает в сводку.
+    """
+    profile = parse_explain_analyze(EXPLAIN_ANALYZE_OUTPUT)
+
+    hot = profile.operators[0]
+    assert [op.name for op in profile.operators] == ["ScanFilterProject", "Aggregate"]
+    assert (hot.fragment, hot.table, hot.cpu_ms, hot.wall_ms) == ("1", "quests.public.h_author", 2000, 2850)
+    assert (hot.input_rows, hot.input_bytes, hot.output_rows) == (1500000, 40 * 1024 ** 2, 1000)
+    assert profile.total_cpu_ms == 2100
+
+    monkeypatch.setattr(settings, "EXPLAIN_ANALYZE_ENABLED", True)
+    monkeypatch.setattr(settings, "EXPLAIN_ANALYZE_SAMPLE_SIZE", 1)
+    monkeypatch.setattr(settings, "EXPLAIN_ANALYZE_TIMEOUT_SECONDS", 60)
+    fake_connector.cursor.fetchall.return_value = [(EXPLAIN_ANALYZE_OUTPUT,)]
+    analyzer = AnalysisModule(connector=fake_connector)
+
+    report = analyzer.perform_global_analysis(TaskRequest(**TASK_REQUEST))
+
+    analyzed = [call.args[0] for call in fake_connector.cursor.execute.call_args_list
+                if call.args[0].startswith("EXPLAIN ANALYZE")]
+    assert analyzed == [f"EXPLAIN ANALYZE {report.top_cost_queries[0].sql}"]
+    fake_connector.connection.assert_any_call(session_properties={"query_max_run_time": "60s"},
+                                              request_timeout=70)
+    assert report.top_cost_queries[0].runtime_profile.operators[0].name == "ScanFilterProject"
+    assert all(q.runtime_profile is None for q in report.top_cost_queries[1:])
+    assert "ScanFilterProject on 'quests.public.h_author' takes 95% of CPU time" in report.analysis_summary
+
+
+def test_analysis_stages_are_traced_and_counted(fake_connector, monkeypatch):
+    """
+    Тест 17: Этапы profile, prioritize и detect попадают в гистограмму длительностей,
+    а EXPLAIN-ы профилирования — в счетчик с разделением на успешные и упавшие.
+    """
+    monkeypatch.setattr(settings, "EXPLAIN_MODE", "always")
+    monkeypatch.setattr(settings, "LAZY_PROFILING", False)
+
+    def sample(name, labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    stages = ("profile", "prioritize", "detect")
+    stage_counts = {stage: sample("optimizer_stage_duration_seconds_count", {"stage": stage, "status": "ok"})
+                    for stage in stages}
+    explains_ok = sample("optimizer_explain_calls_total", {"kind": "profile", "status": "ok"})
+
+    AnalysisModule(connector=fake_connector).perform_global_analysis(TaskRequest(**TASK_REQUEST))
+
+    for stage in stages:
+        assert sample("optimizer_stage_duration_seconds_count", {"stage": stage, "status": "ok"}) \
+               == stage_counts[stage] + 1
+    # Запрос broken не разбирается, поэтому до EXPLAIN доходят только три запроса
+    assert sample("optimizer_explain_calls_total", {"kind": "profile", "status": "ok"}) == explains_ok + 3
+
+
+def test_local_validation_ignores_identifier_quoting_and_case():
+    """
+    Тест 18: Таблицы и колонки из DDL в кавычках или в смешанном регистре находятся по обычным именам,
+    а неизвестные колонки таких таблиц по-прежнему отсекаются.
+    """
+    migration = [{"statement": "INSERT INTO quests.optimized.t SELECT a.id FROM quests.public.h_author a"}]
+    query = [{"queryid": "q1", "query": "SELECT Id FROM Quests.Optimized.T"}]
+    for source_ddl in ('CREATE TABLE "quests"."public"."h_author" (id int, Name varchar)',
+                       "CREATE TABLE Quests.Public.H_Author (ID int, Name varchar)"):
+        validator = StaticSQLValidator([source_ddl])
+        ddl = [{"statement": 'CREATE TABLE "Quests".Optimized."T" (id int)'}]
+
+        assert validator.validate(ddl, migration, query) == (True, "", "")
+        assert validator.validate([], [], [{"query": "SELECT name FROM quests.public.h_author"}])[0]
+        is_valid, error_msg, _ = validator.validate([], [], [{"query": "SELECT nme FROM quests.public.h_author"}])
+        assert not is_valid and "nme" in error_msg
+        is_valid, error_msg, _ = validator.validate([], [], [{"query": "SELECT id FROM quests.public.other"}])
+        assert not is_valid and "quests.public.other" in error_msg
+
+
+def test_template_aggregation_memory_does_not_grow_with_workload(monkeypatch):
+    """
+    Тест 19: Шаблоны агрегируются по мере чтения потока: пиковая память не растет с числом запросов,
+    список идентификаторов шаблона ограничен, а полный размер группы хранится в query_count.
+    """
+    # Отпечаток упрощен, чтобы замер касался только агрегации, а не кэша разбора SQL
+    monkeypatch.setattr("optimizer_service.data_analyzer.deduplication.query_fingerprint",
+                        lambda sql: re.sub(r"\d+", "?", sql))
+
+    def workload(size):
+        for i in range(size):
+            yield QueryStatement(queryid=f"query-{i:08d}", runquantity=1 + i % 7, executiontime=1 + i % 3,
+                                 query=f"SELECT name FROM quests.public.{'abcde'[i % 5]} WHERE id = {i} AND note = '{'x' * 200}'")
+
+    def peak_memory(size):
+        tracemalloc.start()
+        try:
+            templates = build_query_templates(workload(size), queryids_limit=10)
+            return tracemalloc.get_traced_memory()[1], templates
+        finally:
+            tracemalloc.stop()
+
+    small_peak, _ = peak_memory(5_000)
+    large_peak, templates = peak_memory(100_000)
+
+    assert len(templates) == 5
+    assert sum(t.query_count for t in templates) == 100_000
+    assert all(len(t.queryids) == 10 for t in templates)
+    assert sum(t.runquantity for t in templates) == sum(1 + i % 7 for i in range(100_000))
+    assert large_peak < small_peak * 2
+
+
+def test_scan_cost_detector_uses_plan_cost_vectors(fake_connector, monkeypatch):
+    """
+    Тест 20: Детектор стоимости чтения находит таблицу, на которую по векторам стоимости плана приходится
+    основной объем чтения, предлагает партиционирование по колонкам фильтра и пропускает малые объемы.
+    """
+    small_sql = "SELECT id FROM quests.public.small"
+    wide_sql = "SELECT col_1 FROM quests.public.wide WHERE dt > DATE '2024-01-01'"
+    plans = {small_sql: _scan_plan("quests.public.small", 1e3), wide_sql: _scan_plan("quests.public.wide", 5e9)}
+    detector = TableScanCostDetector()
+    analyzer = AnalysisModule(connector=fake_connector, detectors=[detector])
+    monkeypatch.setattr(analyzer, "_explain", lambda parsed, ddl_map: plans[parsed.sql])
+    queries = [
+        QueryStatement(queryid="slow_small", query=small_sql, runquantity=100, executiontime=100),
+        QueryStatement(queryid="fast_wide", query=wide_sql, runquantity=10, executiontime=1),
+    ]
+    profiled = analyzer._profile_queries(build_query_templates(queries), {})
+
+    detections = detector.run(profiled, {})
+
+    assert [d.pattern_name for d in detections] == ["Dominant Table Scan"]
+    assert [q.queryid for q in detections[0].queries] == ["fast_wide"]
+    assert "Table 'quests.public.wide' accounts for 100%" in detections[0].message
+    assert "partitioned by the filter columns 'dt'" in detections[0].message
+
+    small_only = [q for q in profiled if q.queryid == "slow_small"]
+    assert detector.run(small_only, {}) == []
+
+
+def test_scan_cost_detector_reports_measured_hot_scans(fake_connector, monkeypatch):
+    """
+    Тест 21: Детектор запрашивает профиль EXPLAIN ANALYZE и, если он есть, подкрепляет оценку плана
+    измеренной долей CPU операторов чтения таблицы и долей строк, прошедших фильтр.
+    """
+    sql = "SELECT name, count(*) FROM quests.public.h_author WHERE dt > DATE '2024-01-01' GROUP BY name"
+    detector = TableScanCostDetector()
+    analyzer = AnalysisModule(connector=fake_connector, detectors=[detector])
+    monkeypatch.setattr(analyzer, "_explain", lambda parsed, ddl_map: _scan_plan("quests.public.h_author", 5e9))
+    profiled = analyzer._profile_queries(build_query_templates(
+        [QueryStatement(queryid="q1", query=sql, runquantity=1, executiontime=10)]), {})
+
+    assert DetectorInput.RUNTIME_PROFILE in detector.required_inputs
+    assert "Measured by EXPLAIN ANALYZE" not in detector.run(profiled, {})[0].message
+
+    profiled[0].runtime_profile = parse_explain_analyze(EXPLAIN_ANALYZE_OUTPUT)
+    message = detector.run(profiled, {})[0].message
+
+    assert ("Measured by EXPLAIN ANALYZE: reading 'quests.public.h_author' takes 95% of CPU time "
+            "of the profiled queries and keeps 0.07% of 1500000 input rows after filtering.") in message
+
+
+def test_detector_budget_counts_from_start_and_orphans_are_counted():
+    """
+    Тест 22: Бюджет времени отсчитывается с запуска детектора, а не с постановки в очередь, а поток
+    детектора, превысившего бюджет, учитывается в метрике и не занимает пул следующего запуска.
+    """
+    class SteadyDetector(BasePatternDetector):
+        def run(self, queries, ddl_map, stats=None):
+            time.sleep(0.2)
+            return []
+
+    class HangingDetector(BasePatternDetector):
+        def run(self, queries, ddl_map, stats=None):
+            time.sleep(1)
+            return []
+
+    runner = DetectorRunner(max_workers=1, time_budget_seconds=0.3)
+    _, run_stats = runner.run([SteadyDetector(), SteadyDetector()], [], {})
+
+    assert [s.status for s in run_stats] == ["ok", "ok"]
+
+    def orphaned():
+        return REGISTRY.get_sample_value("optimizer_detector_orphaned_threads_total",
+                                         {"detector": "HangingDetector"}) or 0.0
+
+    before = orphaned()
+    _, run_stats = runner.run([HangingDetector()], [], {})
+    assert [s.status for s in run_stats] == ["timeout"]
+    assert orphaned() == before + 1
+
+    started_at = time.monotonic()
+    _, run_stats = runner.run([SteadyDetector()], [], {})
+    assert [s.status for s in run_stats] == ["ok"]
+    assert time.monotonic() - started_at < 0.5
+
+
+def test_fingerprint_keeps_ordinals_and_row_limits():
+    """
+    Тест 23: Номера колонок в GROUP BY/ORDER BY и значения LIMIT/OFFSET не заменяются плейсхолдерами:
+    такие запросы дают разные шаблоны, а отличающиеся только фильтром сливаются.
+    """
+    base = "SELECT name, dt, count(*) FROM quests.public.h_author WHERE id = {id} GROUP BY {group} ORDER BY {order}"
+    variants = [
+        base.format(id=1, group="1, 2", order=1),
+        base.format(id=1, group="1, 2", order=2),
+        base.format(id=1, group="2, 1", order=1),
+        base.format(id=1, group="1, 2", order=1) + " LIMIT 10",
+        base.format(id=1, group="1, 2", order=1) + " LIMIT 1000",
+        base.format(id=1, group="1, 2", order=1) + " OFFSET 10 LIMIT 10",
+    ]
+
+    assert len({query_fingerprint(sql) for sql in variants}) == len(variants)
+    assert query_fingerprint(base.format(id=1, group="1, 2", order=1) + " LIMIT 10") \
+           == query_fingerprint(base.format(id=42, group="1, 2", order=1) + " LIMIT 10")
+
+
+def test_local_validation_checks_query_only_answers(fake_connector):
+    """
+    Тест 24: Ответ без новых таблиц и миграций тоже проверяется локально: запрос с неизвестной колонкой
+    отклоняется до обращения к Trino.
+    """
+    analyzer = AnalysisModule(connector=fake_connector)
+    source_ddl = [ddl["statement"] for ddl in TASK_REQUEST["ddl"]]
+    query = "SELECT a.nme FROM quests.public.h_author a WHERE a.dt > DATE '2024-01-01'"
+
+    is_valid, error_msg, failing_sql = analyzer.validate_sql_list(
+        [], [], [{"queryid": "q1", "query": query}], source_ddl=source_ddl)
+
+    assert not is_valid
+    assert "nme" in error_msg
+    assert failing_sql == query
+    fake_connector.cursor.execute.assert_not_called()
+
+
+def test_query_only_answers_are_explained_against_source_schema(fake_connector):
+    """
+    Тест 25: Ответ только из запросов проверяется EXPLAIN-ом каждого запроса по исходной схеме
+    (ошибка Trino делает ответ невалидным), а ответ без итоговых запросов не считается валидным.
+    """
+    analyzer = AnalysisModule(connector=fake_connector)
+    queries = [
+        {"queryid": "q1", "query": "SELECT a.name FROM quests.public.h_author a JOIN quests.public.l_book_author l "
+                                   "ON a.id = l.author_id"},
+        {"queryid": "q2", "query": "SELECT nme FROM quests.public.authors"},
+    ]
+
+    is_valid, _, _ = analyzer.validate_sql_list([], [], queries)
+
+    assert is_valid
+    assert [call.args[0] for call in fake_connector.cursor.execute.call_args_list] == [
+        f"EXPLAIN {parse_query(q['query']).ast.sql(dialect='trino')}" for q in queries]
+
+    def fail_on_missing_table(sql):
+        if "quests.public.authors" in sql:
+            raise ValueError("Table 'quests.public.authors' does not exist")
+
+    fake_connector.cursor.execute.side_effect = fail_on_missing_table
+    is_valid, error_msg, failing_sql = analyzer.validate_sql_list([], [], queries)
+
+    assert not is_valid
+    assert "does not exist" in error_msg
+    assert failing_sql == queries[1]["query"]
+
+    assert analyzer.validate_sql_list([{"statement": "CREATE TABLE quests.optimized.t (id int)"}], [], []) == \
+           (False, "Ответ LLM не содержит итоговых запросов", "")
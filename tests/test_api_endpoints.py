@@ -1,7 +1,19 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+
+import fakeredis
 import pytest
+import redis
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
 
+from optimizer_service.core.config import settings
+from optimizer_service.core.observability import span
+from optimizer_service.core.staging import workload_staging
+from optimizer_service.core.task_dedup import TaskDeduplicator, task_deduplicator
 from optimizer_service.main import app
 
 client = TestClient(app)
@@ -26,13 +38,14 @@ def mock_celery_task():
     Эта фикстура "мокает" нашу Celery-задачу.
     Вместо реального запуска она возвращает mock-объект, которым мы можем управлять.
     """
-    with patch("optimizer_service.api.endpoints.run_optimization_task.delay") as mock_delay:
+    with patch("optimizer_service.api.endpoints.run_optimization_task.apply_async") as mock_apply, \
+            patch.object(task_deduplicator, "_client", fakeredis.FakeRedis()):
         mock_async_result = MagicMock()
         mock_async_result.id = "test-task-id-12345"
 
-        mock_delay.return_value = mock_async_result
+        mock_apply.return_value = mock_async_result
 
-        yield mock_delay
+        yield mock_apply
 
 
 @pytest.fixture
@@ -124,4 +137,181 @@ def test_get_result_endpoint_not_ready(mock_async_result):
     response = client.get("/api/getresult", params={"task_id": "some-task-id"})
 
     assert response.status_code == 200
-    assert "error" in response.json()
\ No newline at end of file
+    assert "error" in response.json()
+
+@pytest.fixture
+def staged_redis():
+    """
+    Эта фикстура подменяет Redis промежуточного хранилища нагрузок in-memory реализацией.
+    """
+    fake_client = fakeredis.FakeRedis()
+    with patch.object(workload_staging, "_client", fake_client):
+        yield fake_client
+
+
+def test_create_streamed_task_endpoint(staged_redis):
+    """
+    Тест 6: Проверяем, что /new/stream принимает сжатый NDJSON и передает в Celery только ссылку на нагрузку.
+    """
+    print("--- Тестируем POST /api/new/stream ---")
+
+    header = {"url": VALID_TASK_REQUEST["url"], "ddl": VALID_TASK_REQUEST["ddl"]}
+    lines = [json.dumps(header)] + [
+        json.dumps({"queryid": f"q{i}", "query": "SELECT 1", "runquantity": i}) for i in range(2500)
+    ]
+    body = gzip.compress("\n".join(lines).encode("utf-8"))
+
+    with patch("optimizer_service.api.endpoints.run_staged_optimization_task.delay") as mock_delay:
+        mock_delay.return_value = MagicMock(id="staged-task-id")
+        response = client.post("/api/new/stream", content=body, headers={"Content-Encoding": "gzip"})
+
+    assert response.status_code == 202
+    assert response.json()["taskid"] == "staged-task-id"
+
+    workload_id = mock_delay.call_args.args[0]
+    staged = workload_staging.load(workload_id)
+    assert staged.url == VALID_TASK_REQUEST["url"]
+    assert [q.queryid for q in staged.queries] == [f"q{i}" for i in range(2500)]
+
+
+def test_create_streamed_task_rejects_invalid_record(staged_redis):
+    """
+    Тест 7: Невалидная запись (в том числе JSON, не являющийся объектом) отклоняется с номером строки,
+    а уже сохраненные данные удаляются.
+    """
+    print("--- Тестируем POST /api/new/stream (невалидная строка) ---")
+
+    header = {"url": VALID_TASK_REQUEST["url"], "ddl": []}
+    body = "\n".join([json.dumps(header), json.dumps({"queryid": "q1"})])
+
+    response = client.post("/api/new/stream", content=body)
+
+    assert response.status_code == 422
+    assert "строка 2" in response.json()["detail"]
+    assert staged_redis.keys("workload:*") == []
+
+    for not_an_object in ("[1, 2]", '"x"', "42"):
+        response = client.post("/api/new/stream", content="\n".join([json.dumps(header), not_an_object]))
+
+        assert response.status_code == 422
+        assert "строка 2" in response.json()["detail"]
+        assert "ожидался JSON-объект" in response.json()["detail"]
+        assert staged_redis.keys("workload:*") == []
+
+    response = client.post("/api/new/stream", content="[1, 2]")
+    assert response.status_code == 422
+    assert "строка 1" in response.json()["detail"]
+
+
+def test_create_task_coalesces_identical_requests(mock_celery_task):
+    """
+    Тест 8: Идентичная задача не ставится в очередь повторно, а готовый результат отдается сразу.
+    """
+    print("--- Тестируем POST /api/new (повторная отправка) ---")
+
+    reformatted_request = dict(VALID_TASK_REQUEST, queries=[
+        dict(VALID_TASK_REQUEST["queries"][0], query="select *\n  from QUESTS.PUBLIC.H_AUTHOR")
+    ])
+
+    first = client.post("/api/new", json=VALID_TASK_REQUEST).json()
+    second = client.post("/api/new", json=reformatted_request).json()
+
+    assert first == {"taskid": "test-task-id-12345"}
+    assert mock_celery_task.call_count == 1
+    task_id = mock_celery_task.call_args.kwargs["task_id"]
+    assert second == {"taskid": task_id}
+
+    task_deduplicator.complete(mock_celery_task.call_args.kwargs["kwargs"]["digest"], task_id, IDEAL_RESULT_PAYLOAD)
+    third = client.post("/api/new", json=VALID_TASK_REQUEST).json()
+
+    assert mock_celery_task.call_count == 1
+    assert third == {"taskid": task_id, "result": IDEAL_RESULT_PAYLOAD}
+
+
+def test_metrics_endpoint_exposes_stage_durations():
+    """
+    Тест 9: /metrics отдает метрики в формате Prometheus, включая длительности этапов трассы.
+    """
+    print("--- Тестируем GET /metrics ---")
+
+    with span("prompt_build"):
+        pass
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'optimizer_stage_duration_seconds_count{stage="prompt_build",status="ok"}' in response.text
+    assert "# TYPE optimizer_explain_calls_total counter" in response.text
+
+
+def test_failed_enqueue_releases_task_digest(mock_celery_task):
+    """
+    Тест 10: Если брокер недоступен, отпечаток задачи освобождается и повторная отправка ставит новую задачу.
+    """
+    print("--- Тестируем POST /api/new (брокер недоступен) ---")
+
+    mock_celery_task.side_effect = ConnectionError("broker is down")
+    with pytest.raises(ConnectionError):
+        client.post("/api/new", json=VALID_TASK_REQUEST)
+    failed_task_id = mock_celery_task.call_args.kwargs["task_id"]
+
+    mock_celery_task.side_effect = None
+    response = client.post("/api/new", json=VALID_TASK_REQUEST)
+
+    assert response.status_code == 202
+    assert mock_celery_task.call_count == 2
+    assert mock_celery_task.call_args.kwargs["task_id"] != failed_task_id
+
+
+def test_metrics_endpoint_collects_worker_processes(tmp_path, monkeypatch):
+    """
+    Тест 11: Этапы, записанные процессом воркера в свой каталог мультипроцессного режима,
+    видны на /metrics API, которому этот каталог указан в METRICS_COLLECT_DIRS.
+    """
+    print("--- Тестируем GET /metrics (метрики воркера) ---")
+
+    worker_dir = tmp_path / "worker"
+    script = ("from optimizer_service.core.observability import span\n"
+              "with span('detect'):\n"
+              "    pass\n")
+    subprocess.run([sys.executable, "-c", script], check=True,
+                   env=dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(worker_dir)))
+    monkeypatch.setattr(settings, "METRICS_COLLECT_DIRS", f"{tmp_path / 'api'},{worker_dir}")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'optimizer_stage_duration_seconds_count{stage="detect",status="ok"} 1.0' in response.text
+
+
+def test_release_keeps_marker_of_another_owner():
+    """
+    Тест 12: Снятие отметки не удаляет ее, если отпечаток уже принадлежит другой задаче,
+    в том числе когда новая задача заняла его между сравнением и удалением.
+    """
+    print("--- Тестируем снятие отметки о выполнении задачи ---")
+    server = fakeredis.FakeServer()
+    deduplicator = TaskDeduplicator(client=fakeredis.FakeRedis(server=server))
+    other_client = fakeredis.FakeRedis(server=server)
+    key = "task-digest:digest:inflight"
+
+    assert deduplicator.claim("digest", "new-owner") is None
+    deduplicator.release("digest", "old-owner")
+    assert other_client.get(key) == b"new-owner"
+
+    other_client.set(key, "old-owner")
+    original_get = redis.client.Pipeline.get
+
+    def get_then_reclaim(pipe, name):
+        value = original_get(pipe, name)
+        # Отметка истекла и ее заняла новая задача сразу после сравнения
+        other_client.set(key, "new-owner")
+        return value
+
+    with patch.object(redis.client.Pipeline, "get", get_then_reclaim):
+        deduplicator.release("digest", "old-owner")
+    assert other_client.get(key) == b"new-owner"
+
+    deduplicator.release("digest", "new-owner")
+    assert other_client.get(key) is None
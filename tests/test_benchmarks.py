@@ -0,0 +1,88 @@
+import pytest
+
+from benchmarks.analysis_benchmark import CannedTrinoConnector, compare, generate_workload
+from benchmarks.optimization_benchmark import DuckDBEngine, build_report, percentile, run_benchmark
+from optimizer_service.data_analyzer.analysis_module import AnalysisModule
+from optimizer_service.models.schemas import OptimizationResult, TaskRequest
+
+TASK = TaskRequest(
+    url="jdbc:trino://fake-host:443",
+    ddl=[
+        {"statement": "CREATE TABLE quests.public.h_author (id int, name varchar, dt date) "
+                      "WITH (format = 'PARQUET')"},
+        {"statement": "CREATE TABLE quests.public.l_book_author (book_id int, author_id int)"},
+    ],
+    queries=[{"queryid": "q1", "runquantity": 10, "executiontime": 5,
+              "query": "SELECT a.name, count(*) FROM quests.public.h_author a "
+                       "JOIN quests.public.l_book_author l ON a.id = l.author_id GROUP BY a.name"}],
+)
+
+RESULT = OptimizationResult(
+    ddl=[{"statement": "CREATE SCHEMA quests.optimized"},
+         {"statement": "CREATE TABLE quests.optimized.author_books (name varchar, books bigint)"}],
+    migrations=[{"statement": "INSERT INTO quests.optimized.author_books SELECT a.name, count(*) "
+                              "FROM quests.public.h_author a JOIN quests.public.l_book_author l "
+                              "ON a.id = l.author_id GROUP BY a.name"}],
+    queries=[{"queryid": "q1", "query": "SELECT name, books FROM quests.optimized.author_books"},
+             {"queryid": "unknown", "query": "SELECT 1"}],
+)
+
+
+def test_percentile_nearest_rank():
+    """
+    Тест 1: Перцентили считаются методом ближайшего ранга.
+    """
+    values = [float(v) for v in range(1, 101)]
+    assert (percentile(values, 50), percentile(values, 95), percentile(values, 99)) == (50, 95, 99)
+    assert percentile([], 50) is None
+
+
+def test_before_after_benchmark_on_duckdb():
+    """
+    Тест 2: Офлайн-замер в DuckDB: DDL и запросы транспилируются, результат применяется,
+    по каждому queryid есть перцентили исходного и переписанного запроса и ускорение.
+    """
+    pytest.importorskip("duckdb")
+    engine = DuckDBEngine(rows=500)
+    try:
+        report = build_report(run_benchmark(engine, TASK, RESULT, repeat=3, warmup=1))
+    finally:
+        engine.close()
+
+    q1, unknown = report
+    assert q1["error"] is None
+    assert q1["baseline"]["runs"] == q1["optimized"]["runs"] == 3
+    assert q1["baseline"]["p50_ms"] > 0 and q1["optimized"]["cpu_ms"] is not None
+    assert q1["speedup"] > 0
+    assert unknown["error"] and unknown["speedup"] is None
+
+
+def test_synthetic_workload_is_analyzed_offline():
+    """
+    Тест 3: Синтетическая нагрузка воспроизводима по seed, содержит все заложенные формы запросов
+    и повторы шаблонов, а конвейер анализа проходит по ней с заглушкой Trino.
+    """
+    task = generate_workload(300, seed=7)
+    assert task == generate_workload(300, seed=7)
+    sqls = [q.query for q in task.queries]
+    for marker in ("CROSS JOIN", "HAVING name =", "SELECT * FROM quests.public.wide_", "JOIN quests.public.l_"):
+        assert any(marker in sql for sql in sqls)
+
+    report = AnalysisModule(connector=CannedTrinoConnector()).perform_global_analysis(task)
+
+    assert len(report.top_cost_queries) == 5
+    assert sum(len(q.queryids) for q in report.top_cost_queries) > 5
+    assert report.top_detection is not None
+    assert all(s.status == "ok" for s in report.detector_stats)
+
+
+def test_compare_flags_throughput_and_memory_regressions():
+    """
+    Тест 4: Падение пропускной способности или рост памяти сверх допуска считаются регрессией.
+    """
+    baseline = {"100": {"perform_global_analysis": {"seconds": 1.0, "throughput": 100.0, "peak_mb": 10.0}}}
+    within = {"100": {"perform_global_analysis": {"seconds": 1.05, "throughput": 95.0, "peak_mb": 10.5}}}
+    worse = {"100": {"perform_global_analysis": {"seconds": 2.0, "throughput": 50.0, "peak_mb": 20.0}}}
+
+    assert compare(within, baseline, tolerance=0.1) == []
+    assert len(compare(worse, baseline, tolerance=0.1)) == 2
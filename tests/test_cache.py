@@ -0,0 +1,85 @@
+from unittest.mock import MagicMock
+
+import fakeredis
+import pytest
+
+from optimizer_service.agent.optimization_agent import OptimizationAgent
+from optimizer_service.core.cache import RedisCache
+from optimizer_service.core.config import settings
+from optimizer_service.data_analyzer.analysis_module import AnalysisModule
+from optimizer_service.data_analyzer.explain_cache import ExplainPlanCache
+from optimizer_service.llm import BaseLLMProvider, CachingLLMProvider
+from optimizer_service.models.schemas import TaskRequest
+from tests.test_analysis_module import TASK_REQUEST
+
+
+@pytest.fixture
+def redis_client():
+    """
+    Эта фикстура поднимает in-memory Redis, чтобы кэши можно было тестировать без сервера.
+    """
+    return fakeredis.FakeRedis()
+
+
+def test_cache_evicts_least_recently_used(redis_client):
+    """
+    Тест 1: При превышении max_entries вытесняется самая давно использованная запись.
+    """
+    cache = RedisCache(namespace="test", ttl_seconds=60, max_entries=2, client=redis_client)
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}
+
+    cache.set("c", {"v": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+    assert cache.get("c") == {"v": 3}
+    assert cache.stats() == {"hits": 3, "misses": 1, "evictions": 1}
+
+
+def test_explain_cache_skips_trino_on_repeat(fake_connector, redis_client, monkeypatch):
+    """
+    Тест 2: Повторная отправка того же набора запросов обслуживается из кэша без EXPLAIN в Trino.
+    """
+    monkeypatch.setattr(settings, "EXPLAIN_MODE", "always")
+    fake_connector.target = "fake-host:443/quests/public"
+    explain_cache = ExplainPlanCache(cache=RedisCache(
+        namespace="explain-plan", ttl_seconds=60, max_entries=100, client=redis_client))
+    analyzer = AnalysisModule(connector=fake_connector, explain_cache=explain_cache)
+
+    first = analyzer._profile_all_queries(TaskRequest(**TASK_REQUEST))
+    calls_after_first_run = fake_connector.cursor.execute.call_count
+    second = analyzer._profile_all_queries(TaskRequest(**TASK_REQUEST))
+
+    assert fake_connector.cursor.execute.call_count == calls_after_first_run
+    assert [q.explain_plan for q in first] == [q.explain_plan for q in second]
+    assert explain_cache.stats()["hits"] == len(second)
+
+
+def test_llm_cache_stores_only_validated_responses(redis_client, monkeypatch):
+    """
+    Тест 3: Ответ LLM кэшируется только после валидации, и повторная отправка не обращается к модели.
+    """
+    provider = MagicMock(spec=BaseLLMProvider)
+    provider.cache_identity.return_value = {"provider": "Fake", "model": "m"}
+    provider.supports_streaming = False
+    provider.get_completion.side_effect = [{"ddl": ["bad"]}, {"ddl": ["good"]}]
+    cached_provider = CachingLLMProvider(provider, cache=RedisCache(
+        namespace="llm-response", ttl_seconds=60, max_entries=100, client=redis_client))
+
+    analyzer = MagicMock()
+    analyzer.validate_sql_list.side_effect = [(False, "syntax error", "bad"), (True, None, None)]
+    agent = OptimizationAgent(llm_provider=cached_provider, analyzer=analyzer)
+    monkeypatch.setattr(agent, "_build_pattern_prompt", lambda *args: "PROMPT")
+    monkeypatch.setattr("optimizer_service.agent.optimization_agent.time.sleep", lambda _: None)
+    monkeypatch.setattr("optimizer_service.agent.optimization_agent.pattern_dispatcher.get_pattern",
+                        lambda name: {"solution_template": {}})
+
+    first = agent.run_global_optimization(TaskRequest(**TASK_REQUEST))
+    second = agent.run_global_optimization(TaskRequest(**TASK_REQUEST))
+
+    assert first == second == {"ddl": ["good"]}
+    assert provider.get_completion.call_count == 2
+    assert analyzer.validate_sql_list.call_count == 2
+    assert cached_provider.get_cached_completion("OTHER PROMPT") is None
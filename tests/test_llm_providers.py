@@ -0,0 +1,291 @@
+import asyncio
+import json
+import time
+from unittest.mock import MagicMock
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+from optimizer_service.agent.optimization_agent import OptimizationAgent
+from optimizer_service.core.config import settings
+from optimizer_service.core.observability import current_span, span
+from optimizer_service.data_analyzer.analysis_module import AnalysisModule
+from optimizer_service.llm import AsyncLLMProvider, LlamaCppProvider
+from optimizer_service.llm.async_runtime import run_sync
+from optimizer_service.llm.streaming_json import IncrementalJSONParser, MalformedLLMOutput
+from optimizer_service.llm.output_schema import optimization_json_schema
+from optimizer_service.models.schemas import TaskRequest, GeneratedOptimization, OptimizationResult
+from optimizer_service.patterns.dispatcher import pattern_dispatcher
+from tests.test_analysis_module import TASK_REQUEST
+
+GUIDED_RESPONSE = {
+    "ddl": [{"statement": "CREATE TABLE quests.optimized.t (id int)"}],
+    "migrations": [{"statement": "INSERT INTO quests.optimized.t SELECT id FROM quests.public.h_author"}],
+    "queries": [{"queryid": "q1", "query": "SELECT id FROM quests.optimized.t"}],
+}
+
+
+@pytest.fixture
+def llama_server(monkeypatch):
+    """
+    Эта фикстура подменяет HTTP-пул провайдеров клиентом с фейковым сервером llama-cpp.
+    Сервер отвечает JSON-объектом с промптом и считает полученные запросы.
+    """
+    received = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        prompt = json.loads(request.content)["prompt"]
+        received.append(prompt)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"content": f'```json\n{{"prompt": "{prompt}"}}\n```'})
+
+    monkeypatch.setattr("optimizer_service.llm.llama_cpp_provider.get_http_client",
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return received
+
+
+def test_async_completions_run_concurrently(llama_server):
+    """
+    Тест 1: Много генераций выполняются одновременно в одном цикле событий, без потока на каждый запрос.
+    """
+    provider = LlamaCppProvider(host="fake", port=1)
+
+    async def generate_all():
+        return await asyncio.gather(*(provider.aget_completion(f"p{i}") for i in range(20)))
+
+    loop = asyncio.new_event_loop()
+    try:
+        started_at = loop.time()
+        responses = loop.run_until_complete(generate_all())
+        elapsed = loop.time() - started_at
+    finally:
+        loop.close()
+
+    assert responses == [{"prompt": f"p{i}"} for i in range(20)]
+    assert len(llama_server) == 20
+    assert elapsed < 0.05 * 20 / 2
+
+
+def test_sync_adapter_returns_completion(llama_server):
+    """
+    Тест 2: Синхронный get_completion продолжает работать для существующих вызывающих.
+    """
+    provider = LlamaCppProvider(host="fake", port=1)
+
+    assert provider.get_completion("hello") == {"prompt": "hello"}
+    assert llama_server == ["hello"]
+
+
+class ScriptedProvider(AsyncLLMProvider):
+    """Провайдер, возвращающий заранее заданные ответы с заданными задержками."""
+
+    def __init__(self, script):
+        self._script = list(script)
+        self.cancelled = 0
+
+    async def aget_completion(self, prompt: str) -> dict:
+        delay, response = self._script.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return response
+
+
+def test_speculative_generation_returns_first_valid_candidate(monkeypatch):
+    """
+    Тест 3: Варианты валидируются по мере поступления, первый валидный возвращается, остальные отменяются.
+    """
+    monkeypatch.setattr(settings, "LLM_SPECULATIVE_CANDIDATES", 3)
+    provider = ScriptedProvider([
+        (5.0, {"ddl": ["slow"]}),
+        (0.01, {"ddl": ["invalid"]}),
+        (0.05, {"ddl": ["valid"]}),
+    ])
+    analyzer = MagicMock()
+    analyzer.validate_sql_list.side_effect = lambda ddl_statements, **_: (
+        (True, None, None) if ddl_statements == ["valid"] else (False, "syntax error", ddl_statements[0])
+    )
+    agent = OptimizationAgent(llm_provider=provider, analyzer=analyzer)
+    monkeypatch.setattr(agent, "_build_pattern_prompt", lambda *args: "PROMPT")
+    monkeypatch.setattr("optimizer_service.agent.optimization_agent.pattern_dispatcher.get_pattern",
+                        lambda name: {"solution_template": {}})
+
+    started_at = time.monotonic()
+    result = agent.run_global_optimization(TaskRequest(**TASK_REQUEST))
+
+    assert result == {"ddl": ["valid"]}
+    assert time.monotonic() - started_at < 1.0
+    assert analyzer.validate_sql_list.call_count == 2
+    assert provider.cancelled == 1
+
+
+def test_incremental_parser_emits_items_before_response_ends():
+    """
+    Тест 4: Элементы секций отдаются, как только сгенерированы, а несогласованные скобки прерывают разбор.
+    """
+    parser = IncrementalJSONParser()
+
+    events = parser.feed('```json\n{"ddl": [{"statement": "CREATE TABLE t (a int) -- ] }"}, ')
+    assert events == [("ddl", {"statement": "CREATE TABLE t (a int) -- ] }"})]
+    assert parser.feed('{"statement": "CREATE SCHEMA s"}], "migrations": ["INSERT INTO t SELECT 1"') == [
+        ("ddl", {"statement": "CREATE SCHEMA s"})
+    ]
+    assert parser.feed('], "queries": []}\n```') == [("migrations", "INSERT INTO t SELECT 1")]
+    assert parser.result()["queries"] == []
+
+    with pytest.raises(MalformedLLMOutput):
+        IncrementalJSONParser().feed('{"ddl": [{"statement": "x"]')
+
+
+class StreamingProvider(AsyncLLMProvider):
+    """Провайдер, отдающий ответ заранее заданными фрагментами."""
+    supports_streaming = True
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.sent = 0
+        self.closed = False
+
+    async def aget_completion(self, prompt: str) -> dict:
+        raise AssertionError("в потоковом режиме aget_completion не вызывается")
+
+    async def astream_completion(self, prompt: str):
+        try:
+            for chunk in self._chunks:
+                self.sent += 1
+                yield chunk
+        finally:
+            self.closed = True
+
+
+def test_streaming_aborts_on_invalid_ddl(fake_connector, monkeypatch):
+    """
+    Тест 5: Невалидный DDL обнаруживается до окончания генерации, и поток закрывается.
+    """
+    monkeypatch.setattr(settings, "LLM_SPECULATIVE_CANDIDATES", 1)
+    provider = StreamingProvider([
+        '{"ddl": [{"statement": "CREATE TABLE t ("}], ',
+        '"migrations": [{"statement": "INSERT INTO t SELECT 1"}], ',
+        '"queries": [{"queryid": "q1", "query": "SELECT 1"}]}',
+    ])
+    agent = OptimizationAgent(llm_provider=provider, analyzer=AnalysisModule(connector=fake_connector))
+
+    llm_response, (is_valid, error_msg, failing_sql) = run_sync(agent._streamed_candidate("PROMPT", []))
+
+    assert llm_response is None
+    assert not is_valid
+    assert failing_sql == "CREATE TABLE t ("
+    assert provider.sent == 1
+    assert provider.closed
+
+
+def test_llama_cpp_sends_json_schema_for_guided_decoding(monkeypatch):
+    """
+    Тест 6: Схема ответа уходит в llama.cpp, и ответ по этой схеме совместим с OptimizationResult.
+    """
+    payloads = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payloads.append(json.loads(request.content))
+        return httpx.Response(200, json={"content": json.dumps(GUIDED_RESPONSE)})
+
+    monkeypatch.setattr("optimizer_service.llm.llama_cpp_provider.get_http_client",
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    provider = LlamaCppProvider(host="fake", port=1, guided_decoding=True)
+
+    response = provider.get_completion("PROMPT")
+
+    schema = payloads[0]["json_schema"]
+    assert schema["required"] == ["ddl", "migrations", "queries"]
+    assert "response_format" not in payloads[0]
+    assert OptimizationResult(**GeneratedOptimization(**response).model_dump()).queries[0]["queryid"] == "q1"
+
+
+def test_llm_tokens_and_latency_are_recorded_within_trace(monkeypatch):
+    """
+    Тест 7: Число токенов из ответа llama.cpp и длительность запроса попадают в метрики,
+    а этап трассы вызывающего потока виден внутри корутины фонового цикла.
+    """
+    seen_traces = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"content": json.dumps(GUIDED_RESPONSE),
+                                         "tokens_evaluated": 120, "tokens_predicted": 30})
+
+    monkeypatch.setattr("optimizer_service.llm.llama_cpp_provider.get_http_client",
+                        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    provider = LlamaCppProvider(host="fake", port=1)
+
+    def sample(name, labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    prompt_tokens = sample("optimizer_llm_tokens_total", {"provider": "llama_cpp", "kind": "prompt"})
+    completion_tokens = sample("optimizer_llm_tokens_total", {"provider": "llama_cpp", "kind": "completion"})
+    requests_count = sample("optimizer_llm_request_duration_seconds_count",
+                            {"provider": "llama_cpp", "mode": "single", "status": "ok"})
+
+    async def traced_completion():
+        seen_traces.append(current_span().trace_id)
+        return await provider.aget_completion("PROMPT")
+
+    with span("llm_call", trace_id="trace-1"):
+        assert run_sync(traced_completion()) == GUIDED_RESPONSE
+
+    assert seen_traces == ["trace-1"]
+    assert sample("optimizer_llm_tokens_total", {"provider": "llama_cpp", "kind": "prompt"}) == prompt_tokens + 120
+    assert sample("optimizer_llm_tokens_total", {"provider": "llama_cpp", "kind": "completion"}) \
+           == completion_tokens + 30
+    assert sample("optimizer_llm_request_duration_seconds_count",
+                  {"provider": "llama_cpp", "mode": "single", "status": "ok"}) == requests_count + 1
+
+
+def test_speculative_generation_without_candidates_is_invalid():
+    """
+    Тест 8: Если модель не вернула ни одного варианта, результат невалиден и пригоден для промпта исправления.
+    """
+    agent = OptimizationAgent(llm_provider=ScriptedProvider([]), analyzer=MagicMock())
+
+    llm_response, validation = run_sync(agent._first_valid_candidate("PROMPT", 0, []))
+
+    assert llm_response is None
+    assert validation == (False, "LLM не вернула ни одного ответа", "")
+    correction = OptimizationAgent._build_correction_prompt("PROMPT", llm_response, validation[2], validation[1])
+    assert "LLM не вернула ни одного ответа" in correction[-1]["content"]
+
+
+def test_default_stream_yields_full_completion(monkeypatch):
+    """
+    Тест 9: Провайдер без потоковой генерации отдает полный ответ одним фрагментом,
+    и потоковый путь агента валидирует его как обычный ответ.
+    """
+    provider = ScriptedProvider([(0, GUIDED_RESPONSE)])
+    analyzer = MagicMock()
+    analyzer.precheck_statement.return_value = None
+    analyzer.validate_sql_list.return_value = (True, "", "")
+    agent = OptimizationAgent(llm_provider=provider, analyzer=analyzer)
+
+    llm_response, (is_valid, _, _) = run_sync(agent._streamed_candidate("PROMPT", []))
+
+    assert not provider.supports_streaming
+    assert llm_response == GUIDED_RESPONSE
+    assert is_valid
+    assert analyzer.precheck_statement.call_count == 3
+
+
+def test_guided_schema_accepts_query_only_golden_examples():
+    """
+    Тест 10: Схема ограниченного декодирования допускает пустые ddl и migrations, поэтому эталонные
+    решения, которые только переписывают запросы, соответствуют ей без выдуманных таблиц и миграций.
+    """
+    schema = optimization_json_schema()
+    example = pattern_dispatcher.get_pattern("CrossJoinDetector")["solution_template"]
+
+    assert example["ddl"] == [] and example["migrations"] == []
+    assert sorted(schema["required"]) == sorted(example)
+    for section, items in example.items():
+        assert len(items) >= schema["properties"][section].get("minItems", 0)
+    assert schema["properties"]["queries"]["minItems"] == 1
+    assert GeneratedOptimization.model_validate(example).queries[0].queryid == "{highest_cost_query_id}"
@@ -0,0 +1,126 @@
+from optimizer_service.agent.optimization_agent import OptimizationAgent
+from optimizer_service.agent.prompt_builder import PromptBuilder
+from optimizer_service.models.schemas import GlobalAnalysisReport, ProfiledQuery
+from tests.test_analysis_module import TASK_REQUEST
+
+DDL_STATEMENTS = [ddl["statement"] for ddl in TASK_REQUEST["ddl"]]
+EXAMPLE = {"ddl": [{"statement": "CREATE TABLE table1 (col_a int)"}], "migrations": [], "queries": []}
+
+
+def make_report(*queries) -> GlobalAnalysisReport:
+    return GlobalAnalysisReport(
+        top_cost_queries=[
+            ProfiledQuery(queryid=queryid, sql=sql, run_quantity=1, execution_time=cost, cost=cost)
+            for queryid, sql, cost in queries
+        ],
+        analysis_summary="Cross join detected.",
+    )
+
+
+def test_prompt_is_compressed_and_reported_per_section():
+    """
+    Тест 1: SQL минифицируется, DDL сокращается до используемых колонок, пример сериализуется компактно.
+    """
+    report = make_report(("q2", "SELECT a.name\n    -- автор\n    FROM   quests.public.h_author a\n"
+                                "WHERE a.dt > DATE '2024-01-01'", 500))
+
+    messages, sizes = PromptBuilder(token_budget=10000, chars_per_token=4).build(report, DDL_STATEMENTS, EXAMPLE)
+    prompt = "\n".join(message["content"] for message in messages)
+
+    assert "SQL: SELECT a.name FROM quests.public.h_author AS a WHERE a.dt > CAST('2024-01-01' AS DATE)" in prompt
+    assert "CREATE TABLE quests.public.h_author (name VARCHAR, dt DATE); -- 1 unused columns omitted" in prompt
+    assert "l_book_author" not in prompt
+    assert '{"ddl":[{"statement":"CREATE TABLE table1 (col_a int)"}]' in prompt
+    assert sizes["total"] == sum(sizes[name] for name in (
+        "analysis_summary", "static_prefix", "top_queries_context", "ddl_context", "template"))
+
+
+def test_prompt_drops_cheapest_queries_to_fit_budget():
+    """
+    Тест 2: Если промпт не помещается в бюджет, отбрасываются наименее дорогие запросы, но не самый дорогой.
+    """
+    report = make_report(
+        ("q1", "SELECT a.name FROM quests.public.h_author a CROSS JOIN quests.public.l_book_author l", 1000),
+        ("q3", "SELECT * FROM quests.public.wide", 10),
+    )
+    builder = PromptBuilder(token_budget=10000, chars_per_token=4)
+    _, full_sizes = builder.build(report, DDL_STATEMENTS, EXAMPLE)
+
+    tight_builder = PromptBuilder(token_budget=full_sizes["total"] - 1, chars_per_token=4)
+    messages, sizes = tight_builder.build(report, DDL_STATEMENTS, EXAMPLE)
+    prompt = messages[-1]["content"]
+
+    assert full_sizes["top_n"] == 2
+    assert sizes["top_n"] == 1
+    assert "Query ID: q1" in prompt
+    assert "quests.public.wide" not in prompt
+
+
+def test_static_prefix_is_shared_between_tasks_and_corrections():
+    """
+    Тест 3: Системное сообщение не зависит от задачи, а исправление дописывается в конец диалога.
+    """
+    builder = PromptBuilder(token_budget=10000, chars_per_token=4)
+    first, _ = builder.build(make_report(("q1", "SELECT id FROM quests.public.h_author", 10)), DDL_STATEMENTS, EXAMPLE)
+    second, _ = builder.build(make_report(("q9", "SELECT author_id FROM quests.public.l_book_author", 99)),
+                              DDL_STATEMENTS, EXAMPLE)
+
+    assert first[0] == second[0]
+    assert first[0]["role"] == "system"
+    assert "q1" not in first[0]["content"]
+
+    correction = OptimizationAgent._build_correction_prompt(first, {"ddl": []}, "CREATE TABLE x (", "syntax error")
+
+    assert correction[:2] == first
+    assert [message["role"] for message in correction[2:]] == ["assistant", "user"]
+    assert "syntax error" in correction[-1]["content"]
+
+
+def test_ddl_columns_are_pruned_per_table():
+    """
+    Тест 4: Колонки, упомянутые в запросе, засчитываются своей таблице по алиасу: одноименная колонка
+    другой таблицы из DDL не сохраняется, а колонка без квалификатора засчитывается всем таблицам запроса.
+    """
+    ddl_statements = DDL_STATEMENTS + ["CREATE TABLE quests.public.h_book (id int, name varchar, title varchar)"]
+    report = make_report(("q1", "SELECT a.name, b.title FROM quests.public.h_author a "
+                                "JOIN quests.public.h_book b ON a.id = b.id WHERE dt > DATE '2024-01-01'", 100))
+
+    messages, _ = PromptBuilder(token_budget=10000, chars_per_token=4).build(report, ddl_statements, EXAMPLE)
+    prompt = messages[-1]["content"]
+
+    assert "CREATE TABLE quests.public.h_author (id INTEGER, name VARCHAR, dt DATE);" in prompt
+    assert "CREATE TABLE quests.public.h_book (id INTEGER, title VARCHAR); -- 1 unused columns omitted" in prompt
+
+
+def test_ddl_columns_of_same_named_tables_stay_separate():
+    """
+    Тест 5: Одноименные таблицы из разных схем не делят колонки: каждая сохраняет только свои,
+    на которые запрос ссылается через алиас или полное имя, а регистр имен таблиц не важен.
+    """
+    ddl_statements = [
+        "CREATE TABLE quests.public.orders (id int, amount double, note varchar)",
+        "CREATE TABLE quests.optimized.orders (id int, total double, comment varchar)",
+    ]
+    report = make_report(("q1", "SELECT quests.public.orders.amount, o.total FROM Quests.Public.Orders "
+                                "JOIN quests.optimized.orders o ON quests.public.orders.id = o.id", 100))
+
+    messages, _ = PromptBuilder(token_budget=10000, chars_per_token=4).build(report, ddl_statements, EXAMPLE)
+    prompt = messages[-1]["content"]
+
+    assert "CREATE TABLE quests.public.orders (id INTEGER, amount DOUBLE); -- 1 unused columns omitted" in prompt
+    assert "CREATE TABLE quests.optimized.orders (id INTEGER, total DOUBLE); -- 1 unused columns omitted" in prompt
+
+
+def test_ddl_pruning_keeps_constraints_and_properties():
+    """
+    Тест 6: При сокращении DDL ограничения и свойства таблицы сохраняются вместе с колонками,
+    на которые они ссылаются (ключ, колонки партиционирования); убираются только неиспользуемые колонки.
+    """
+    ddl_statements = ["CREATE TABLE quests.public.orders (id int, amount double, note varchar, dt date, "
+                      "PRIMARY KEY (id)) WITH (partitioned_by = ARRAY['dt'])"]
+    report = make_report(("q1", "SELECT amount FROM quests.public.orders", 100))
+
+    messages, _ = PromptBuilder(token_budget=10000, chars_per_token=4).build(report, ddl_statements, EXAMPLE)
+
+    assert ("CREATE TABLE quests.public.orders (id INTEGER, amount DOUBLE, dt DATE, PRIMARY KEY (id)) "
+            "WITH (PARTITIONED_BY=ARRAY['dt']); -- 1 unused columns omitted") in messages[-1]["content"]